@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from backend.registro import obter_logger
+
+# Fuso que define o "hoje" da energia do dia
+AGREGADOS_FUSO = os.getenv("AGREGADOS_FUSO", "America/Sao_Paulo")
+# O local de um carregador é o trecho do ID antes do separador ("SP01-CP003" -> "SP01")
+AGREGADOS_SEPARADOR_LOCAL = os.getenv("AGREGADOS_SEPARADOR_LOCAL", "-")
+# Segundos entre resumos enviados aos WebSockets (só quando algo mudou); 0 desliga
+AGREGADOS_INTERVALO = float(os.getenv("AGREGADOS_INTERVALO", "1"))
+# Janelas (minutos, até 60) das contagens de sessões iniciadas e finalizadas
+JANELAS_MINUTOS = (5, 15, 60)
+
+TOPICO_RESUMO = "frota/resumo"
+SEM_LOCAL = "sem_local"
+STATUS = ("livre", "ocupado", "offline")
+
+log = obter_logger("agregados")
+
+
+class _Carregador:
+    __slots__ = ("status", "local", "energia", "lida_em", "potencia")
+
+    def __init__(self, local):
+        self.status = None
+        self.local = local
+        self.energia = None  # última energia medida da sessão (kWh)
+        self.lida_em = None
+        self.potencia = 0.0  # kW
+
+
+class _Janela:
+    """Contagem por minuto dos últimos 60 minutos, num buffer circular."""
+
+    def __init__(self):
+        self._minutos = [-1] * 60
+        self._contagens = [0] * 60
+
+    def incrementar(self, agora):
+        minuto = int(agora // 60)
+        i = minuto % 60
+        if self._minutos[i] != minuto:
+            self._minutos[i] = minuto
+            self._contagens[i] = 0
+        self._contagens[i] += 1
+
+    def somar(self, agora, minutos):
+        atual = int(agora // 60)
+        return sum(c for m, c in zip(self._minutos, self._contagens) if atual - minutos < m <= atual)
+
+
+class AgregadosFrota:
+    """
+    Totais da frota mantidos a cada mensagem recebida pela API, em vez de
+    percorrer todos os carregadores a cada consulta: contagem por status (geral
+    e por local), potência instantânea, energia do dia e sessões iniciadas e
+    finalizadas nas últimas janelas. Cada mensagem custa O(1); o resumo custa
+    O(locais).
+
+    A potência de um carregador vem da diferença entre duas leituras do medidor
+    (ou status com energia) e zera no fim da sessão ou quando ele fica
+    livre/offline. A energia do dia soma esses incrementos, então uma sessão
+    que atravessa a meia-noite é dividida entre os dois dias.
+    """
+
+    def __init__(self, fuso=AGREGADOS_FUSO, separador=AGREGADOS_SEPARADOR_LOCAL):
+        try:
+            self.fuso = ZoneInfo(fuso)
+        except (ZoneInfoNotFoundError, ValueError):
+            self.fuso = ZoneInfo("UTC")
+        self.separador = separador
+        self._lock = threading.Lock()
+        self._carregadores: dict[str, _Carregador] = {}
+        self._status = dict.fromkeys(STATUS, 0)
+        self._locais: dict[str, dict] = {}
+        self._potencia = 0.0
+        self._energia_dia = 0.0
+        self._fim_dia = 0.0
+        self._dia = None
+        self._iniciadas = _Janela()
+        self._finalizadas = _Janela()
+        self.versao = 0
+
+    def _local(self, carregador_id):
+        if self.separador and self.separador in carregador_id:
+            return carregador_id.split(self.separador, 1)[0]
+        return SEM_LOCAL
+
+    def _carregador(self, carregador_id):
+        carregador = self._carregadores.get(carregador_id)
+        if carregador is None:
+            carregador = self._carregadores[carregador_id] = _Carregador(self._local(carregador_id))
+            if carregador.local not in self._locais:
+                self._locais[carregador.local] = {**dict.fromkeys(STATUS, 0), "potencia_kW": 0.0}
+        return carregador
+
+    def _definir_potencia(self, carregador, potencia):
+        diferenca = potencia - carregador.potencia
+        if diferenca:
+            carregador.potencia = potencia
+            self._potencia += diferenca
+            self._locais[carregador.local]["potencia_kW"] += diferenca
+
+    def _virar_dia(self, agora):
+        if agora < self._fim_dia:
+            return
+        # Virada do dia no fuso configurado: recomeça a contagem
+        inicio = datetime.fromtimestamp(agora, self.fuso).replace(hour=0, minute=0, second=0, microsecond=0)
+        self._fim_dia = (inicio + timedelta(days=1)).timestamp()
+        if self._dia != inicio.date():
+            self._dia = inicio.date()
+            self._energia_dia = 0.0
+
+    def _somar_energia(self, energia, agora):
+        if energia > 0:
+            self._virar_dia(agora)
+            self._energia_dia += energia
+
+    # --- Atualizações (thread do MQTT) ---
+    # `agora` é o horário de recebimento em segundos desde a época.
+
+    def registrar_status(self, payload, agora):
+        carregador_id = payload.get("carregador")
+        status = payload.get("status")
+        if not carregador_id or status not in STATUS:
+            return
+        with self._lock:
+            carregador = self._carregador(carregador_id)
+            if status != carregador.status:
+                contagem_local = self._locais[carregador.local]
+                if carregador.status is not None:
+                    self._status[carregador.status] -= 1
+                    contagem_local[carregador.status] -= 1
+                self._status[status] += 1
+                contagem_local[status] += 1
+                carregador.status = status
+            if status == "ocupado":
+                self._medir(carregador, payload.get("energia_consumida_kWh"), agora)
+            else:
+                self._definir_potencia(carregador, 0.0)
+                carregador.energia = None
+            self.versao += 1
+
+    def registrar_leitura(self, leitura, agora):
+        carregador_id = leitura.get("carregador")
+        if not carregador_id:
+            return
+        with self._lock:
+            self._medir(self._carregador(carregador_id), leitura.get("energia_consumida_kWh"), agora)
+            self.versao += 1
+
+    def _medir(self, carregador, energia, agora):
+        if energia is None:
+            return
+        anterior, lida_em = carregador.energia, carregador.lida_em
+        if anterior is not None and energia >= anterior:
+            self._somar_energia(energia - anterior, agora)
+            if agora > lida_em:
+                self._definir_potencia(carregador, (energia - anterior) / ((agora - lida_em) / 3600))
+        carregador.energia = energia
+        carregador.lida_em = agora
+
+    def registrar_evento(self, evento, agora):
+        carregador_id = evento.get("carregador")
+        acao = evento.get("acao")
+        if not carregador_id or acao not in ("inicio_carga", "fim_carga"):
+            return
+        with self._lock:
+            carregador = self._carregador(carregador_id)
+            if acao == "inicio_carga":
+                self._iniciadas.incrementar(agora)
+                carregador.energia = 0.0
+                carregador.lida_em = agora
+            else:
+                self._finalizadas.incrementar(agora)
+                total = evento.get("energia_consumida_kWh")
+                if total is not None:
+                    # O que a sessão consumiu depois da última leitura vista
+                    self._somar_energia(total - (carregador.energia or 0.0), agora)
+                carregador.energia = None
+            self._definir_potencia(carregador, 0.0)
+            self.versao += 1
+
+    # --- Leitura ---
+
+    @property
+    def sessoes_ativas(self):
+        return self._status["ocupado"]
+
+    def resumo(self, agora=None):
+        agora = time.time() if agora is None else agora
+        with self._lock:
+            self._virar_dia(agora)
+            return {
+                "versao": self.versao,
+                "carregadores": {**self._status, "total": len(self._carregadores)},
+                "potencia_kW": round(max(self._potencia, 0.0), 3),
+                "energia_hoje_kWh": round(self._energia_dia, 3),
+                "sessoes": {
+                    "ativas": self._status["ocupado"],
+                    "iniciadas": {f"{m}min": self._iniciadas.somar(agora, m) for m in JANELAS_MINUTOS},
+                    "finalizadas": {f"{m}min": self._finalizadas.somar(agora, m) for m in JANELAS_MINUTOS},
+                },
+                "locais": {
+                    local: {**{s: valores[s] for s in STATUS}, "potencia_kW": round(max(valores["potencia_kW"], 0.0), 3)}
+                    for local, valores in self._locais.items()
+                },
+            }
+
+    async def executar(self, manager, intervalo=AGREGADOS_INTERVALO):
+        """Envia o resumo aos WebSockets a cada `intervalo` segundos, se algo mudou."""
+        enviada = None
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                if self.versao != enviada and manager.active_connections:
+                    resumo = self.resumo()
+                    enviada = resumo["versao"]
+                    manager.broadcast(json.dumps({"topic": TOPICO_RESUMO, "payload": resumo}), TOPICO_RESUMO, resumo)
+            except Exception as e:
+                log.error("Erro ao enviar o resumo da frota: %s", e)
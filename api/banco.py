@@ -0,0 +1,167 @@
+import asyncio
+import os
+import re
+import time
+import asyncpg
+from backend import metricas
+from backend.registro import obter_logger
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+API_DB_POOL_MIN = int(os.getenv("API_DB_POOL_MIN", "1"))
+API_DB_POOL_MAX = int(os.getenv("API_DB_POOL_MAX", "10"))
+API_DB_TIMEOUT = float(os.getenv("API_DB_TIMEOUT", "10"))  # segundos por consulta
+# Statements preparados guardados por conexão. Use 0 atrás de um pgbouncer em
+# modo transação, onde statements preparados não sobrevivem entre transações.
+API_DB_CACHE_STATEMENTS = int(os.getenv("API_DB_CACHE_STATEMENTS", "256"))
+
+DIRETORIO_MIGRACOES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migracoes")
+# Chave do advisory lock: várias instâncias da API subindo juntas migram uma por vez
+TRAVA_MIGRACOES = 727001
+
+log = obter_logger("banco")
+
+
+class BancoIndisponivel(Exception):
+    pass
+
+
+class EstatisticasConsultas:
+    """Chamadas, erros e tempo (total e máximo) de cada consulta nomeada."""
+
+    def __init__(self):
+        self._consultas: dict[str, dict] = {}
+
+    def registrar(self, nome, duracao, erro=False):
+        estatistica = self._consultas.setdefault(nome, {"chamadas": 0, "erros": 0, "total_ms": 0.0, "max_ms": 0.0})
+        estatistica["chamadas"] += 1
+        if erro:
+            estatistica["erros"] += 1
+        metricas.CONSULTA_BANCO.labels(nome).observe(duracao)
+        duracao_ms = duracao * 1000
+        estatistica["total_ms"] += duracao_ms
+        estatistica["max_ms"] = max(estatistica["max_ms"], duracao_ms)
+
+    def resumo(self):
+        return {
+            nome: {
+                "chamadas": e["chamadas"],
+                "erros": e["erros"],
+                "media_ms": round(e["total_ms"] / e["chamadas"], 3) if e["chamadas"] else 0.0,
+                "max_ms": round(e["max_ms"], 3),
+            }
+            for nome, e in self._consultas.items()
+        }
+
+
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+estatisticas = EstatisticasConsultas()
+
+
+def listar_migracoes():
+    """Arquivos `NNNN_nome.sql` de migracoes/, em ordem de versão."""
+    migracoes = []
+    for arquivo in os.listdir(DIRETORIO_MIGRACOES):
+        encontrado = re.fullmatch(r"(\d+)_(\w+)\.sql", arquivo)
+        if encontrado:
+            migracoes.append((int(encontrado.group(1)), encontrado.group(2), os.path.join(DIRETORIO_MIGRACOES, arquivo)))
+    return sorted(migracoes)
+
+
+async def migrar(conn):
+    """
+    Aplica as migrações ainda não registradas em `schema_migracoes`, cada uma
+    em sua própria transação.
+    """
+    await conn.execute("SELECT pg_advisory_lock($1)", TRAVA_MIGRACOES)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migracoes (
+                versao INTEGER PRIMARY KEY,
+                nome VARCHAR(255) NOT NULL,
+                aplicada_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        aplicadas = {linha["versao"] for linha in await conn.fetch("SELECT versao FROM schema_migracoes")}
+        for versao, nome, caminho in listar_migracoes():
+            if versao in aplicadas:
+                continue
+            with open(caminho, encoding="utf-8") as arquivo:
+                sql = arquivo.read()
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migracoes (versao, nome) VALUES ($1, $2)", versao, nome)
+            log.info("Migração %04d '%s' aplicada", versao, nome)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", TRAVA_MIGRACOES)
+
+
+async def iniciar():
+    """Cria o pool e aplica as migrações pendentes. Chamado no startup da API."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
+        if not DATABASE_URL:
+            raise BancoIndisponivel("A variável de ambiente DATABASE_URL não foi definida")
+        try:
+            pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=API_DB_POOL_MIN,
+                max_size=API_DB_POOL_MAX,
+                command_timeout=API_DB_TIMEOUT,
+                statement_cache_size=API_DB_CACHE_STATEMENTS,
+            )
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            raise BancoIndisponivel(f"Não foi possível conectar ao banco: {e}") from e
+        try:
+            async with pool.acquire() as conn:
+                await migrar(conn)
+        except BaseException:
+            await pool.close()
+            raise
+        _pool = pool
+        log.info("Pool pronto (%d-%d conexões)", API_DB_POOL_MIN, API_DB_POOL_MAX)
+        return _pool
+
+
+async def fechar():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+async def consultar(nome, sql, *parametros):
+    """
+    Executa uma consulta de leitura e devolve as linhas como dicts. O asyncpg
+    prepara o statement na primeira execução em cada conexão e o reaproveita
+    daí em diante (até API_DB_CACHE_STATEMENTS statements por conexão).
+    """
+    # Se o banco estava fora do ar no startup, tenta de novo a cada consulta
+    pool = _pool or await iniciar()
+    inicio = time.perf_counter()
+    try:
+        async with pool.acquire(timeout=API_DB_TIMEOUT) as conn:
+            linhas = await conn.fetch(sql, *parametros)
+    except (OSError, asyncio.TimeoutError, asyncpg.exceptions.ConnectionDoesNotExistError, asyncpg.exceptions.CannotConnectNowError) as e:
+        estatisticas.registrar(nome, time.perf_counter() - inicio, erro=True)
+        raise BancoIndisponivel(f"Falha na consulta '{nome}': {e}") from e
+    except Exception:
+        estatisticas.registrar(nome, time.perf_counter() - inicio, erro=True)
+        raise
+    estatisticas.registrar(nome, time.perf_counter() - inicio)
+    return [dict(linha) for linha in linhas]
+
+
+def estado_pool():
+    if _pool is None:
+        return {"conectado": False}
+    return {
+        "conectado": True,
+        "tamanho": _pool.get_size(),
+        "ociosas": _pool.get_idle_size(),
+        "min": _pool.get_min_size(),
+        "max": _pool.get_max_size(),
+    }
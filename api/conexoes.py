@@ -0,0 +1,248 @@
+import asyncio
+import json
+import os
+from fastapi import WebSocket
+from backend import metricas
+from backend.registro import obter_logger
+
+WS_FILA_MAX = int(os.getenv("WS_FILA_MAX", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))  # segundos
+# "descartar": descarta as mensagens mais antigas da fila de um cliente lento
+# "desconectar": desconecta o cliente assim que a fila dele enche
+WS_POLITICA_LENTO = os.getenv("WS_POLITICA_LENTO", "descartar")
+# Com a política "descartar", clientes que perdem mais do que isso seguidas são desconectados
+WS_MAX_DESCARTES = int(os.getenv("WS_MAX_DESCARTES", "1000"))
+
+log = obter_logger("websocket")
+
+_AUSENTE = object()
+
+
+def topico_corresponde(filtro: str, topico: str) -> bool:
+    """Compara um tópico com um filtro no estilo MQTT (curingas `+` e `#`)."""
+    partes_filtro = filtro.split("/")
+    partes_topico = topico.split("/")
+    for i, parte in enumerate(partes_filtro):
+        if parte == "#":
+            return True
+        if i >= len(partes_topico):
+            return False
+        if parte != "+" and parte != partes_topico[i]:
+            return False
+    return len(partes_filtro) == len(partes_topico)
+
+
+class FiltroSubscricao:
+    """
+    Seleção de atualizações feita por um cliente. Cada critério vazio aceita tudo:
+    `topicos` (filtros MQTT), `carregadores` (IDs) e `eventos` (valores de `acao`).
+    """
+
+    def __init__(self, topicos=None, carregadores=None, eventos=None, delta=False):
+        self.topicos = list(topicos or [])
+        self.carregadores = set(carregadores or [])
+        self.eventos = set(eventos or [])
+        self.delta = delta
+
+    @classmethod
+    def de_mensagem(cls, mensagem: dict):
+        for campo in ("topicos", "carregadores", "eventos"):
+            valor = mensagem.get(campo)
+            if valor is not None and not (isinstance(valor, list) and all(isinstance(v, str) for v in valor)):
+                raise ValueError(f"'{campo}' deve ser uma lista de strings")
+        return cls(mensagem.get("topicos"), mensagem.get("carregadores"), mensagem.get("eventos"), bool(mensagem.get("delta", False)))
+
+    def aceita(self, topico: str, payload: dict) -> bool:
+        if self.topicos and not any(topico_corresponde(f, topico) for f in self.topicos):
+            return False
+        if self.carregadores and payload.get("carregador") not in self.carregadores:
+            return False
+        if self.eventos and topico.endswith("/eventos") and payload.get("acao") not in self.eventos:
+            return False
+        return True
+
+
+class ClienteWebSocket:
+    """Um dashboard conectado, com sua própria fila de saída e tarefa de envio."""
+
+    def __init__(self, websocket: WebSocket, fila_max=WS_FILA_MAX):
+        self.websocket = websocket
+        self.fila: asyncio.Queue[str] = asyncio.Queue(maxsize=fila_max)
+        self.descartes_seguidos = 0
+        self.descartes_total = 0
+        self.tarefa: asyncio.Task | None = None
+        self.filtro: FiltroSubscricao | None = None
+        # Último status enviado por carregador, usado para calcular deltas
+        self.ultimo_status: dict[str, dict] = {}
+
+    def preparar(self, topico: str, payload: dict, item: dict) -> dict | None:
+        """
+        Decide o que enviar a este cliente para uma atualização. Retorna o
+        próprio `item` (compartilhado entre clientes), um item de delta próprio
+        do cliente, ou None se a atualização não interessa (ou não mudou nada).
+        """
+        if self.filtro is None:
+            return item
+        if not self.filtro.aceita(topico, payload):
+            return None
+        if not (self.filtro.delta and topico.endswith("/status")):
+            return item
+
+        carregador_id = payload.get("carregador")
+        anterior = self.ultimo_status.get(carregador_id)
+        self.ultimo_status[carregador_id] = payload
+        if anterior is None:
+            return item
+        delta = {k: v for k, v in payload.items() if anterior.get(k, _AUSENTE) != v}
+        if not delta:
+            return None
+        return {"topic": topico, "carregador": carregador_id, "delta": delta}
+
+    def enfileirar(self, mensagem: str) -> bool:
+        """
+        Coloca a mensagem na fila do cliente sem bloquear. Retorna False se o
+        cliente deve ser desconectado pela política de consumidor lento.
+        """
+        try:
+            self.fila.put_nowait(mensagem)
+            self.descartes_seguidos = 0
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if WS_POLITICA_LENTO == "desconectar":
+            return False
+
+        # Descarta a mensagem mais antiga: para um dashboard, a atualização mais
+        # recente é mais útil do que uma fila de estados já superados
+        self.fila.get_nowait()
+        self.fila.put_nowait(mensagem)
+        if self.filtro is not None and self.filtro.delta:
+            # Os deltas seguintes partiam do que foi descartado: a próxima
+            # atualização de cada carregador volta a ser o status completo
+            self.ultimo_status.clear()
+        metricas.WEBSOCKET_DESCARTADAS.inc()
+        self.descartes_seguidos += 1
+        self.descartes_total += 1
+        return self.descartes_seguidos <= WS_MAX_DESCARTES
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: dict[WebSocket, ClienteWebSocket] = {}
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        cliente = ClienteWebSocket(websocket)
+        cliente.tarefa = asyncio.create_task(self._enviar(cliente))
+        self.active_connections[websocket] = cliente
+        return cliente
+
+    def disconnect(self, websocket: WebSocket):
+        cliente = self.active_connections.pop(websocket, None)
+        if cliente is None:
+            return
+        if cliente.tarefa is not None and cliente.tarefa is not asyncio.current_task():
+            cliente.tarefa.cancel()
+
+    def subscrever(self, websocket: WebSocket, filtro: FiltroSubscricao | None, carregadores: dict):
+        """
+        Aplica (ou remove, com filtro None) a subscrição de um cliente e envia
+        o status atual dos carregadores que passam no novo filtro.
+        """
+        cliente = self.active_connections.get(websocket)
+        if cliente is None:
+            return
+        cliente.filtro = filtro
+        cliente.ultimo_status = {}
+        for carregador_id, payload in list(carregadores.items()):
+            topico = f"carregadores/{carregador_id}/status"
+            if filtro is None or filtro.aceita(topico, payload):
+                if filtro is not None and filtro.delta:
+                    cliente.ultimo_status[carregador_id] = payload
+                cliente.enfileirar(json.dumps({"topic": topico, "payload": payload}))
+
+    def broadcast(self, message: str, topic: str | None = None, payload: dict | None = None):
+        """
+        Distribui uma mensagem já serializada para todos os clientes.
+
+        Apenas enfileira: nenhum envio acontece aqui, então um cliente lento
+        não atrasa os demais. Deve ser chamado a partir do loop de eventos
+        (use `loop.call_soon_threadsafe` a partir de outras threads). Quando
+        `topic` e `payload` são informados, os filtros e deltas de cada
+        cliente são aplicados; caso contrário a mensagem vai para todos.
+        """
+        item = {"topic": topic, "payload": payload}
+        lentos = []
+        for websocket, cliente in self.active_connections.items():
+            if topic is None:
+                mensagem = message
+            else:
+                preparado = cliente.preparar(topic, payload, item)
+                if preparado is None:
+                    continue
+                mensagem = message if preparado is item else json.dumps(preparado)
+            if not cliente.enfileirar(mensagem):
+                lentos.append(websocket)
+        self._desconectar_lentos(lentos)
+
+    def broadcast_lote(self, itens: list[tuple[str, dict]]):
+        """
+        Envia várias atualizações (tópico, payload) num único frame
+        {"topic": "lote", "mensagens": [...]}. O frame completo é serializado
+        uma vez e compartilhado; só clientes com filtro recebem um frame próprio.
+        """
+        completos = [{"topic": topico, "payload": payload} for topico, payload in itens]
+        compartilhada = None
+        lentos = []
+        for websocket, cliente in self.active_connections.items():
+            if cliente.filtro is None:
+                if compartilhada is None:
+                    compartilhada = json.dumps({"topic": "lote", "mensagens": completos})
+                mensagem = compartilhada
+            else:
+                mensagens = []
+                for (topico, payload), item in zip(itens, completos):
+                    preparado = cliente.preparar(topico, payload, item)
+                    if preparado is not None:
+                        mensagens.append(preparado)
+                if not mensagens:
+                    continue
+                mensagem = json.dumps({"topic": "lote", "mensagens": mensagens})
+            if not cliente.enfileirar(mensagem):
+                lentos.append(websocket)
+        self._desconectar_lentos(lentos)
+
+    def _desconectar_lentos(self, lentos):
+        for websocket in lentos:
+            log.warning("Cliente lento desconectado (%d mensagens descartadas)", self.active_connections[websocket].descartes_total)
+            self.disconnect(websocket)
+            asyncio.create_task(self._fechar(websocket))
+
+    async def _enviar(self, cliente: ClienteWebSocket):
+        try:
+            while True:
+                mensagem = await cliente.fila.get()
+                await asyncio.wait_for(cliente.websocket.send_text(mensagem), WS_SEND_TIMEOUT)
+                metricas.WEBSOCKET_ENVIADAS.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Socket morto ou envio travado: remove o cliente sem afetar os demais
+            log.warning("Falha ao enviar para cliente, removendo: %r", e)
+            self.disconnect(cliente.websocket)
+            await self._fechar(cliente.websocket)
+
+    def atualizar_metricas(self):
+        """Clientes conectados e profundidade das filas de envio (na coleta do /metrics)."""
+        filas = [cliente.fila.qsize() for cliente in self.active_connections.values()]
+        metricas.WEBSOCKET_CLIENTES.set(len(filas))
+        metricas.WEBSOCKET_FILA.labels("soma").set(sum(filas))
+        metricas.WEBSOCKET_FILA.labels("max").set(max(filas, default=0))
+
+    @staticmethod
+    async def _fechar(websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import threading
+from backend.registro import obter_logger
+
+# Frames de status por segundo enviados aos WebSockets; 0 desliga a conflação
+STATUS_FPS = float(os.getenv("STATUS_FPS", "4"))
+
+log = obter_logger("conflacao")
+
+
+class ConflacaoStatus:
+    """
+    Mantém apenas o último status recebido de cada carregador entre dois
+    frames. Os status chegam pela thread do MQTT e são descarregados no loop
+    de eventos a cada 1/fps segundos, num único frame de WebSocket. Assim o
+    custo do broadcast é limitado por frames × clientes, e não por
+    mensagens × clientes.
+    """
+
+    def __init__(self, fps=STATUS_FPS):
+        self.fps = fps
+        self._pendentes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ativa(self):
+        return self.fps > 0
+
+    def registrar(self, topico: str, payload: dict):
+        with self._lock:
+            self._pendentes[topico] = payload
+
+    def drenar(self) -> list[tuple[str, dict]]:
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        return list(pendentes.items())
+
+    async def executar(self, manager):
+        intervalo = 1 / self.fps
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                itens = self.drenar()
+                if itens:
+                    manager.broadcast_lote(itens)
+            except Exception as e:
+                # Um frame com erro não pode parar os próximos
+                log.error("Erro ao enviar o frame de status: %s", e)
@@ -0,0 +1,86 @@
+from api.banco import consultar
+
+TRUNCAR = {"hora": "hour", "dia": "day"}
+
+
+# As consultas abaixo leem dos agregados (rollup_*), cujo tamanho depende do
+# número de carregadores/carros e do período, não do total de transações.
+
+async def receita_por_carregador(inicio, fim, limit):
+    return await consultar("receita_por_carregador", """
+        SELECT carregador_id, sum(sessoes) AS sessoes, sum(energia_kwh) AS energia_kwh, sum(receita_brl) AS receita_brl
+        FROM rollup_carregador_hora
+        WHERE hora >= date_trunc('hour', $1::timestamptz) AND hora < $2
+        GROUP BY carregador_id
+        ORDER BY receita_brl DESC
+        LIMIT $3;
+    """, inicio, fim, limit)
+
+
+async def serie_carregador(carregador_id, granularidade, inicio, fim):
+    return await consultar("serie_carregador", """
+        SELECT date_trunc($1, hora) AS periodo, sum(sessoes) AS sessoes, sum(energia_kwh) AS energia_kwh, sum(receita_brl) AS receita_brl
+        FROM rollup_carregador_hora
+        WHERE carregador_id = $2 AND hora >= date_trunc('hour', $3::timestamptz) AND hora < $4
+        GROUP BY 1
+        ORDER BY 1;
+    """, TRUNCAR[granularidade], carregador_id, inicio, fim)
+
+
+async def consumo_por_carro(inicio, fim, limit):
+    return await consultar("consumo_por_carro", """
+        SELECT carro_id, sum(sessoes) AS sessoes, sum(energia_kwh) AS energia_kwh, sum(custo_brl) AS custo_brl
+        FROM rollup_carro_dia
+        WHERE dia >= $1 AND dia <= $2
+        GROUP BY carro_id
+        ORDER BY energia_kwh DESC
+        LIMIT $3;
+    """, inicio.date(), fim.date(), limit)
+
+
+async def serie_carro(carro_id, inicio, fim):
+    return await consultar("serie_carro", """
+        SELECT dia AS periodo, sessoes, energia_kwh, custo_brl
+        FROM rollup_carro_dia
+        WHERE carro_id = $1 AND dia >= $2 AND dia <= $3
+        ORDER BY dia;
+    """, carro_id, inicio.date(), fim.date())
+
+
+async def resumo_frota(granularidade, inicio, fim):
+    return await consultar("resumo_frota", """
+        SELECT date_trunc($1, hora) AS periodo, sum(sessoes) AS sessoes, sum(energia_kwh) AS energia_kwh, sum(receita_brl) AS receita_brl
+        FROM rollup_carregador_hora
+        WHERE hora >= date_trunc('hour', $2::timestamptz) AND hora < $3
+        GROUP BY 1
+        ORDER BY 1;
+    """, TRUNCAR[granularidade], inicio, fim)
+
+
+async def listar_transacoes(carregador_id, carro_id, antes_de, limit, divergentes=False):
+    """
+    Transações mais recentes primeiro, com paginação por chave (`antes_de` é o
+    menor `id` da página anterior). Os filtros usam os índices
+    (carregador_id, id) e (carro_id, id); `divergentes` usa o índice parcial
+    das transações que não bateram com as leituras do medidor.
+    """
+    condicoes = []
+    parametros = []
+    for coluna, operador, valor in (("carregador_id", "=", carregador_id), ("carro_id", "=", carro_id), ("id", "<", antes_de)):
+        if valor is not None:
+            parametros.append(valor)
+            condicoes.append(f"{coluna} {operador} ${len(parametros)}")
+    if divergentes:
+        condicoes.append("divergencia IS NOT NULL")
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    parametros.append(limit)
+    # Cada combinação de filtros vira um statement preparado diferente (no máximo 16)
+    return await consultar("listar_transacoes", f"""
+        SELECT id, carro_id, carregador_id, energia_total_kwh, custo_total_brl,
+               timestamp_transacao, chave_idempotencia, registrado_em,
+               energia_medida_kwh, leituras_recebidas, leituras_esperadas, divergencia, tarifa
+        FROM transacoes
+        {where}
+        ORDER BY id DESC
+        LIMIT ${len(parametros)};
+    """, *parametros)
@@ -0,0 +1,275 @@
+import asyncio
+import fcntl
+import functools
+import hashlib
+import hmac
+import inspect
+import json
+import os
+import socket
+import time
+import typing
+import uuid
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from backend import metricas
+from backend.registro import obter_logger
+
+# Trava que elege o worker dono do controle dos processos (uma por máquina)
+API_DONO_ARQUIVO = os.getenv("API_DONO_ARQUIVO", "/tmp/mqtt-carros-eletricos-api.lock")
+# Segundos entre tentativas de assumir o controle, se o dono atual sair
+API_DONO_INTERVALO = float(os.getenv("API_DONO_INTERVALO", "5"))
+# Espera máxima pela resposta do dono a uma operação encaminhada
+API_CONTROLE_TIMEOUT = float(os.getenv("API_CONTROLE_TIMEOUT", "30"))
+
+# Chave do HMAC que assina as mensagens de controle entre os workers; sem ela,
+# requisições e difusões recebidas pelo MQTT são recusadas
+API_CONTROLE_CHAVE = os.getenv("API_CONTROLE_CHAVE") or os.getenv("TOKEN_API")
+
+TOPICO_REQUISICOES = "api/controle/requisicoes"
+TOPICO_RESPOSTAS = "api/controle/respostas/"
+TOPICO_DIFUSAO = "api/controle/difusao"
+
+log = obter_logger("coordenacao")
+
+
+def _modelo(anotacao):
+    """O modelo pydantic de um parâmetro (também em `Modelo | None`), se houver."""
+    for tipo in (anotacao, *typing.get_args(anotacao)):
+        if isinstance(tipo, type) and issubclass(tipo, BaseModel):
+            return tipo
+    return None
+
+
+def _assinatura(chave, mensagem):
+    conteudo = {k: v for k, v in mensagem.items() if k != "assinatura"}
+    corpo = json.dumps(conteudo, sort_keys=True, separators=(",", ":")).encode()
+    return hmac.new(chave.encode(), corpo, hashlib.sha256).hexdigest()
+
+
+class Coordenacao:
+    """
+    Coordena vários workers da API (uvicorn --workers N ou WEB_CONCURRENCY=N).
+
+    Cada worker tem o próprio cliente MQTT e monta sozinho o estado servido
+    aos dashboards (status, eventos, sessões, agregados), então a capacidade de
+    WebSockets cresce com os núcleos sem estado compartilhado entre processos.
+
+    Os processos filhos (carregadores, frota, billing) têm um único dono: o
+    worker que obtém a trava exclusiva em API_DONO_ARQUIVO. As operações de
+    controle (`@coordenacao.operacao`) rodam direto no dono; nos demais workers
+    elas são encaminhadas a ele pelo MQTT (requisição em TOPICO_REQUISICOES e
+    resposta no tópico próprio do worker). Se o dono sair, a trava é liberada
+    pelo sistema e outro worker assume na próxima tentativa. Ações que mudam o
+    estado de todos os workers (limpar) vão por TOPICO_DIFUSAO.
+
+    Qualquer cliente do broker pode publicar nesses tópicos, então toda
+    mensagem de controle leva um HMAC-SHA256 com API_CONTROLE_CHAVE e o
+    horário de emissão. As que chegam sem assinatura válida, fora da janela de
+    API_CONTROLE_TIMEOUT segundos ou repetidas são descartadas antes de
+    executar qualquer coisa.
+    """
+
+    def __init__(self, arquivo=API_DONO_ARQUIVO, chave=API_CONTROLE_CHAVE):
+        self.arquivo = arquivo
+        self.chave = chave
+        self._vistas: dict[str, float] = {}  # id -> expiração, contra repetição
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.dono = False
+        self.client = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._arquivo_trava = None
+        self._operacoes = {}
+        self._difusao = {}
+        self._pendentes: dict[str, asyncio.Future] = {}
+        self._ao_assumir = None
+        self._tarefa: asyncio.Task | None = None
+
+    @property
+    def topico_respostas(self):
+        return TOPICO_RESPOSTAS + self.worker_id
+
+    # --- Eleição do dono ---
+
+    def tentar_assumir(self):
+        """Tenta obter a trava de dono sem bloquear. Devolve se este worker é o dono."""
+        if self.dono:
+            return True
+        arquivo = open(self.arquivo, "a+")
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            arquivo.close()
+            return False
+        arquivo.seek(0)
+        arquivo.truncate()
+        arquivo.write(f"{self.worker_id}\n")
+        arquivo.flush()
+        # O arquivo fica aberto: a trava vale enquanto este processo existir
+        self._arquivo_trava = arquivo
+        self.dono = True
+        log.info("Worker %s é o dono do controle dos processos", self.worker_id)
+        return True
+
+    async def iniciar(self, client, ao_assumir):
+        """
+        Liga a coordenação ao cliente MQTT. `ao_assumir` (corrotina) roda
+        quando este worker se torna dono (já no startup ou mais tarde).
+        """
+        self.client = client
+        self.loop = asyncio.get_running_loop()
+        self._ao_assumir = ao_assumir
+        if self.tentar_assumir():
+            await ao_assumir()
+        else:
+            self._tarefa = asyncio.create_task(self._disputar())
+
+    async def _disputar(self):
+        while not self.tentar_assumir():
+            await asyncio.sleep(API_DONO_INTERVALO)
+        self.client.subscribe(TOPICO_REQUISICOES, qos=1)
+        await self._ao_assumir()
+
+    def fechar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+        if self._arquivo_trava is not None:
+            self._arquivo_trava.close()
+            self._arquivo_trava = None
+            self.dono = False
+
+    # --- MQTT (thread do paho) ---
+
+    def on_connect(self, client):
+        client.subscribe(self.topico_respostas, qos=1)
+        client.subscribe(TOPICO_DIFUSAO, qos=1)
+        if self.dono:
+            client.subscribe(TOPICO_REQUISICOES, qos=1)
+
+    def tratar_mensagem(self, topico, payload):
+        """Trata as mensagens de controle entre workers. Devolve False para as demais."""
+        if not topico.startswith("api/controle/"):
+            return False
+        if topico == TOPICO_REQUISICOES:
+            if self.dono:
+                asyncio.run_coroutine_threadsafe(self._atender(payload), self.loop)
+        elif topico == self.topico_respostas:
+            self.loop.call_soon_threadsafe(self._resolver, payload)
+        elif topico == TOPICO_DIFUSAO:
+            if payload.get("origem") != self.worker_id:
+                self.loop.call_soon_threadsafe(self._difundida, payload)
+        return True
+
+    # --- Assinatura (loop de eventos) ---
+
+    def _assinar(self, mensagem):
+        if self.chave is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="API_CONTROLE_CHAVE não configurada: operações entre workers desativadas")
+        mensagem = dict(mensagem, id=mensagem.get("id") or uuid.uuid4().hex, emitido_em=time.time())
+        mensagem["assinatura"] = _assinatura(self.chave, mensagem)
+        return json.dumps(mensagem)
+
+    def _autentica(self, mensagem):
+        """Assinatura válida, emitida há pouco e ainda não vista."""
+        assinatura = mensagem.get("assinatura")
+        if self.chave is None or not isinstance(assinatura, str):
+            return False
+        if not hmac.compare_digest(assinatura, _assinatura(self.chave, mensagem)):
+            return False
+        agora = time.time()
+        emitido_em = mensagem.get("emitido_em")
+        if not isinstance(emitido_em, (int, float)) or abs(agora - emitido_em) > API_CONTROLE_TIMEOUT:
+            return False
+        for vista in [i for i, expira in self._vistas.items() if expira < agora]:
+            del self._vistas[vista]
+        if mensagem.get("id") in self._vistas:
+            return False
+        self._vistas[mensagem.get("id")] = agora + 2 * API_CONTROLE_TIMEOUT
+        return True
+
+    # --- Operações de controle ---
+
+    def operacao(self, func):
+        """
+        Decorador das operações que só o dono executa. A assinatura é mantida
+        (o FastAPI continua validando os parâmetros); os argumentos, modelos
+        pydantic incluídos, vão em JSON até o dono.
+        """
+        self._operacoes[func.__name__] = func
+
+        @functools.wraps(func)
+        async def encaminhada(**argumentos):
+            if self.dono:
+                return await func(**argumentos)
+            return await self._chamar_dono(func.__name__, argumentos)
+
+        return encaminhada
+
+    async def _chamar_dono(self, nome, argumentos):
+        requisicao_id = uuid.uuid4().hex
+        futuro = self.loop.create_future()
+        self._pendentes[requisicao_id] = futuro
+        requisicao = {"id": requisicao_id, "operacao": nome, "argumentos": jsonable_encoder(argumentos), "responder": self.topico_respostas}
+        self.client.publish(TOPICO_REQUISICOES, self._assinar(requisicao), qos=1)
+        metricas.contar_publicada(TOPICO_REQUISICOES)
+        try:
+            resposta = await asyncio.wait_for(futuro, API_CONTROLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="O worker dono do controle dos processos não respondeu")
+        finally:
+            self._pendentes.pop(requisicao_id, None)
+        if "erro" in resposta:
+            raise HTTPException(status_code=resposta.get("codigo", 500), detail=resposta["erro"])
+        return resposta["resultado"]
+
+    def _resolver(self, resposta):
+        if not self._autentica(resposta):
+            log.warning("Resposta de controle sem assinatura válida descartada")
+            return
+        futuro = self._pendentes.get(resposta.get("id"))
+        if futuro is not None and not futuro.done():
+            futuro.set_result(resposta)
+
+    async def _atender(self, requisicao):
+        if not self._autentica(requisicao):
+            log.warning("Requisição de controle '%s' sem assinatura válida descartada", requisicao.get("operacao"))
+            return
+        resposta = {"id": requisicao.get("id")}
+        func = self._operacoes.get(requisicao.get("operacao"))
+        try:
+            if func is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Operação desconhecida: {requisicao.get('operacao')}")
+            argumentos = dict(requisicao.get("argumentos") or {})
+            for nome, parametro in inspect.signature(func).parameters.items():
+                modelo = _modelo(parametro.annotation)
+                if modelo is not None and argumentos.get(nome) is not None:
+                    argumentos[nome] = modelo(**argumentos[nome])
+            resposta["resultado"] = jsonable_encoder(await func(**argumentos))
+        except HTTPException as e:
+            resposta.update(erro=e.detail, codigo=e.status_code)
+        except Exception as e:
+            log.error("Falha na operação encaminhada '%s': %s", requisicao.get("operacao"), e)
+            resposta.update(erro=f"Falha no worker dono: {e}", codigo=500)
+        self.client.publish(requisicao.get("responder"), self._assinar(resposta), qos=1)
+
+    # --- Difusão ---
+
+    def registrar_difusao(self, acao, callback):
+        """`callback()` roda no loop de eventos de cada worker quando outro difunde `acao`."""
+        self._difusao[acao] = callback
+
+    def _difundida(self, mensagem):
+        if not self._autentica(mensagem):
+            log.warning("Difusão '%s' sem assinatura válida descartada", mensagem.get("acao"))
+            return
+        callback = self._difusao.get(mensagem.get("acao"))
+        if callback is not None:
+            callback()
+
+    def difundir(self, acao):
+        if self.chave is None:
+            log.warning("API_CONTROLE_CHAVE não configurada: '%s' não é difundido aos demais workers", acao)
+            return
+        self.client.publish(TOPICO_DIFUSAO, self._assinar({"acao": acao, "origem": self.worker_id}), qos=1)
+        metricas.contar_publicada(TOPICO_DIFUSAO)
@@ -0,0 +1,249 @@
+import json
+import math
+import sys
+import threading
+from array import array
+from collections.abc import MutableMapping
+from json.encoder import encode_basestring_ascii as _texto_json
+
+# Códigos do array de status; um status fora desta lista vai para os extras
+STATUS = ("livre", "ocupado", "offline")
+_CODIGO_STATUS = {status: codigo for codigo, status in enumerate(STATUS)}
+
+# Bits de presença de cada campo, para devolver o payload com as mesmas chaves
+_TEM_STATUS, _TEM_CARRO, _TEM_ENERGIA, _TEM_TIMESTAMP = 1, 2, 4, 8
+# Energia publicada como int (o payload de offline manda 0): volta como int
+_ENERGIA_INTEIRA = 16
+_COMPLETO = _TEM_STATUS | _TEM_CARRO | _TEM_ENERGIA | _TEM_TIMESTAMP
+_CAMPOS = ("carregador", "status", "carro_conectado", "energia_consumida_kWh", "timestamp")
+_LIMITE_INT64 = 2 ** 63
+
+
+class TabelaCarregadores(MutableMapping):
+    """
+    Último status de cada carregador em formato compacto, com a interface de
+    um dict {carregador_id: payload}.
+
+    Cada carregador ganha um índice fixo; status, energia e timestamp ficam em
+    arrays tipados (sem um objeto Python por valor) e os IDs de carregador e
+    carro são internados, então o mesmo texto é compartilhado por todos os
+    registros. Ler um carregador remonta o dict do payload. Campos fora do
+    formato publicado pelos carregadores (ou valores de outro tipo) vão para
+    um dict de extras só daquele carregador, então nada se perde.
+
+    Escritas vêm da thread do MQTT e leituras do loop de eventos; a trava
+    mantém cada registro consistente.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._indices: dict[str, int] = {}
+        self._ids: list[str | None] = []
+        self._carros: list[str | None] = []
+        self._status = array("b")
+        self._presenca = array("B")
+        self._energia = array("d")
+        self._timestamp = array("q")
+        self._extras: dict[int, dict] = {}
+        self._livres: list[int] = []
+
+    def _indice(self, carregador_id):
+        indice = self._indices.get(carregador_id)
+        if indice is not None:
+            return indice
+        carregador_id = sys.intern(carregador_id)
+        if self._livres:
+            indice = self._livres.pop()
+            self._ids[indice] = carregador_id
+        else:
+            indice = len(self._ids)
+            self._ids.append(carregador_id)
+            self._carros.append(None)
+            self._status.append(-1)
+            self._presenca.append(0)
+            self._energia.append(0.0)
+            self._timestamp.append(0)
+        self._indices[carregador_id] = indice
+        return indice
+
+    def _gravar(self, indice, carregador_id, payload):
+        presenca = 0
+        extras = {k: v for k, v in payload.items() if k not in _CAMPOS}
+        if payload.get("carregador", carregador_id) != carregador_id:
+            extras["carregador"] = payload["carregador"]
+
+        codigo = -1
+        if "status" in payload:
+            codigo = _CODIGO_STATUS.get(payload["status"], -1)
+            if codigo >= 0:
+                presenca |= _TEM_STATUS
+            else:
+                extras["status"] = payload["status"]
+        self._status[indice] = codigo
+
+        carro = None
+        if "carro_conectado" in payload:
+            carro = payload["carro_conectado"]
+            if carro is None or isinstance(carro, str):
+                presenca |= _TEM_CARRO
+                carro = sys.intern(carro) if carro is not None else None
+            else:
+                extras["carro_conectado"] = carro
+                carro = None
+        self._carros[indice] = carro
+
+        if "energia_consumida_kWh" in payload:
+            bits = self._bits_energia(indice, payload["energia_consumida_kWh"])
+            if bits:
+                presenca |= bits
+            else:
+                extras["energia_consumida_kWh"] = payload["energia_consumida_kWh"]
+
+        timestamp = payload.get("timestamp")
+        if type(timestamp) is int and -_LIMITE_INT64 <= timestamp < _LIMITE_INT64:
+            presenca |= _TEM_TIMESTAMP
+            self._timestamp[indice] = timestamp
+        elif "timestamp" in payload:
+            extras["timestamp"] = timestamp
+
+        self._presenca[indice] = presenca
+        if extras:
+            self._extras[indice] = extras
+        else:
+            self._extras.pop(indice, None)
+
+    def _bits_energia(self, indice, energia):
+        """Grava a energia no array se couber (float finito ou int pequeno); devolve os bits."""
+        if type(energia) is float and math.isfinite(energia):
+            self._energia[indice] = energia
+            return _TEM_ENERGIA
+        if type(energia) is int and abs(energia) < 2 ** 53:
+            self._energia[indice] = energia
+            return _TEM_ENERGIA | _ENERGIA_INTEIRA
+        return 0
+
+    def _energia_lida(self, indice, presenca):
+        energia = self._energia[indice]
+        return int(energia) if presenca & _ENERGIA_INTEIRA else energia
+
+    def _ler(self, indice):
+        presenca = self._presenca[indice]
+        extras = self._extras.get(indice)
+        payload = {"carregador": self._ids[indice]}
+        if presenca & _TEM_STATUS:
+            payload["status"] = STATUS[self._status[indice]]
+        if presenca & _TEM_CARRO:
+            payload["carro_conectado"] = self._carros[indice]
+        if presenca & _TEM_ENERGIA:
+            payload["energia_consumida_kWh"] = self._energia_lida(indice, presenca)
+        if presenca & _TEM_TIMESTAMP:
+            payload["timestamp"] = self._timestamp[indice]
+        if extras:
+            payload.update(extras)
+        return payload
+
+    # --- Interface de dict ---
+
+    def __setitem__(self, carregador_id, payload):
+        with self._lock:
+            self._gravar(self._indice(carregador_id), carregador_id, payload)
+
+    def __getitem__(self, carregador_id):
+        with self._lock:
+            return self._ler(self._indices[carregador_id])
+
+    def __delitem__(self, carregador_id):
+        with self._lock:
+            indice = self._indices.pop(carregador_id)
+            self._ids[indice] = None
+            self._carros[indice] = None
+            self._extras.pop(indice, None)
+            self._livres.append(indice)
+
+    def __contains__(self, carregador_id):
+        return carregador_id in self._indices
+
+    def __iter__(self):
+        return iter(list(self._indices))
+
+    def __len__(self):
+        return len(self._indices)
+
+    def items(self):
+        """Cópia dos pares (id, payload), segura para iterar enquanto o MQTT escreve."""
+        with self._lock:
+            return [(carregador_id, self._ler(indice)) for carregador_id, indice in self._indices.items()]
+
+    def clear(self):
+        with self._lock:
+            self._reiniciar()
+
+    # --- Operações sem montar o payload ---
+
+    def status(self, carregador_id):
+        with self._lock:
+            indice = self._indices.get(carregador_id)
+            if indice is None:
+                return None
+            if self._presenca[indice] & _TEM_STATUS:
+                return STATUS[self._status[indice]]
+            return (self._extras.get(indice) or {}).get("status")
+
+    def atualizar_energia(self, carregador_id, energia):
+        """Atualiza só a energia de um carregador já conhecido (leituras do medidor)."""
+        with self._lock:
+            indice = self._indices.get(carregador_id)
+            if indice is None:
+                return False
+            bits = self._bits_energia(indice, energia)
+            self._presenca[indice] = (self._presenca[indice] & ~(_TEM_ENERGIA | _ENERGIA_INTEIRA)) | bits
+            extras = self._extras.get(indice)
+            if not bits:
+                self._extras.setdefault(indice, {})["energia_consumida_kWh"] = energia
+            elif extras is not None:
+                extras.pop("energia_consumida_kWh", None)
+                if not extras:
+                    del self._extras[indice]
+        return True
+
+    def json(self):
+        """
+        O objeto {id: payload} já em JSON, montado direto dos arrays (sem criar
+        um dict por carregador). Usado pelo snapshot do estado inicial. Só a
+        cópia dos arrays acontece com a trava; a formatação, fora dela.
+        """
+        with self._lock:
+            indices = list(self._indices.items())
+            carros, status, presenca = self._carros[:], self._status[:], self._presenca[:]
+            energia, timestamp = self._energia[:], self._timestamp[:]
+            extras_todos = {indice: self._ler(indice) for indice in self._extras}
+        partes = []
+        for carregador_id, indice in indices:
+            texto_id = _texto_json(carregador_id)
+            completo = extras_todos.get(indice)
+            if completo is not None:
+                partes.append(f"{texto_id}: {json.dumps(completo)}")
+                continue
+            bits = presenca[indice]
+            carro = carros[indice]
+            texto_carro = "null" if carro is None else _texto_json(carro)
+            energia_texto = repr(int(energia[indice]) if bits & _ENERGIA_INTEIRA else energia[indice])
+            if bits & _COMPLETO == _COMPLETO:
+                # Caso comum: o payload publicado pelos carregadores, com todos os campos
+                partes.append(f'{texto_id}: {{"carregador": {texto_id}, "status": "{STATUS[status[indice]]}", '
+                              f'"carro_conectado": {texto_carro}, "energia_consumida_kWh": {energia_texto}, "timestamp": {timestamp[indice]}}}')
+                continue
+            campos = [f'"carregador": {texto_id}']
+            if bits & _TEM_STATUS:
+                campos.append(f'"status": "{STATUS[status[indice]]}"')
+            if bits & _TEM_CARRO:
+                campos.append(f'"carro_conectado": {texto_carro}')
+            if bits & _TEM_ENERGIA:
+                campos.append(f'"energia_consumida_kWh": {energia_texto}')
+            if bits & _TEM_TIMESTAMP:
+                campos.append(f'"timestamp": {timestamp[indice]}')
+            partes.append(f'{texto_id}: {{{", ".join(campos)}}}')
+        return "{" + ", ".join(partes) + "}"
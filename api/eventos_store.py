@@ -0,0 +1,153 @@
+import bisect
+import os
+import threading
+from collections import deque
+
+EVENTOS_CAPACIDADE = int(os.getenv("EVENTOS_CAPACIDADE", "100000"))
+
+
+def formatar_cursor(timestamp: int, seq: int) -> str:
+    return f"{timestamp}:{seq}"
+
+
+def ler_cursor(cursor: str) -> tuple[int, int]:
+    """Converte um cursor 'timestamp:seq' em tupla. Levanta ValueError se inválido."""
+    timestamp, seq = cursor.split(":")
+    return int(timestamp), int(seq)
+
+
+class EventoStore:
+    """
+    Buffer circular dos eventos mais recentes, com índices por carregador, por
+    carro e por timestamp de Lamport.
+
+    Cada evento recebe um número de sequência crescente; a posição no buffer é
+    `seq % capacidade`, então inserir e descartar o mais antigo são O(1). Os
+    índices por carregador/carro guardam as sequências em ordem de chegada e
+    perdem a da esquerda quando o evento correspondente sai do buffer. O índice
+    por timestamp é uma lista ordenada de (timestamp, seq) compactada de tempos
+    em tempos; entradas de eventos já descartados são ignoradas nas consultas.
+
+    `adicionar` é chamado pela thread do MQTT e as consultas pelo loop de
+    eventos, por isso todo acesso passa pelo mesmo lock.
+    """
+
+    def __init__(self, capacidade=EVENTOS_CAPACIDADE):
+        self.capacidade = capacidade
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._lock:
+            self._buffer: list[tuple[int, int, dict] | None] = [None] * self.capacidade
+            self._proximo_seq = 0
+            self._por_carregador: dict[str, deque] = {}
+            self._por_carro: dict[str, deque] = {}
+            self._por_timestamp: list[tuple[int, int]] = []
+
+    def __len__(self):
+        return self._proximo_seq - self._primeiro_seq
+
+    @property
+    def _primeiro_seq(self):
+        return max(0, self._proximo_seq - self.capacidade)
+
+    def adicionar(self, evento: dict) -> int:
+        timestamp = evento.get("timestamp")
+        if not isinstance(timestamp, int):
+            timestamp = 0
+
+        with self._lock:
+            seq = self._proximo_seq
+            posicao = seq % self.capacidade
+            antigo = self._buffer[posicao]
+            if antigo is not None:
+                self._remover_dos_indices(antigo)
+
+            self._buffer[posicao] = (seq, timestamp, evento)
+            self._proximo_seq += 1
+            self._indexar(self._por_carregador, evento.get("carregador"), seq)
+            self._indexar(self._por_carro, evento.get("carro"), seq)
+
+            chave = (timestamp, seq)
+            if not self._por_timestamp or chave > self._por_timestamp[-1]:
+                self._por_timestamp.append(chave)
+            else:
+                bisect.insort(self._por_timestamp, chave)
+            if len(self._por_timestamp) > 2 * self.capacidade:
+                primeiro = self._primeiro_seq
+                self._por_timestamp = [c for c in self._por_timestamp if c[1] >= primeiro]
+            return seq
+
+    @staticmethod
+    def _indexar(indice, chave, seq):
+        if chave is None:
+            return
+        seqs = indice.get(chave)
+        if seqs is None:
+            seqs = indice[chave] = deque()
+        seqs.append(seq)
+
+    def _remover_dos_indices(self, antigo):
+        # O evento descartado é o mais antigo do buffer, logo o primeiro de cada índice
+        seq, _, evento = antigo
+        for indice, chave in ((self._por_carregador, evento.get("carregador")), (self._por_carro, evento.get("carro"))):
+            seqs = indice.get(chave)
+            if seqs and seqs[0] == seq:
+                seqs.popleft()
+                if not seqs:
+                    del indice[chave]
+
+    def _obter(self, seq):
+        if seq < self._primeiro_seq or seq >= self._proximo_seq:
+            return None
+        return self._buffer[seq % self.capacidade]
+
+    def ultimos(self, quantidade: int) -> list[dict]:
+        """Os `quantidade` eventos mais recentes, em ordem de chegada."""
+        with self._lock:
+            inicio = max(self._primeiro_seq, self._proximo_seq - quantidade)
+            return [self._buffer[seq % self.capacidade][2] for seq in range(inicio, self._proximo_seq)]
+
+    def consultar(self, since=None, carregador=None, carro=None, limit=100, cursor=None):
+        """
+        Eventos em ordem de (timestamp de Lamport, seq), posteriores a `since`
+        e ao `cursor`, filtrados por carregador e/ou carro. Retorna a página e o
+        cursor para a próxima (None quando não há mais eventos).
+        """
+        inicio = (-1, -1)
+        if since is not None:
+            inicio = (since, float("inf"))
+        if cursor is not None:
+            inicio = max(inicio, ler_cursor(cursor))
+
+        with self._lock:
+            if carregador is None and carro is None:
+                pagina = []
+                posicao = bisect.bisect_right(self._por_timestamp, inicio)
+                primeiro = self._primeiro_seq
+                while posicao < len(self._por_timestamp) and len(pagina) < limit + 1:
+                    timestamp, seq = self._por_timestamp[posicao]
+                    posicao += 1
+                    if seq >= primeiro:
+                        pagina.append(self._obter(seq))
+            else:
+                # Usa o índice do filtro informado; se houver os dois, o de carregador
+                indice, chave = (self._por_carregador, carregador) if carregador is not None else (self._por_carro, carro)
+                candidatos = []
+                for seq in indice.get(chave, ()):
+                    entrada = self._obter(seq)
+                    if entrada is None or (entrada[1], seq) <= inicio:
+                        continue
+                    if carro is not None and entrada[2].get("carro") != carro:
+                        continue
+                    candidatos.append(entrada)
+                candidatos.sort(key=lambda e: (e[1], e[0]))
+                pagina = candidatos[:limit + 1]
+
+        proximo = None
+        if len(pagina) > limit:
+            pagina = pagina[:limit]
+            seq, timestamp, _ = pagina[-1]
+            proximo = formatar_cursor(timestamp, seq)
+        return [evento for _, _, evento in pagina], proximo
@@ -1,17 +1,47 @@
 import asyncio
 import json
 import threading
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Header, Query
+import time
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import paho.mqtt.client as mqtt
-import subprocess
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import sys
 import os
-from init_db import criar_tabelas_transacoes
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from backend.codec import decodificar
+from backend import log_eventos, metricas, transporte
+from backend.registro import obter_logger
+from api.agregados import AgregadosFrota, AGREGADOS_INTERVALO
+from api.conexoes import ConnectionManager, FiltroSubscricao
+from api.conflacao import ConflacaoStatus
+from api.coordenacao import Coordenacao
+from api.eventos_store import EventoStore
+from api.medicao import MedicaoSessoes
+from api.estado_carregadores import TabelaCarregadores
+from api.snapshot import SnapshotEstado, escolher_codificacao, etag_corresponde
+from api.supervisor import Supervisor
+from api import banco, consultas_billing
 
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
 TOKEN_API = os.getenv("TOKEN_API")
+# "processo": um processo por carregador; "frota": todos os carregadores em backend/frota.py
+CARREGADOR_MODO = os.getenv("CARREGADOR_MODO", "processo")
+FROTA_ID = os.getenv("FROTA_ID", "frota-1")
+# Porta base do /metrics dos workers de billing (o worker i usa base + i); vazio desativa
+BILLING_METRICAS_PORTA = os.getenv("BILLING_METRICAS_PORTA")
+# Segundos do log de eventos relidos no startup para reconstruir o estado (0 desativa)
+API_REPLAY_JANELA = float(os.getenv("API_REPLAY_JANELA", "86400"))
+# Tópico de controle das tarifas escutado pelos workers de billing (backend/tarifas.py)
+TOPICO_CONTROLE_TARIFAS = "billing/controle/tarifas"
+
+log = obter_logger("api")
+metricas.definir_servico("api")
 
 app = FastAPI()
 
@@ -23,36 +53,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-carregadores_ativos = {}
-billing_process = None
+# Processos filhos (carregadores, frota, billing)
+supervisor = Supervisor()
+# Carregadores hospedados na frota (CARREGADOR_MODO=frota)
+carregadores_frota: set[str] = set()
+# Vários workers da API: só o dono da trava controla os processos filhos
+coordenacao = Coordenacao()
 
 class CarregadorRequest(BaseModel):
     carregador_id: str
 
-# --- Gerenciador de Conexões WebSocket ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+class CarregadoresLoteRequest(BaseModel):
+    carregador_ids: list[str]
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+class BillingRequest(BaseModel):
+    workers: int = 1
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+class FrotaRequest(BaseModel):
+    quantidade: int
+    prefixo: str = "CP"
 
+# --- Gerenciador de Conexões WebSocket ---
 manager = ConnectionManager()
+conflacao_status = ConflacaoStatus()
 
 # --- Estado Global da Aplicação ---
-# Dicionário para armazenar o último status de cada carregador e a lista de eventos
+# Último status de cada carregador (tabela compacta com interface de dict)
 app_state = {
-    "carregadores": {},
-    "eventos": []
+    "carregadores": TabelaCarregadores(),
 }
+# Histórico de eventos (buffer circular indexado, seguro entre threads)
+eventos_store = EventoStore()
+# Estado inicial versionado e pré-serializado servido em /api/estado-inicial
+snapshot = SnapshotEstado(app_state["carregadores"], eventos_store)
+# Sessões de carga em andamento, com o consumo interpolado entre as leituras do medidor
+medicao = MedicaoSessoes()
+# Totais da frota atualizados a cada mensagem (/api/frota/resumo e WebSocket)
+agregados = AgregadosFrota()
 
 async def verificar_api_key(authorization: str | None = Header(default=None)):
     if authorization != TOKEN_API:
@@ -71,206 +108,673 @@ async def verificar_api_key_ws(token: str | None = Query(default=None)):
     return token
 
 # --- Lógica do Cliente MQTT ---
+def aplicar_mensagem(topico, payload, agora):
+    """
+    Atualiza o estado da aplicação com uma mensagem de carregador, recebida do
+    broker ou relida do log de eventos. `agora` é o instante de chegada no
+    relógio monotônico (usado na interpolação das leituras).
+    """
+    # Os agregados usam o horário de parede (energia do dia, janelas por minuto)
+    recebido_em = agora - time.monotonic() + time.time()
+    if "status" in topico:
+        carregador_id = payload.get("carregador")
+        if carregador_id:
+            app_state["carregadores"][carregador_id] = payload
+            snapshot.registrar_status(carregador_id)
+            agregados.registrar_status(payload, recebido_em)
+    elif "eventos" in topico:
+        eventos_store.adicionar(payload)
+        snapshot.registrar_evento(payload)
+        agregados.registrar_evento(payload, recebido_em)
+        if payload.get("acao") == "inicio_carga":
+            medicao.iniciar(payload, agora)
+        elif payload.get("acao") == "fim_carga":
+            medicao.finalizar(payload)
+    elif topico.endswith("/leituras"):
+        medicao.registrar_leitura(payload, agora)
+        agregados.registrar_leitura(payload, recebido_em)
+        # Mantém a energia do status (e do estado inicial) em dia sem status a cada ciclo
+        carregador_id = payload.get("carregador")
+        if app_state["carregadores"].status(carregador_id) == "ocupado":
+            app_state["carregadores"].atualizar_energia(carregador_id, payload.get("energia_consumida_kWh"))
+            snapshot.registrar_status(carregador_id)
+
+def reconstruir_estado():
+    """
+    Relê as últimas API_REPLAY_JANELA segundos do log de eventos (gravado pelo
+    backend/gravador_eventos.py) para que status, histórico de eventos e sessões
+    em andamento não comecem vazios a cada restart. Os status retidos que o
+    broker entrega depois da conexão sobrescrevem os relidos.
+    """
+    if API_REPLAY_JANELA <= 0 or not os.path.isdir(log_eventos.LOG_EVENTOS_DIR):
+        return 0
+    # Converte o horário de recebimento gravado para o relógio monotônico
+    deslocamento = time.monotonic() - time.time()
+    aplicadas = 0
+    for topico, dados, _, recebido_em in log_eventos.ler_log(desde=time.time() - API_REPLAY_JANELA):
+        try:
+            payload = decodificar(dados)
+        except ValueError:
+            continue
+        if isinstance(payload, dict):
+            aplicar_mensagem(topico, payload, recebido_em + deslocamento)
+            aplicadas += 1
+    return aplicadas
+
 def setup_mqtt_client(loop):
-    client = mqtt.Client(client_id="api-service")
+    # Um cliente (e uma subscrição) por worker da API
+    client = transporte.criar_cliente(f"api-service-{os.getpid()}")
     
     def on_connect(client, userdata, flags, rc):
         if rc == 0:
-            print("API conectada ao Broker MQTT!")
+            log.info("API conectada ao Broker MQTT!")
             # Subscreve aos tópicos de status e eventos
             client.subscribe("carregadores/+/status")
             client.subscribe("carregadores/+/eventos")
+            client.subscribe("carregadores/+/leituras")
+            # Status da frota (o LWT dela), para a vivacidade no supervisor
+            client.subscribe("frotas/+/status")
+            # Operações de controle encaminhadas entre os workers
+            coordenacao.on_connect(client)
         else:
-            print(f"Falha na conexão MQTT, código de retorno: {rc}\n")
+            log.error("Falha na conexão MQTT, código de retorno: %s", rc)
 
     def on_message(client, userdata, msg):
+        metricas.contar_recebida(msg.topic)
         try:
-            payload_str = msg.payload.decode()
-            payload = json.loads(payload_str)
-            
-            # Atualiza o estado da aplicação com base no tópico
-            if "status" in msg.topic:
-                carregador_id = payload.get("carregador")
-                if carregador_id:
-                    app_state["carregadores"][carregador_id] = payload
-            elif "eventos" in msg.topic:
-                app_state["eventos"].append(payload)
-                # Limita a lista de eventos para não crescer indefinidamente
-                if len(app_state["eventos"]) > 50:
-                    app_state["eventos"].pop(0)
-
-            asyncio.run_coroutine_threadsafe(
-                manager.broadcast(json.dumps({"topic": msg.topic, "payload": payload})), 
-                loop
+            # Aceita JSON e o formato binário; os WebSockets continuam recebendo JSON
+            payload = metricas.decodificar_medindo(decodificar, msg.payload)
+            if coordenacao.tratar_mensagem(msg.topic, payload):
+                return
+            if msg.topic.startswith("frotas/"):
+                loop.call_soon_threadsafe(supervisor.registrar_status, f"frota:{msg.topic.split('/')[1]}", payload.get("status"), time.monotonic())
+                return
+            aplicar_mensagem(msg.topic, payload, time.monotonic())
+            if msg.topic.endswith("/status"):
+                loop.call_soon_threadsafe(supervisor.registrar_status, nome_carregador(payload.get("carregador")), payload.get("status"), time.monotonic())
+
+            # Status e leituras são conflacionados (último valor vence) e enviados em frames
+            if ("status" in msg.topic or msg.topic.endswith("/leituras")) and conflacao_status.ativa:
+                conflacao_status.registrar(msg.topic, payload)
+                return
+
+            # Serializa uma única vez; o broadcast só enfileira para cada cliente
+            loop.call_soon_threadsafe(
+                manager.broadcast, json.dumps({"topic": msg.topic, "payload": payload}), msg.topic, payload
             )
 
         except Exception as e:
-            print(f"Erro ao processar mensagem MQTT: {e}")
+            log.warning("Erro ao processar mensagem MQTT: %s", e)
 
     client.on_connect = on_connect
     client.on_message = on_message
     return client
 
+async def conectar_mqtt(client, tentativas=10):
+    """
+    Conecta ao broker. Com o broker embutido, os outros workers podem subir
+    antes de o dono abrir a porta: tenta de novo por alguns segundos.
+    """
+    porta = int(transporte.MQTT_BROKER_EMBUTIDO_PORTA or 1883)
+    for tentativa in range(tentativas):
+        try:
+            return await asyncio.to_thread(client.connect, MQTT_BROKER_HOST, porta, 60)
+        except OSError as e:
+            if tentativa == tentativas - 1:
+                raise
+            log.warning("Broker MQTT indisponível (%s); tentando de novo...", e)
+            await asyncio.sleep(1)
+
+async def subir_broker_embutido(tentativas=10):
+    """
+    Sobe o broker embutido (MQTT_BROKER_EMBUTIDO_PORTA) ao assumir o controle
+    depois que o dono anterior saiu. A porta pode levar um instante para ser
+    liberada; sem ela os workers e os processos filhos ficariam sem MQTT.
+    """
+    for tentativa in range(tentativas):
+        try:
+            return await asyncio.to_thread(transporte.iniciar_broker_embutido)
+        except OSError as e:
+            if tentativa == tentativas - 1:
+                log.error("Não foi possível subir o broker MQTT embutido: %s", e)
+                return None
+            log.warning("Porta do broker MQTT embutido indisponível (%s); tentando de novo...", e)
+            await asyncio.sleep(1)
+
+async def assumir_controle():
+    """Este worker passou a ser o dono dos processos filhos (e do broker embutido)."""
+    if app.state.broker_embutido is None and transporte.MQTT_BROKER_EMBUTIDO_PORTA:
+        # Os clientes dos workers e dos filhos reconectam sozinhos ao novo broker
+        app.state.broker_embutido = await subir_broker_embutido()
+    supervisor.iniciar()
+
 @app.on_event("startup")
 async def startup_event():
     """
     Este código é executado quando a aplicação FastAPI inicia.
     """
+    # Estado anterior ao restart, antes de receber as mensagens novas
+    inicio = time.perf_counter()
+    aplicadas = await asyncio.to_thread(reconstruir_estado)
+    if aplicadas:
+        log.info("Estado reconstruído com %d mensagens do log de eventos em %.2fs", aplicadas, time.perf_counter() - inicio)
+
+    # Broker embutido (MQTT_BROKER_EMBUTIDO_PORTA), no worker dono: os
+    # processos filhos e os outros workers falam MQTT com ele em TCP; o dono,
+    # pelo transporte em memória. Um worker que assume depois sobe o broker
+    # em assumir_controle (e continua falando com ele em TCP)
+    dono = coordenacao.tentar_assumir()
+    app.state.broker_embutido = transporte.iniciar_broker_embutido() if dono else None
+
     # Guardamos o cliente no estado da aplicação para poder acessá-lo no shutdown
     main_loop = asyncio.get_running_loop()
     app.state.mqtt_client = setup_mqtt_client(main_loop)
-    app.state.mqtt_client.connect(MQTT_BROKER_HOST, 1883, 60)
-    
+    await conectar_mqtt(app.state.mqtt_client)
+    await coordenacao.iniciar(app.state.mqtt_client, assumir_controle)
+
     # Inicia o loop do MQTT em uma thread separada
     threading.Thread(target=app.state.mqtt_client.loop_forever, daemon=True).start()
 
+    if conflacao_status.ativa:
+        app.state.tarefa_conflacao = asyncio.create_task(conflacao_status.executar(manager))
+    if AGREGADOS_INTERVALO > 0:
+        app.state.tarefa_agregados = asyncio.create_task(agregados.executar(manager))
+
+    # Pool do banco + migrações pendentes. Sem banco a API sobe mesmo assim; as
+    # consultas tentam conectar de novo e respondem 503 enquanto ele não volta.
+    try:
+        await banco.iniciar()
+    except Exception as e:
+        log.warning("Banco indisponível no startup: %s", e)
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """
     Este código é executado quando a aplicação FastAPI desliga.
     """
-    print("Desconectando do MQTT...")
+    # Os processos filhos saem junto com o worker dono
+    if coordenacao.dono:
+        await supervisor.fechar()
+    log.info("Desconectando do MQTT...")
     app.state.mqtt_client.loop_stop()
     app.state.mqtt_client.disconnect()
+    # A porta do broker é liberada antes da trava, para o próximo dono
+    if app.state.broker_embutido is not None:
+        app.state.broker_embutido.parar()
+    coordenacao.fechar()
+    await banco.fechar()
 # ----------------------------------------------------
 
 
+# --- Controle dos processos ---
+# Carregadores (modo processo), frota e workers de billing são processos
+# filhos gerenciados pelo supervisor (api/supervisor.py).
+def nome_carregador(carregador_id):
+    return f"carregador:{carregador_id}"
+
+def nome_frota():
+    return f"frota:{FROTA_ID}"
+
+def frota_ativa():
+    return supervisor.ativo(nome_frota())
+
+def enviar_comando_frota(acao, carregador_ids=()):
+    comando = {"acao": acao, "carregadores": list(carregador_ids)}
+    app.state.mqtt_client.publish(f"frotas/{FROTA_ID}/comandos", json.dumps(comando), qos=1)
+    metricas.contar_publicada(f"frotas/{FROTA_ID}/comandos")
+
+def carregador_ativo(carregador_id):
+    return carregador_id in carregadores_frota or supervisor.ativo(nome_carregador(carregador_id))
+
+async def iniciar_na_frota(carregador_ids):
+    """
+    Adiciona carregadores à frota, iniciando o processo da frota se necessário.
+    Os IDs iniciais vão na linha de comando para não depender da subscrição MQTT
+    da frota estar pronta; os adicionados depois entram no comando guardado
+    pelo supervisor, para que um reinício da frota os traga de volta.
+    """
+    if frota_ativa():
+        enviar_comando_frota("iniciar", carregador_ids)
+        supervisor.workers[nome_frota()].comando.extend(carregador_ids)
+        worker = supervisor.workers[nome_frota()]
+    else:
+        comando = [sys.executable, "backend/frota.py", FROTA_ID, "0", *carregador_ids]
+        worker = await supervisor.iniciar_worker(nome_frota(), comando, os.environ.copy(), "frota")
+    carregadores_frota.update(carregador_ids)
+    return worker
+
+async def iniciar_carregadores(carregador_ids):
+    """Inicia carregadores ainda inativos, na frota ou um processo por carregador."""
+    novos = [carregador_id for carregador_id in dict.fromkeys(carregador_ids) if not carregador_ativo(carregador_id)]
+    if not novos:
+        return novos, None
+    if CARREGADOR_MODO == "frota":
+        return novos, await iniciar_na_frota(novos)
+    env = os.environ.copy()
+    # sys.executable garante que estamos usando o mesmo interpretador Python
+    # que está rodando a API para executar o script.
+    await supervisor.iniciar_workers([
+        (nome_carregador(carregador_id), [sys.executable, "backend/carregador.py", carregador_id], env, "carregador")
+        for carregador_id in novos
+    ])
+    return novos, None
+
+async def parar_carregadores(carregador_ids):
+    """Para os carregadores indicados (os da frota saem da frota). Devolve os parados."""
+    na_frota = [carregador_id for carregador_id in carregador_ids if carregador_id in carregadores_frota]
+    if na_frota:
+        enviar_comando_frota("parar", na_frota)
+        carregadores_frota.difference_update(na_frota)
+        worker = supervisor.workers.get(nome_frota())
+        if worker is not None:
+            worker.comando[4:] = [c for c in worker.comando[4:] if c in carregadores_frota]
+    parados = await supervisor.parar([nome_carregador(carregador_id) for carregador_id in carregador_ids])
+    return na_frota + [nome.split(":", 1)[1] for nome in parados]
+
 # --- Endpoints da API ---
 
 @app.post("/api/carregadores", status_code=201, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
 async def iniciar_carregador(request: CarregadorRequest):
     """
     Inicia um novo processo de carregador.
     """
     carregador_id = request.carregador_id
-    if carregador_id in carregadores_ativos:
+    if carregador_ativo(carregador_id):
         return {"status": "erro", "mensagem": f"Carregador {carregador_id} já está em execução."}
 
     try:
-        # sys.executable garante que estamos usando o mesmo interpretador Python
-        # que está rodando a API para executar o script.
-        comando = [sys.executable, "backend/carregador.py", carregador_id]
-        
-        # Popen inicia o processo em segundo plano, sem bloquear a API
-        processo = subprocess.Popen(comando, env=os.environ.copy())
-        
-        # Armazena o objeto do processo no nosso dicionário
-        carregadores_ativos[carregador_id] = processo
-        
-        print(f"[API] Iniciado carregador {carregador_id} com PID: {processo.pid}")
-        return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} iniciado.", "pid": processo.pid}
+        _, frota = await iniciar_carregadores([carregador_id])
+        if frota is not None:
+            return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} iniciado na frota {FROTA_ID}.", "pid": frota.pid}
+        return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} iniciado.", "pid": supervisor.workers[nome_carregador(carregador_id)].pid}
     except Exception as e:
         return {"status": "erro", "mensagem": f"Falha ao iniciar carregador: {e}"}
-    
+
+@app.post("/api/carregadores/lote", status_code=201, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
+async def iniciar_carregadores_lote(request: CarregadoresLoteRequest):
+    """
+    Inicia vários carregadores numa única requisição (os já ativos são ignorados).
+    """
+    try:
+        novos, _ = await iniciar_carregadores(request.carregador_ids)
+    except Exception as e:
+        return {"status": "erro", "mensagem": f"Falha ao iniciar carregadores: {e}"}
+    if not novos:
+        return {"status": "erro", "mensagem": "Nenhum carregador novo para iniciar."}
+    return {"status": "sucesso", "mensagem": f"{len(novos)} carregadores iniciados.", "iniciados": novos}
+
+@app.post("/api/carregadores/lote/parar", status_code=200, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
+async def parar_carregadores_lote(request: CarregadoresLoteRequest):
+    """
+    Para vários carregadores numa única requisição; responde depois que todos
+    os processos saíram.
+    """
+    parados = await parar_carregadores(request.carregador_ids)
+    if not parados:
+        return {"status": "erro", "mensagem": "Nenhum dos carregadores está em execução."}
+    return {"status": "sucesso", "mensagem": f"{len(parados)} carregadores parados.", "parados": parados}
+
+@coordenacao.operacao
+async def parar_todos_carregadores():
+    return await parar_carregadores([*carregadores_frota, *(nome.split(":", 1)[1] for nome in supervisor.nomes("carregador"))])
+
+def limpar_estado():
+    eventos_store.limpar()
+    medicao.limpar()
+    snapshot.reiniciar()
+
+coordenacao.registrar_difusao("limpar_estado", limpar_estado)
+
 @app.delete("/api/limpar-carregadores-e-eventos", status_code=200, dependencies=[Depends(verificar_api_key)])
 async def limpar_carregadores_e_eventos():
-    global carregadores_ativos
-    carregadores_ativos = {}
-    app_state["eventos"] = []
+    # Para os processos de verdade (no worker dono) antes de esquecê-los
+    await parar_todos_carregadores()
+    # Cada worker tem o próprio histórico: os demais limpam pela difusão
+    limpar_estado()
+    coordenacao.difundir("limpar_estado")
     return {"status": "sucesso", "mensagem": "Carregadores e eventos limpos."}
-    
+
 @app.delete("/api/carregadores/{carregador_id}", status_code=200, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
 async def parar_carregador(carregador_id: str):
     """
     Para um processo de carregador em execução.
     """
-    if carregador_id not in carregadores_ativos:
+    if not carregador_ativo(carregador_id):
         return {"status": "erro", "mensagem": f"Carregador {carregador_id} não encontrado ou não está em execução."}
 
+    na_frota = carregador_id in carregadores_frota
     try:
-        processo = carregadores_ativos[carregador_id]
-        processo.terminate()  # Envia um sinal para o processo terminar
-        processo.wait(timeout=5) # Espera um pouco para o processo encerrar
-        
-        del carregadores_ativos[carregador_id]
-        
-        print(f"[API] Parado carregador {carregador_id} com PID: {processo.pid}")
-        return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} parado."}
+        await parar_carregadores([carregador_id])
     except Exception as e:
         return {"status": "erro", "mensagem": f"Falha ao parar carregador: {e}"}
-    
+    if na_frota:
+        return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} removido da frota {FROTA_ID}."}
+    return {"status": "sucesso", "mensagem": f"Carregador {carregador_id} parado."}
+
 @app.get("/api/carregadores/ativos", dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
 async def listar_carregadores_ativos():
     """
     Lista os IDs de todos os carregadores atualmente gerenciados pela API.
     """
-    # Verifica se os processos ainda estão rodando
-    ativos = []
-    for cid, processo in list(carregadores_ativos.items()):
-        if processo.poll() is None: # poll() retorna None se o processo ainda está rodando
-            ativos.append(cid)
-        else:
-            # Limpa processos que morreram sozinhos
-            del carregadores_ativos[cid]
-            
+    # Processos que caíram e aguardam reinício continuam na lista
+    ativos = [nome.split(":", 1)[1] for nome in supervisor.nomes("carregador")]
+    if frota_ativa():
+        ativos.extend(carregadores_frota)
     return {"carregadores_ativos": ativos}
 
+@app.get("/api/supervisor", dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
+async def estado_supervisor():
+    """
+    Processos supervisionados: estado, PID, reinícios, último código de saída
+    e vivacidade (processo em execução e status MQTT diferente de 'offline').
+    """
+    return {"workers": supervisor.resumo()}
+
+@app.post("/api/frota/carregadores", status_code=201, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
+async def iniciar_carregadores_frota(request: FrotaRequest):
+    """
+    Inicia vários carregadores de uma vez na frota (para testes de carga).
+    """
+    novos = [f"{request.prefixo}{i:05d}" for i in range(request.quantidade)]
+    novos = [carregador_id for carregador_id in novos if not carregador_ativo(carregador_id)]
+
+    if not novos:
+        return {"status": "erro", "mensagem": "Nenhum carregador novo para iniciar."}
+
+    try:
+        worker = await iniciar_na_frota(novos)
+        return {"status": "sucesso", "mensagem": f"{len(novos)} carregadores iniciados na frota {FROTA_ID}.", "pid": worker.pid}
+    except Exception as e:
+        return {"status": "erro", "mensagem": f"Falha ao iniciar carregadores na frota: {e}"}
+
+@app.delete("/api/frota", status_code=200, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
+async def parar_frota():
+    """
+    Para o processo da frota e todos os carregadores hospedados nele.
+    """
+    if not frota_ativa():
+        return {"status": "erro", "mensagem": "A frota não está em execução."}
+
+    try:
+        pid = supervisor.workers[nome_frota()].pid
+        await supervisor.parar([nome_frota()])
+        carregadores_frota.clear()
+
+        log.info("Parada frota %s com PID: %s", FROTA_ID, pid)
+        return {"status": "sucesso", "mensagem": f"Frota {FROTA_ID} parada."}
+    except Exception as e:
+        return {"status": "erro", "mensagem": f"Falha ao parar a frota: {e}"}
+
+def billing_ativos():
+    return [supervisor.workers[nome] for nome in supervisor.nomes("billing")]
+
 @app.post("/api/billing/start", status_code=201, dependencies=[Depends(verificar_api_key)])
-async def iniciar_billing():
+@coordenacao.operacao
+async def iniciar_billing(request: BillingRequest | None = None):
     """
-    Inicia o processo do serviço de billing.
+    Inicia o serviço de billing. Com `workers` > 1, inicia várias instâncias
+    que dividem os carregadores por partição (leituras e eventos de uma sessão
+    ficam no mesmo worker e as tarifas por horário usam o perfil completo).
     """
-    global billing_process
-    # Verifica se o processo já não está rodando
-    if billing_process and billing_process.poll() is None:
+    workers = request.workers if request else 1
+    # Verifica se o serviço já não está rodando
+    if billing_ativos():
         return {"status": "erro", "mensagem": "O serviço de billing já está em execução."}
+    if workers < 1:
+        return {"status": "erro", "mensagem": "O número de workers deve ser pelo menos 1."}
+
+    especificacoes = []
+    comando = [sys.executable, "backend/billing.py"]
+    for i in range(workers):
+        env = os.environ.copy()
+        env["BILLING_WORKER_ID"] = f"worker-{i}"
+        if workers > 1:
+            env.setdefault("BILLING_MODO_ESCALA", "particionado")
+            env["BILLING_PARTICAO"] = f"{i}/{workers}"
+        if BILLING_METRICAS_PORTA:
+            env["BILLING_METRICAS_PORTA"] = str(int(BILLING_METRICAS_PORTA) + i)
+        especificacoes.append((f"billing:{i}", comando, env, "billing"))
 
     try:
-        comando = [sys.executable, "backend/billing.py"]
-        billing_process = subprocess.Popen(comando, env=os.environ.copy())
-        
-        print(f"[API] Iniciado serviço de billing com PID: {billing_process.pid}")
-        return {"status": "sucesso", "mensagem": "Serviço de billing iniciado.", "pid": billing_process.pid}
+        iniciados = await supervisor.iniciar_workers(especificacoes)
+        pids = [worker.pid for worker in iniciados]
+        return {"status": "sucesso", "mensagem": f"Serviço de billing iniciado com {workers} worker(s).", "pid": pids[0], "pids": pids}
     except Exception as e:
-        billing_process = None
+        await supervisor.parar([nome for nome, _, _, _ in especificacoes])
         return {"status": "erro", "mensagem": f"Falha ao iniciar o serviço de billing: {e}"}
-    
+
 @app.post("/api/billing/stop", status_code=200, dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
 async def parar_billing():
     """
-    Para o processo do serviço de billing.
+    Para todos os processos do serviço de billing.
     """
-    global billing_process
-    if not billing_process or billing_process.poll() is not None:
+    ativos = billing_ativos()
+    if not ativos:
         return {"status": "erro", "mensagem": "O serviço de billing não está em execução."}
 
     try:
-        pid = billing_process.pid
-        billing_process.terminate()
-        billing_process.wait(timeout=5)
-        billing_process = None
-        
-        print(f"[API] Parado serviço de billing com PID: {pid}")
+        pids = [worker.pid for worker in ativos]
+        # Espera o desligamento ordenado (filas esvaziadas e transações gravadas)
+        await supervisor.parar([worker.nome for worker in ativos])
+        log.info("Parado serviço de billing com PIDs: %s", pids)
         return {"status": "sucesso", "mensagem": "Serviço de billing parado."}
     except Exception as e:
         return {"status": "erro", "mensagem": f"Falha ao parar o serviço de billing: {e}"}
-    
+
 @app.get("/api/billing/status", dependencies=[Depends(verificar_api_key)])
+@coordenacao.operacao
 async def status_billing():
     """
     Verifica e retorna o status do serviço de billing.
     """
-    if billing_process and billing_process.poll() is None:
-        return {"status": "ativo", "pid": billing_process.pid}
-    return {"status": "inativo", "pid": None}
+    ativos = billing_ativos()
+    if ativos:
+        return {"status": "ativo", "pid": ativos[0].pid, "pids": [worker.pid for worker in ativos]}
+    return {"status": "inativo", "pid": None, "pids": []}
+
+@app.post("/api/tarifas/recarregar", dependencies=[Depends(verificar_api_key)])
+async def recarregar_tarifas():
+    """
+    Pede a todos os workers de billing que recarreguem as tarifas do banco
+    (sem isso, as alterações valem a partir da próxima recarga periódica).
+    """
+    app.state.mqtt_client.publish(TOPICO_CONTROLE_TARIFAS, json.dumps({"acao": "recarregar"}), qos=1)
+    metricas.contar_publicada(TOPICO_CONTROLE_TARIFAS)
+    return {"status": "sucesso", "mensagem": "Recarga de tarifas solicitada."}
+
+# --- Métricas ---
+@app.get("/metrics")
+async def metrics():
+    """
+    Métricas no formato de exposição do Prometheus. Os valores instantâneos
+    (filas dos WebSockets, sessões ativas) são calculados na coleta.
+    """
+    manager.atualizar_metricas()
+    metricas.SESSOES_ATIVAS.labels(metricas.SERVICO).set(agregados.sessoes_ativas)
+    conteudo, tipo = metricas.gerar()
+    return Response(content=conteudo, media_type=tipo)
+
+# --- Analytics de Billing ---
+# As consultas usam o pool assíncrono de api/banco.py e não bloqueiam o loop
+# de eventos (nem os WebSockets) enquanto esperam o banco.
+
+@app.exception_handler(banco.BancoIndisponivel)
+async def banco_indisponivel(request: Request, exc: banco.BancoIndisponivel):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)})
+
+def periodo_padrao(inicio: datetime | None, fim: datetime | None):
+    fim = fim or datetime.now(timezone.utc)
+    inicio = inicio or fim - timedelta(days=7)
+    # Datas sem fuso são tratadas como UTC
+    if fim.tzinfo is None:
+        fim = fim.replace(tzinfo=timezone.utc)
+    if inicio.tzinfo is None:
+        inicio = inicio.replace(tzinfo=timezone.utc)
+    return inicio, fim
+
+@app.get("/api/billing/carregadores", dependencies=[Depends(verificar_api_key)])
+async def analytics_por_carregador(inicio: datetime | None = None, fim: datetime | None = None, limit: int = Query(default=100, ge=1, le=10000)):
+    """
+    Receita, energia e sessões por carregador no período (padrão: últimos 7 dias).
+    """
+    inicio, fim = periodo_padrao(inicio, fim)
+    return {"inicio": inicio, "fim": fim, "carregadores": await consultas_billing.receita_por_carregador(inicio, fim, limit)}
+
+@app.get("/api/billing/carregadores/{carregador_id}", dependencies=[Depends(verificar_api_key)])
+async def analytics_serie_carregador(carregador_id: str, granularidade: Literal["hora", "dia"] = "hora", inicio: datetime | None = None, fim: datetime | None = None):
+    """
+    Série temporal de receita/energia de um carregador, por hora ou por dia.
+    """
+    inicio, fim = periodo_padrao(inicio, fim)
+    return {"carregador": carregador_id, "granularidade": granularidade, "serie": await consultas_billing.serie_carregador(carregador_id, granularidade, inicio, fim)}
+
+@app.get("/api/billing/carros", dependencies=[Depends(verificar_api_key)])
+async def analytics_por_carro(inicio: datetime | None = None, fim: datetime | None = None, limit: int = Query(default=100, ge=1, le=10000)):
+    """
+    Energia, custo e sessões por carro no período (padrão: últimos 7 dias).
+    """
+    inicio, fim = periodo_padrao(inicio, fim)
+    return {"inicio": inicio, "fim": fim, "carros": await consultas_billing.consumo_por_carro(inicio, fim, limit)}
+
+@app.get("/api/billing/carros/{carro_id}", dependencies=[Depends(verificar_api_key)])
+async def analytics_serie_carro(carro_id: str, inicio: datetime | None = None, fim: datetime | None = None):
+    """
+    Consumo diário de um carro.
+    """
+    inicio, fim = periodo_padrao(inicio, fim)
+    return {"carro": carro_id, "serie": await consultas_billing.serie_carro(carro_id, inicio, fim)}
+
+@app.get("/api/billing/resumo", dependencies=[Depends(verificar_api_key)])
+async def analytics_resumo(granularidade: Literal["hora", "dia"] = "hora", inicio: datetime | None = None, fim: datetime | None = None):
+    """
+    Totais da frota por hora ou por dia.
+    """
+    inicio, fim = periodo_padrao(inicio, fim)
+    return {"granularidade": granularidade, "serie": await consultas_billing.resumo_frota(granularidade, inicio, fim)}
+
+@app.get("/api/billing/transacoes", dependencies=[Depends(verificar_api_key)])
+async def analytics_transacoes(carregador: str | None = None, carro: str | None = None, antes_de: int | None = None, limit: int = Query(default=100, ge=1, le=1000), divergentes: bool = False):
+    """
+    Transações mais recentes. Para a próxima página, passe `antes_de` com o
+    `proximo_antes_de` da resposta. Com `divergentes=true`, só as cobranças
+    cujo total não bateu com as leituras do medidor (auditoria).
+    """
+    transacoes = await consultas_billing.listar_transacoes(carregador, carro, antes_de, limit, divergentes)
+    proximo = transacoes[-1]["id"] if len(transacoes) == limit else None
+    return {"transacoes": transacoes, "proximo_antes_de": proximo}
+
+@app.get("/api/banco/estatisticas", dependencies=[Depends(verificar_api_key)])
+async def estatisticas_banco():
+    """
+    Estado do pool de conexões e tempo de cada consulta (chamadas, erros,
+    média e máximo em ms).
+    """
+    return {"pool": banco.estado_pool(), "consultas": banco.estatisticas.resumo()}
 
 @app.get("/api/estado-inicial", dependencies=[Depends(verificar_api_key)])
-async def get_initial_state():
+async def get_initial_state(request: Request, desde: int | None = None, instancia: str | None = None):
     """
     Fornece o estado completo atual quando o frontend carrega a página.
+
+    A resposta traz a `versao` do estado e um ETag; com If-None-Match igual ao
+    ETag atual a resposta é 304. Um cliente que reconecta pode passar
+    `desde=<versao>` para receber só os carregadores alterados e os eventos
+    novos; se a versão for antiga demais, recebe o snapshot completo.
+
+    Cada worker (e cada execução da API) tem a própria numeração de versões:
+    o delta só é servido com a `instancia` da resposta anterior. Sem ela, ou
+    se a requisição cair em outro worker, a resposta é o snapshot completo.
+    """
+    if desde is not None and instancia == snapshot.instancia:
+        mudancas = snapshot.mudancas_desde(desde)
+        if mudancas is not None:
+            return mudancas
+
+    # O ETag muda com a codificação (identidade, gzip, br), como o corpo
+    codificacao = escolher_codificacao(request.headers.get("accept-encoding"))
+    etag = snapshot.etag(codificacao)
+    if etag_corresponde(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+    corpo, etag = await snapshot.serializado(codificacao)
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if codificacao != "identity":
+        headers["Content-Encoding"] = codificacao
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+@app.get("/api/sessoes", dependencies=[Depends(verificar_api_key)])
+async def listar_sessoes():
+    """
+    Sessões de carga em andamento com a última energia medida e a estimada
+    para agora (interpolada pela potência entre as leituras do medidor).
     """
-    return app_state
+    return {"sessoes": medicao.estimar(time.monotonic())}
+
+@app.get("/api/frota/resumo", dependencies=[Depends(verificar_api_key)])
+async def resumo_frota():
+    """
+    Totais da frota mantidos a cada mensagem: carregadores por status (geral e
+    por local), potência instantânea, energia do dia e sessões iniciadas e
+    finalizadas nas últimas janelas. O mesmo resumo é enviado aos WebSockets
+    no tópico 'frota/resumo'.
+    """
+    return agregados.resumo()
+
+@app.get("/api/eventos", dependencies=[Depends(verificar_api_key)])
+async def listar_eventos(
+    since: int | None = Query(default=None, description="Apenas eventos com timestamp de Lamport maior que este"),
+    carregador: str | None = None,
+    carro: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
+):
+    """
+    Consulta o histórico de eventos em ordem de timestamp de Lamport, com
+    paginação por cursor (use `proximo_cursor` da resposta anterior).
+    """
+    try:
+        eventos, proximo_cursor = eventos_store.consultar(since, carregador, carro, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor inválido")
+    return {"eventos": eventos, "proximo_cursor": proximo_cursor}
 
 @app.websocket("/ws", dependencies=[Depends(verificar_api_key_ws)])
 async def websocket_endpoint(websocket: WebSocket):
     """
     Mantém a conexão em tempo real com o frontend.
+
+    Sem subscrição, o cliente recebe todas as atualizações. Para filtrar, envie
+    {"acao": "subscrever", "topicos": [...], "carregadores": [...], "eventos": [...], "delta": true};
+    {"acao": "cancelar"} volta a receber tudo. Só o resumo da frota, a cada
+    AGREGADOS_INTERVALO segundos: {"acao": "subscrever", "topicos": ["frota/resumo"]}.
     """
-    await manager.connect(websocket)
+    cliente = await manager.connect(websocket)
     try:
         while True:
-            # Mantém a conexão viva. Pode ser usado para receber mensagens do frontend se necessário.
-            await websocket.receive_text()
+            texto = await websocket.receive_text()
+            try:
+                mensagem = json.loads(texto)
+                if mensagem.get("acao") == "subscrever":
+                    manager.subscrever(websocket, FiltroSubscricao.de_mensagem(mensagem), app_state["carregadores"])
+                elif mensagem.get("acao") == "cancelar":
+                    manager.subscrever(websocket, None, app_state["carregadores"])
+                else:
+                    raise ValueError("ação desconhecida")
+            except (ValueError, AttributeError) as e:
+                cliente.enfileirar(json.dumps({"erro": f"Mensagem inválida: {e}"}))
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        print("Cliente WebSocket desconectado")
\ No newline at end of file
+        log.info("Cliente WebSocket desconectado")
+    except RuntimeError:
+        # O socket foi fechado pelo gerenciador (cliente lento ou envio falhou)
+        pass
+    finally:
+        manager.disconnect(websocket)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import os
+import threading
+
+# Até quantos segundos depois da última leitura o consumo é extrapolado. Sem
+# leituras novas por mais tempo (carregador travado ou offline) a estimativa
+# para de crescer.
+MEDICAO_HORIZONTE = float(os.getenv("MEDICAO_HORIZONTE", "120"))
+
+
+class MedicaoSessoes:
+    """
+    Sessões de carga em andamento, montadas a partir dos eventos inicio_carga /
+    fim_carga e das leituras periódicas do medidor (carregadores/<id>/leituras).
+
+    Entre duas leituras o consumo é interpolado pela potência observada nas
+    duas últimas leituras (ou desde o início da sessão), usando o instante de
+    chegada de cada mensagem, já que o timestamp de Lamport não mede tempo.
+    """
+
+    def __init__(self, horizonte=MEDICAO_HORIZONTE):
+        self.horizonte = horizonte
+        self._sessoes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _nova(self, carregador_id, sessao, carro, agora):
+        sessao_atual = {
+            "carregador": carregador_id,
+            "sessao": sessao,
+            "carro": carro,
+            "leituras": 0,
+            "energia_kWh": 0.0,
+            "lida_em": agora,
+            "potencia_kW": 0.0,
+        }
+        self._sessoes[carregador_id] = sessao_atual
+        return sessao_atual
+
+    def iniciar(self, evento, agora):
+        with self._lock:
+            self._nova(evento.get("carregador"), evento.get("sessao"), evento.get("carro"), agora)
+
+    def registrar_leitura(self, leitura, agora):
+        carregador_id = leitura.get("carregador")
+        energia = leitura.get("energia_consumida_kWh")
+        if carregador_id is None or energia is None:
+            return
+        with self._lock:
+            sessao_atual = self._sessoes.get(carregador_id)
+            if sessao_atual is None or sessao_atual["sessao"] != leitura.get("sessao"):
+                # Sessão iniciada antes da API subir (ou inicio_carga perdido)
+                sessao_atual = self._nova(carregador_id, leitura.get("sessao"), None, agora)
+                sessao_atual["energia_kWh"] = energia
+                sessao_atual["leituras"] = 1
+                return
+            intervalo = agora - sessao_atual["lida_em"]
+            if intervalo > 0 and energia >= sessao_atual["energia_kWh"]:
+                sessao_atual["potencia_kW"] = (energia - sessao_atual["energia_kWh"]) / (intervalo / 3600)
+            sessao_atual["energia_kWh"] = energia
+            sessao_atual["lida_em"] = agora
+            sessao_atual["leituras"] += 1
+
+    def finalizar(self, evento):
+        with self._lock:
+            sessao_atual = self._sessoes.get(evento.get("carregador"))
+            if sessao_atual is not None and sessao_atual["sessao"] == evento.get("sessao"):
+                del self._sessoes[evento.get("carregador")]
+
+    def estimar(self, agora):
+        """Consumo de cada sessão em andamento: o último medido e o estimado para agora."""
+        with self._lock:
+            sessoes = [dict(s) for s in self._sessoes.values()]
+        resultado = []
+        for s in sessoes:
+            decorrido = agora - s["lida_em"]
+            estimada = s["energia_kWh"] + s["potencia_kW"] * min(decorrido, self.horizonte) / 3600
+            resultado.append({
+                "carregador": s["carregador"],
+                "sessao": s["sessao"],
+                "carro": s["carro"],
+                "leituras": s["leituras"],
+                "energia_medida_kWh": s["energia_kWh"],
+                "energia_estimada_kWh": round(estimada, 3),
+                "potencia_kW": round(s["potencia_kW"], 3),
+                "ultima_leitura_ha_s": round(decorrido, 1),
+            })
+        return resultado
+
+    def limpar(self):
+        with self._lock:
+            self._sessoes.clear()
@@ -0,0 +1,158 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from api.estado_carregadores import TabelaCarregadores
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele servimos apenas gzip/identidade
+    brotli = None
+
+# Quantas mudanças recentes são lembradas para responder "mudanças desde a versão X"
+SNAPSHOT_HISTORICO = int(os.getenv("SNAPSHOT_HISTORICO", "20000"))
+EVENTOS_SNAPSHOT = 50
+# Sufixo do ETag de cada codificação: corpos diferentes não podem ter o mesmo ETag forte
+SUFIXOS_ETAG = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+
+class SnapshotEstado:
+    """
+    Versão serializada e em cache do estado inicial servido aos dashboards.
+
+    Cada mudança de estado (status de carregador ou evento) incrementa a
+    versão. A serialização em JSON (e a compressão) acontece no máximo uma vez
+    por versão, na primeira requisição que a pede; as demais recebem os mesmos
+    bytes. Um histórico limitado das mudanças permite responder apenas o que
+    mudou desde uma versão que o cliente já tem.
+    """
+
+    def __init__(self, carregadores: TabelaCarregadores, eventos_store, historico=SNAPSHOT_HISTORICO):
+        self.carregadores = carregadores
+        self.eventos_store = eventos_store
+        # Identifica esta execução da API, para um ETag antigo não casar após reinício
+        self.instancia = uuid.uuid4().hex[:8]
+        self.versao = 0
+        self._mudancas = deque(maxlen=historico)  # (versao, "status"|"evento", carregador_id|evento)
+        self._lock = threading.Lock()
+        self._cache_versao = None
+        self._cache: dict[str, bytes] = {}
+
+    def etag(self, codificacao: str = "identity", versao: int | None = None):
+        return f'"{self.instancia}-{self.versao if versao is None else versao}{SUFIXOS_ETAG[codificacao]}"'
+
+    def registrar_status(self, carregador_id: str):
+        with self._lock:
+            self.versao += 1
+            self._mudancas.append((self.versao, "status", carregador_id))
+
+    def registrar_evento(self, evento: dict):
+        with self._lock:
+            self.versao += 1
+            self._mudancas.append((self.versao, "evento", evento))
+
+    def reiniciar(self):
+        """Descarta o histórico de mudanças (clientes passam a receber o snapshot completo)."""
+        with self._lock:
+            self.versao += 1
+            self._mudancas.clear()
+
+    async def serializado(self, codificacao: str = "identity") -> tuple[bytes, str]:
+        """
+        Retorna os bytes do snapshot completo na codificação pedida e o ETag.
+        A trava só protege o cache: a montagem do JSON e a compressão rodam numa
+        thread, sem segurar a thread do MQTT (registrar_status) nem o loop.
+        """
+        with self._lock:
+            versao = self.versao
+            if self._cache_versao != versao:
+                self._cache_versao = versao
+                self._cache = {}
+            cache = self._cache
+            corpo = cache.get(codificacao)
+            bruto = cache.get("identity")
+        etag = self.etag(codificacao, versao)
+        if corpo is not None:
+            return corpo, etag
+
+        bruto, corpo = await asyncio.to_thread(self._serializar, versao, bruto, codificacao)
+        with self._lock:
+            # Se a versão mudou enquanto isso, o cache já é de outra versão
+            if self._cache is cache:
+                cache["identity"] = bruto
+                cache[codificacao] = corpo
+        return corpo, etag
+
+    def _serializar(self, versao: int, bruto: bytes | None, codificacao: str) -> tuple[bytes, bytes]:
+        if bruto is None:
+            # Os carregadores já saem em JSON da tabela compacta; a tabela pode
+            # estar à frente de `versao`, nunca atrás
+            eventos = json.dumps(self.eventos_store.ultimos(EVENTOS_SNAPSHOT))
+            estado = f'{{"versao": {versao}, "instancia": "{self.instancia}", "carregadores": {self.carregadores.json()}, "eventos": {eventos}}}'
+            bruto = estado.encode()
+        if codificacao == "gzip":
+            return bruto, gzip.compress(bruto, compresslevel=5)
+        if codificacao == "br":
+            return bruto, brotli.compress(bruto, quality=5)
+        return bruto, bruto
+
+    def mudancas_desde(self, versao: int) -> dict | None:
+        """
+        Carregadores alterados e eventos recebidos depois de `versao`. Retorna
+        None se essa versão já saiu do histórico (o cliente deve recarregar o
+        snapshot completo).
+        """
+        with self._lock:
+            atual = self.versao
+            if versao > atual:
+                return None
+            if versao < atual and (not self._mudancas or self._mudancas[0][0] > versao + 1):
+                return None
+
+            alterados = set()
+            eventos = []
+            for v, tipo, valor in reversed(self._mudancas):
+                if v <= versao:
+                    break
+                if tipo == "status":
+                    alterados.add(valor)
+                else:
+                    eventos.append(valor)
+
+        eventos.reverse()
+        return {
+            "versao": atual,
+            "instancia": self.instancia,
+            "carregadores": {cid: self.carregadores.get(cid) for cid in alterados},
+            "eventos": eventos,
+        }
+
+
+def escolher_codificacao(accept_encoding: str | None) -> str:
+    aceitas = {parte.split(";")[0].strip() for parte in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in aceitas:
+        return "br"
+    if "gzip" in aceitas:
+        return "gzip"
+    return "identity"
+
+
+def etag_corresponde(if_none_match: str | None, etag: str) -> bool:
+    """
+    If-None-Match casa com o ETag: aceita '*', uma lista separada por vírgulas
+    e ETags fracos (W/"..."), comparados pela forma fraca como manda a RFC 9110.
+    """
+    if not if_none_match:
+        return False
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato == "*":
+            return True
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == etag:
+            return True
+    return False
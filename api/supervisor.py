@@ -0,0 +1,269 @@
+import asyncio
+import os
+import subprocess
+import time
+from backend import metricas
+from backend.registro import obter_logger
+
+SUPERVISOR_INTERVALO = float(os.getenv("SUPERVISOR_INTERVALO", "0.5"))  # segundos entre verificações
+SUPERVISOR_TIMEOUT_PARADA = float(os.getenv("SUPERVISOR_TIMEOUT_PARADA", "5"))  # SIGTERM -> SIGKILL
+SUPERVISOR_BACKOFF_INICIAL = float(os.getenv("SUPERVISOR_BACKOFF_INICIAL", "1"))
+SUPERVISOR_BACKOFF_MAX = float(os.getenv("SUPERVISOR_BACKOFF_MAX", "60"))
+# Um worker que ficou de pé por este tempo volta ao backoff inicial ao cair
+SUPERVISOR_ESTAVEL_APOS = float(os.getenv("SUPERVISOR_ESTAVEL_APOS", "60"))
+# Reinicia um worker cujo processo segue vivo mas cujo status MQTT (LWT) está
+# 'offline' há mais que isso: processo travado ou sem rede. Desativado por
+# padrão (0): só é seguro com carregadores e frota que republicam o status a
+# cada conexão, senão o 'offline' retido de uma queda do broker derruba
+# processos saudáveis.
+SUPERVISOR_OFFLINE_REINICIO = float(os.getenv("SUPERVISOR_OFFLINE_REINICIO", "0"))
+
+log = obter_logger("supervisor")
+
+
+class Worker:
+    """Um processo supervisionado e o que se sabe da sua saúde."""
+
+    def __init__(self, nome, comando, env=None, tipo="worker"):
+        self.nome = nome
+        self.tipo = tipo
+        # Mutável: a frota acrescenta os carregadores que hospeda, para que um
+        # reinício os traga de volta
+        self.comando = comando
+        self.env = env
+        self.processo: subprocess.Popen | None = None
+        # iniciando | executando | parando | reiniciando | parado
+        self.estado = "parado"
+        self.reinicios = 0
+        self.ultimo_codigo = None
+        self.iniciado_em = None
+        self.backoff = SUPERVISOR_BACKOFF_INICIAL
+        self.proximo_inicio = None
+        self.prazo_parada = None
+        self.parado: asyncio.Future | None = None
+        self.lancado: asyncio.Future | None = None  # resolvido quando sai de 'iniciando'
+        self.status_mqtt = None
+        self.status_desde = None
+
+    @property
+    def pid(self):
+        return self.processo.pid if self.processo is not None else None
+
+    @property
+    def ativo(self):
+        return self.estado in ("iniciando", "executando", "reiniciando")
+
+    def resumo(self, agora):
+        vivo = self.estado == "executando" and self.status_mqtt != "offline"
+        return {
+            "nome": self.nome,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "pid": self.pid,
+            "vivo": vivo,
+            "status_mqtt": self.status_mqtt,
+            "status_ha_s": round(agora - self.status_desde, 1) if self.status_desde is not None else None,
+            "em_execucao_ha_s": round(agora - self.iniciado_em, 1) if self.iniciado_em is not None and self.estado == "executando" else None,
+            "reinicios": self.reinicios,
+            "ultimo_codigo_saida": self.ultimo_codigo,
+        }
+
+
+class Supervisor:
+    """
+    Ciclo de vida dos processos iniciados pela API (carregadores, frota,
+    billing) sem bloquear o loop de eventos.
+
+    Uma única tarefa de vigia verifica todos os processos a cada
+    SUPERVISOR_INTERVALO segundos com `poll()` (waitpid sem bloqueio), o que
+    recolhe os filhos que terminaram. Um worker que cai sem ter sido parado é
+    reiniciado com backoff exponencial. Numa parada, o worker recebe SIGTERM e,
+    se não sair em SUPERVISOR_TIMEOUT_PARADA segundos, SIGKILL; quem pediu a
+    parada espera por um future, sem bloquear. A vivacidade combina o processo
+    com o status MQTT: o 'offline' retido pelo LWT dos carregadores e da frota.
+    """
+
+    def __init__(self):
+        self.workers: dict[str, Worker] = {}
+        self._tarefa: asyncio.Task | None = None
+
+    def iniciar(self):
+        self._tarefa = asyncio.create_task(self._vigiar())
+
+    async def fechar(self):
+        await self.parar(list(self.workers))
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+
+    def ativo(self, nome):
+        worker = self.workers.get(nome)
+        return worker is not None and worker.ativo
+
+    def nomes(self, tipo):
+        return [nome for nome, worker in self.workers.items() if worker.tipo == tipo and worker.ativo]
+
+    # --- Início ---
+
+    def _lancar(self, worker):
+        self._executando(worker, subprocess.Popen(worker.comando, env=worker.env))
+
+    def _executando(self, worker, processo):
+        worker.processo = processo
+        worker.estado = "executando"
+        worker.iniciado_em = time.monotonic()
+        worker.status_mqtt = None
+        worker.status_desde = None
+
+    async def iniciar_workers(self, especificacoes):
+        """
+        Inicia vários workers [(nome, comando, env, tipo), ...] de uma vez. Os
+        processos são criados numa thread, para que centenas de fork/exec não
+        travem o loop. Devolve os workers iniciados; os já ativos são ignorados.
+
+        Os workers ficam 'iniciando' (ativos) desde já, então uma requisição
+        concorrente com o mesmo nome não cria outro processo. A thread só faz
+        os fork/exec; o estado dos workers muda apenas no loop.
+        """
+        loop = asyncio.get_running_loop()
+        novos = []
+        for nome, comando, env, tipo in especificacoes:
+            if self.ativo(nome):
+                continue
+            worker = Worker(nome, comando, env, tipo)
+            worker.estado = "iniciando"
+            worker.lancado = loop.create_future()
+            self.workers[nome] = worker
+            novos.append(worker)
+
+        def lancar_todos():
+            resultados = []
+            for worker in novos:
+                try:
+                    resultados.append((worker, subprocess.Popen(worker.comando, env=worker.env), None))
+                except OSError as e:
+                    resultados.append((worker, None, e))
+            return resultados
+
+        for worker, processo, erro in await asyncio.to_thread(lancar_todos):
+            if processo is not None:
+                self._executando(worker, processo)
+                log.info("Iniciado %s com PID: %d", worker.nome, worker.pid)
+            else:
+                log.error("Falha ao iniciar %s: %s", worker.nome, erro)
+                self._agendar_reinicio(worker, time.monotonic())
+            worker.lancado.set_result(None)
+        return novos
+
+    async def iniciar_worker(self, nome, comando, env=None, tipo="worker"):
+        novos = await self.iniciar_workers([(nome, comando, env, tipo)])
+        return novos[0] if novos else self.workers[nome]
+
+    # --- Parada ---
+
+    async def parar(self, nomes, timeout=SUPERVISOR_TIMEOUT_PARADA):
+        """Para os workers indicados e espera todos saírem. Devolve os nomes parados."""
+        loop = asyncio.get_running_loop()
+        # Um worker ainda 'iniciando' é parado depois que o processo existir
+        iniciando = [self.workers[nome].lancado for nome in nomes if nome in self.workers and self.workers[nome].estado == "iniciando"]
+        if iniciando:
+            await asyncio.gather(*iniciando)
+        agora = time.monotonic()
+        esperas = []
+        parados = []
+        for nome in nomes:
+            worker = self.workers.get(nome)
+            if worker is None:
+                continue
+            parados.append(nome)
+            if worker.estado == "parando":
+                esperas.append(worker.parado)
+                continue
+            if worker.processo is None or worker.processo.poll() is not None:
+                # Já terminou (ou aguardava reinício): nada a sinalizar
+                self._finalizar(worker)
+                continue
+            worker.estado = "parando"
+            worker.prazo_parada = agora + timeout
+            worker.parado = loop.create_future()
+            try:
+                worker.processo.terminate()
+            except ProcessLookupError:
+                pass
+            esperas.append(worker.parado)
+        if esperas:
+            await asyncio.gather(*esperas)
+        return parados
+
+    def _finalizar(self, worker):
+        worker.estado = "parado"
+        if worker.processo is not None:
+            worker.ultimo_codigo = worker.processo.returncode
+        if worker.parado is not None and not worker.parado.done():
+            worker.parado.set_result(worker.ultimo_codigo)
+        self.workers.pop(worker.nome, None)
+        log.info("Parado %s (código %s)", worker.nome, worker.ultimo_codigo)
+
+    # --- Vigia ---
+
+    def _agendar_reinicio(self, worker, agora):
+        if worker.iniciado_em is not None and agora - worker.iniciado_em >= SUPERVISOR_ESTAVEL_APOS:
+            worker.backoff = SUPERVISOR_BACKOFF_INICIAL
+        worker.estado = "reiniciando"
+        worker.proximo_inicio = agora + worker.backoff
+        log.warning("%s terminou inesperadamente (código %s); reiniciando em %.1fs", worker.nome, worker.ultimo_codigo, worker.backoff)
+        worker.backoff = min(worker.backoff * 2, SUPERVISOR_BACKOFF_MAX)
+
+    def _verificar(self, worker, agora):
+        if worker.estado in ("executando", "parando"):
+            codigo = worker.processo.poll()
+            if codigo is not None:
+                worker.ultimo_codigo = codigo
+                if worker.estado == "parando":
+                    self._finalizar(worker)
+                else:
+                    self._agendar_reinicio(worker, agora)
+            elif worker.estado == "parando" and agora >= worker.prazo_parada:
+                log.warning("%s não saiu em %.0fs; enviando SIGKILL", worker.nome, SUPERVISOR_TIMEOUT_PARADA)
+                worker.processo.kill()
+                worker.prazo_parada = float("inf")
+            elif (worker.estado == "executando" and SUPERVISOR_OFFLINE_REINICIO > 0 and worker.status_mqtt == "offline"
+                  and agora - worker.status_desde > SUPERVISOR_OFFLINE_REINICIO):
+                log.warning("%s está offline no MQTT há %.0fs com o processo vivo; reiniciando", worker.nome, agora - worker.status_desde)
+                worker.processo.kill()  # a próxima verificação recolhe e reinicia
+                worker.status_mqtt = None
+        elif worker.estado == "reiniciando" and agora >= worker.proximo_inicio:
+            try:
+                self._lancar(worker)
+                worker.reinicios += 1
+                metricas.SUPERVISOR_REINICIOS.labels(worker.tipo).inc()
+                log.info("Reiniciado %s com PID: %d (reinício %d)", worker.nome, worker.pid, worker.reinicios)
+            except OSError as e:
+                log.error("Falha ao reiniciar %s: %s", worker.nome, e)
+                self._agendar_reinicio(worker, agora)
+
+    async def _vigiar(self):
+        while True:
+            agora = time.monotonic()
+            estados = {}
+            for worker in list(self.workers.values()):
+                try:
+                    self._verificar(worker, agora)
+                except Exception as e:
+                    log.error("Erro ao verificar %s: %s", worker.nome, e)
+                estados[worker.estado] = estados.get(worker.estado, 0) + 1
+            for estado in ("executando", "parando", "reiniciando"):
+                metricas.SUPERVISOR_WORKERS.labels(estado).set(estados.get(estado, 0))
+            await asyncio.sleep(SUPERVISOR_INTERVALO)
+
+    # --- Saúde ---
+
+    def registrar_status(self, nome, status_mqtt, agora):
+        """Status publicado pelo worker (ou pelo LWT dele) no MQTT."""
+        worker = self.workers.get(nome)
+        if worker is not None and status_mqtt != worker.status_mqtt:
+            worker.status_mqtt = status_mqtt
+            worker.status_desde = agora
+
+    def resumo(self):
+        agora = time.monotonic()
+        return [worker.resumo(agora) for worker in self.workers.values()]
@@ -1,118 +1,412 @@
-from paho.mqtt import client as mqtt_client
+from transporte import criar_cliente
+from lamport_clock import criar_relogio
+from codec import codificar, decodificar
+from gravador_transacoes import GravadorTransacoes, PENDENTES_DIR
+from pipeline import ConfirmacoesMqtt, Estagio, Pipeline
+from relogio_beacon import BeaconRelogio
+from tarifas import MotorTarifas, TOPICO_CONTROLE, intervalos_consumo
+from registro import obter_logger
+import metricas
 import json
-from lamport_clock import LamportClock
 import sys
 import os
-import psycopg2
 import time
 import socket
+import signal
+import threading
+import zlib
 from dotenv import load_dotenv
 
 load_dotenv()
 
-PRECO_POR_KWH = 0.75
+# Diferença (kWh) tolerada entre o total do fim_carga e a última leitura do medidor
+TOLERANCIA_MEDICAO = float(os.getenv("BILLING_TOLERANCIA_MEDICAO", "0.05"))
 DATABASE_URL = os.getenv("DATABASE_URL")
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+WORKERS_DECODIFICAR = int(os.getenv("BILLING_WORKERS_DECODIFICAR", "2"))
+WORKERS_PRECIFICAR = int(os.getenv("BILLING_WORKERS_PRECIFICAR", "2"))
+FILA_ESTAGIO_MAX = int(os.getenv("BILLING_FILA_ESTAGIO_MAX", "5000"))
+ESTATISTICAS_INTERVALO = float(os.getenv("BILLING_ESTATISTICAS_INTERVALO", "10"))  # segundos
+# Escala horizontal:
+# "unico": uma instância recebe todos os eventos (subscrição normal)
+# "compartilhado": K instâncias dividem os eventos via $share/<grupo>/... (o broker balanceia).
+#                  As leituras de uma sessão se espalham entre as instâncias, então
+#                  as tarifas por horário cobram toda a energia no instante do fim_carga
+# "particionado": cada instância recebe tudo e processa só os carregadores da sua
+#                 partição, definida por BILLING_PARTICAO="<indice>/<total>"
+MODO_ESCALA = os.getenv("BILLING_MODO_ESCALA", "unico")
+GRUPO_COMPARTILHADO = os.getenv("BILLING_GRUPO", "billing")
+PARTICAO = os.getenv("BILLING_PARTICAO", "0/1")
+WORKER_ID = os.getenv("BILLING_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Com um ID de worker fixo a sessão MQTT é persistente: o que o broker entregou
+# e não foi confirmado (PUBACK só depois da gravação) volta quando o worker reinicia
+SESSAO_PERSISTENTE = bool(os.getenv("BILLING_WORKER_ID"))
+# Porta do exportador de métricas (/metrics) deste worker; vazio desativa
+METRICAS_PORTA = os.getenv("BILLING_METRICAS_PORTA")
 
+log = obter_logger("billing")
 
-def salvar_transacao_db(transacao):
-    conn = None
-    
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
 
-        sql = """
-            INSERT INTO transacoes (carro_id, carregador_id, energia_total_kWh, custo_total_brl, timestamp_transacao)
-            VALUES (%s, %s, %s, %s, %s);
-        """
+def chave_idempotencia(evento):
+    """
+    Identifica a cobrança de uma sessão de carga. Eventos sem `sessao` (de
+    carregadores antigos) usam carro + timestamp de Lamport do fim_carga.
+    """
+    carregador = evento.get("carregador")
+    sessao = evento.get("sessao")
+    if sessao:
+        return f"{carregador}:{sessao}"
+    return f"{carregador}:{evento.get('carro')}:{evento.get('timestamp')}"
 
-        with conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, (transacao['carro'], transacao['carregador'], transacao['energia_total_kWh'], transacao['custo_total_brl'], transacao['timestamp_transacao']))
-                conn.commit()
-    except Exception as e:
-        print(f"[DB] Erro ao salvar transação: {e}")
 
 class BillingService:
+    """
+    Serviço de billing organizado em estágios ligados por filas limitadas:
+
+        recepção (thread do paho) -> decodificar -> precificar -> persistir
+        -> (commit no banco) -> publicar
+
+    A thread de rede do paho só enfileira a mensagem, então uma lentidão no
+    banco não impede o consumo do broker até as filas encherem. Os estágios
+    com vários workers distribuem os eventos pelo ID do carregador, mantendo a
+    ordem por carregador. A transação só é publicada depois de gravada.
+
+    O PUBACK de cada evento só é enviado quando ele termina de ser processado
+    (no fim_carga, depois do commit da transação); se o processo cair com
+    eventos nas filas, o broker os reentrega e a chave de idempotência evita
+    a cobrança duplicada.
+    """
+
     def __init__(self, broker_address="localhost"):
         self.broker_address = broker_address
-        self.clock = LamportClock()
+        self.clock = criar_relogio()
+        self.worker_id = WORKER_ID
         self.topic_eventos = "carregadores/+/eventos"
+        self.topic_leituras = "carregadores/+/leituras"
+        prefixo = f"$share/{GRUPO_COMPARTILHADO}/" if MODO_ESCALA == "compartilhado" else ""
+        self.topics_subscricao = [prefixo + self.topic_eventos, prefixo + self.topic_leituras]
+        indice, total = PARTICAO.split("/")
+        self.particao = (int(indice), int(total)) if MODO_ESCALA == "particionado" else (0, 1)
         self.topic_transacoes = "billing/transacoes"
-        self.client = mqtt_client.Client(client_id="billing-service")
+        self.topic_estatisticas = f"billing/{self.worker_id}/estatisticas"
+        # Client id único por worker: ids repetidos fazem o broker derrubar a conexão anterior
+        self.client = criar_cliente(f"billing-service-{self.worker_id}", clean_session=not SESSAO_PERSISTENTE, manual_ack=True)
+        self.confirmacoes = ConfirmacoesMqtt(self.client)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.gravador = None
+        # Tarifas em memória, recarregadas do banco em segundo plano
+        self.tarifas = MotorTarifas(DATABASE_URL)
+        # Última leitura do medidor da sessão em andamento de cada carregador
+        self.medicoes: dict[str, dict] = {}
+        # O billing observa todos os eventos; publica seu relógio como beacon
+        # para que os carregadores não precisem escutar o tópico global
+        self.beacon = BeaconRelogio(self.client, self.clock, origem=f"billing-service-{self.worker_id}")
+
+        self.pipeline = Pipeline([
+            Estagio("decodificar", self.decodificar, WORKERS_DECODIFICAR, FILA_ESTAGIO_MAX),
+            Estagio("precificar", self._precificar_mensagem, WORKERS_PRECIFICAR, FILA_ESTAGIO_MAX),
+            Estagio("persistir", self.persistir, 1, FILA_ESTAGIO_MAX, repassa_confirmacao=True),
+        ])
+        # Alimentado pelo gravador depois do commit de cada lote
+        self.publicacao = Estagio("publicar", self.publicar_transacao, 1, FILA_ESTAGIO_MAX)
+        self._parar = threading.Event()
 
     def on_connect(self, client, userdata, flags, rc):
-        print("Serviço de Billing conectado!")
-        client.subscribe(self.topic_eventos)
-        print(f"Subscrito a '{self.topic_eventos}'")
+        log.info("Serviço de Billing conectado! (worker %s, modo %s)", self.worker_id, MODO_ESCALA)
+        # QoS 1 com PUBACK manual: o broker reentrega os eventos não confirmados
+        client.subscribe([(topico, 1) for topico in self.topics_subscricao])
+        # O controle de tarifas não é compartilhado: todos os workers recarregam
+        client.subscribe(TOPICO_CONTROLE, 1)
+        log.info("Subscrito a %s", self.topics_subscricao)
 
     def on_message(self, client, userdata, msg):
+        metricas.contar_recebida(msg.topic)
+        confirmar = self.confirmacoes.registrar(msg.mid, msg.qos)
+        if msg.topic == TOPICO_CONTROLE:
+            log.info("Recarga de tarifas solicitada")
+            self.tarifas.invalidar()
+            confirmar()
+            return
+        # carregadores/<id>/eventos -> a chave de ordenação é o ID do carregador
+        partes = msg.topic.split("/")
+        chave = partes[1] if len(partes) > 2 else msg.topic
+        indice, total = self.particao
+        if total > 1 and zlib.crc32(chave.encode()) % total != indice:
+            confirmar()
+            return
+        # O horário de chegada define o preço nas tarifas por horário
+        self.pipeline.enviar((msg.topic, msg.payload, time.time()), chave, confirmar)
+
+    # --- Estágios ---
+
+    def decodificar(self, mensagem):
+        topico, dados, recebido_em = mensagem
         try:
-            payload = json.loads(msg.payload.decode())
-            if 'timestamp' in payload:
-                self.clock.receive_event(payload['timestamp'])
-                print(f"[Billing | Clock: {self.clock.get_time()}] Evento recebido: {payload}")
-                self.processar_evento(payload)
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Erro ao processar mensagem: {e}")
-
-    def processar_evento(self, evento):
-        if evento.get("acao") == "fim_carga":
-            carro_id = evento.get("carro")
-            energia_consumida = evento.get("energia_consumida_kWh")
-
-            if carro_id and energia_consumida is not None:
-                custo_total = energia_consumida * PRECO_POR_KWH
-
-                transacao = {
-                    "carro": carro_id,
-                    "carregador": evento.get("carregador"),
-                    "energia_total_kWh": energia_consumida,
-                    "custo_total_brl": round(custo_total, 2),
-                    "timestamp_transacao": self.clock.send_event()
-                }
-
-                # 1. Publica no MQTT (para o frontend ou outros serviços ouvirem)
-                self.client.publish(self.topic_transacoes, json.dumps(transacao))
-                print(f"[MQTT] Transação publicada para {carro_id}: {transacao}")
-
-                # 2. Salva a mesma transação no banco de dados
-                salvar_transacao_db(transacao)
-            else:
-                print(f"[Billing] Evento 'fim_carga' recebido com dados incompletos: {evento}")
+            payload = metricas.decodificar_medindo(decodificar, dados)
+        except ValueError as e:
+            log.warning("Erro ao processar mensagem de '%s': %s", topico, e)
+            return None
+        if not isinstance(payload, dict) or 'timestamp' not in payload:
+            return None
+
+        local = self.clock.get_time()
+        metricas.registrar_relogio(local, self.clock.deriva(local, payload['timestamp']))
+        self.clock.receive_event(payload['timestamp'])
+        log.debug("[Clock: %d] Evento recebido: %s", self.clock.get_time(), payload)
+        return payload, recebido_em
+
+    def _precificar_mensagem(self, mensagem):
+        evento, recebido_em = mensagem
+        return self.precificar(evento, recebido_em)
+
+    def precificar(self, evento, recebido_em=None):
+        """
+        Gera a transação de um evento 'fim_carga', conciliada com as leituras do
+        medidor da sessão e precificada pela tarifa do carregador; inicio_carga
+        e leituras só atualizam a medição e os demais eventos são ignorados.
+        """
+        faturamento = self.faturar(evento, time.time() if recebido_em is None else recebido_em)
+        if faturamento is None:
+            return None
+        transacao, intervalos = faturamento
+        custo, tarifa = self.tarifas.custo(evento.get("carregador"), intervalos)
+        return self._completar(transacao, custo, tarifa)
+
+    def faturar(self, evento, recebido_em):
+        """
+        Atualiza a medição com o evento e, num 'fim_carga', devolve a transação
+        ainda sem custo e os trechos de consumo (instante, kWh) a precificar.
+        """
+        acao = evento.get("acao")
+        if acao == "leitura":
+            self.registrar_leitura(evento, recebido_em)
+            return None
+        if acao == "inicio_carga":
+            self._verificar_sessao_anterior(evento)
+            carregador = evento.get("carregador")
+            if carregador not in self.medicoes:
+                self.medicoes[carregador] = {"sessao": evento.get("sessao"), "energia": None, "leituras": 0, "perfil": [(recebido_em, 0.0)]}
+            return None
+        if acao != "fim_carga":
+            return None
+
+        carro_id = evento.get("carro")
+        energia_consumida = evento.get("energia_consumida_kWh")
+        if not carro_id or energia_consumida is None:
+            log.warning("Evento 'fim_carga' recebido com dados incompletos: %s", evento)
+            return None
+
+        auditoria, perfil = self.conciliar(evento)
+        # O medidor só cresce: um total menor que a última leitura é inconsistente
+        # e a cobrança usa a leitura
+        if auditoria["divergencia"] == "total_menor_que_leitura":
+            energia_consumida = auditoria["energia_medida_kWh"]
+
+        transacao = {
+            "carro": carro_id,
+            "carregador": evento.get("carregador"),
+            "energia_total_kWh": energia_consumida,
+            "chave_idempotencia": chave_idempotencia(evento),
+            **auditoria
+        }
+        if MODO_ESCALA == "compartilhado":
+            # Perfil parcial (só as leituras que chegaram a este worker): não
+            # distribui a energia por ele
+            perfil = []
+        return transacao, intervalos_consumo(perfil, energia_consumida, recebido_em)
+
+    def _completar(self, transacao, custo, tarifa, timestamp=None):
+        transacao["custo_total_brl"] = round(custo, 2)
+        transacao["tarifa"] = tarifa.nome
+        transacao["timestamp_transacao"] = self.clock.send_event() if timestamp is None else timestamp
+        return transacao
+
+    # --- Medição ---
+    # O estado é por carregador e cada carregador é sempre tratado pelo mesmo
+    # worker do estágio precificar, então não há concorrência por carregador.
+
+    def registrar_leitura(self, leitura, recebido_em):
+        carregador = leitura.get("carregador")
+        medicao = self.medicoes.get(carregador)
+        if medicao is None or medicao["sessao"] != leitura.get("sessao"):
+            self._verificar_sessao_anterior(leitura)
+            medicao = self.medicoes[carregador] = {"sessao": leitura.get("sessao"), "energia": None, "leituras": 0, "perfil": []}
+        energia = leitura.get("energia_consumida_kWh")
+        if energia is not None and medicao["energia"] is not None and energia < medicao["energia"]:
+            metricas.DIVERGENCIAS_MEDICAO.labels("leitura_decrescente").inc()
+            log.warning("Leitura decrescente do carregador %s na sessão %s: %s -> %s", carregador, medicao["sessao"], medicao["energia"], energia)
+        if energia is not None:
+            medicao["energia"] = max(energia, medicao["energia"] or 0)
+            medicao["perfil"].append((recebido_em, energia))
+        medicao["leituras"] += 1
+
+    def _verificar_sessao_anterior(self, evento):
+        """Uma sessão nova com leituras da anterior pendentes indica um fim_carga perdido."""
+        anterior = self.medicoes.get(evento.get("carregador"))
+        if anterior is not None and anterior["sessao"] != evento.get("sessao"):
+            del self.medicoes[evento.get("carregador")]
+            # No modo compartilhado o fim_carga da sessão pode ter ido para outro worker
+            if anterior["leituras"] and MODO_ESCALA != "compartilhado":
+                metricas.DIVERGENCIAS_MEDICAO.labels("fim_carga_perdido").inc()
+                log.warning("fim_carga perdido: carregador %s, sessão %s (%d leituras, %s kWh medidos)",
+                            evento.get("carregador"), anterior["sessao"], anterior["leituras"], anterior["energia"])
+
+    def conciliar(self, evento):
+        """
+        Compara o total do fim_carga com as leituras recebidas da sessão e
+        devolve a auditoria e o perfil de consumo [(instante, kWh acumulado)].
+        """
+        medicao = self.medicoes.pop(evento.get("carregador"), None)
+        if medicao is None or medicao["sessao"] != evento.get("sessao"):
+            medicao = {"energia": None, "leituras": 0, "perfil": []}
+        energia_total = evento.get("energia_consumida_kWh")
+        esperadas = evento.get("leituras")
+
+        divergencia = None
+        if medicao["energia"] is not None and energia_total + TOLERANCIA_MEDICAO < medicao["energia"]:
+            divergencia = "total_menor_que_leitura"
+        elif esperadas is not None and medicao["leituras"] < esperadas and MODO_ESCALA != "compartilhado":
+            # No modo compartilhado as leituras de uma sessão se espalham entre os workers
+            divergencia = "leituras_perdidas"
+        if divergencia:
+            metricas.DIVERGENCIAS_MEDICAO.labels(divergencia).inc()
+            log.warning("Divergência '%s' na sessão %s do carregador %s: total %s kWh, medido %s kWh, leituras %d/%s",
+                        divergencia, evento.get("sessao"), evento.get("carregador"), energia_total, medicao["energia"], medicao["leituras"], esperadas)
+        auditoria = {
+            "energia_medida_kWh": medicao["energia"],
+            "leituras_recebidas": medicao["leituras"],
+            "leituras": esperadas,
+            "divergencia": divergencia,
+        }
+        return auditoria, medicao["perfil"]
+
+    def persistir(self, transacao, confirmar=None):
+        # O gravador agrupa as transações em lotes; a publicação e o PUBACK do
+        # fim_carga vêm depois do commit
+        self.gravador.enviar(transacao, confirmar)
+        return None
+
+    def publicar_transacao(self, transacao):
+        # Publica no MQTT (para o frontend ou outros serviços ouvirem)
+        self.client.publish(self.topic_transacoes, codificar(transacao))
+        metricas.contar_publicada(self.topic_transacoes)
+        log.debug("Transação publicada para %s: %s", transacao['carro'], transacao)
+
+    def _transacoes_gravadas(self, lote):
+        for transacao in lote:
+            self.publicacao.enviar(transacao, transacao["carregador"])
+
+    def processar_evento(self, evento, recebido_em=None):
+        """Precifica e persiste um evento já decodificado, fora do fluxo MQTT."""
+        if "timestamp" in evento:
+            self.clock.receive_event(evento["timestamp"])
+        transacao = self.precificar(evento, recebido_em)
+        if transacao is not None:
+            self.persistir(transacao)
+
+    def processar_lote(self, eventos):
+        """
+        Como `processar_evento` para uma lista de (evento, recebido_em) em ordem
+        (usado pelo backend/replay.py): a medição avança evento a evento, mas as
+        sessões encerradas no lote são precificadas juntas. Devolve quantas
+        transações foram geradas.
+        """
+        faturadas = []
+        for evento, recebido_em in eventos:
+            if "timestamp" in evento:
+                self.clock.receive_event(evento["timestamp"])
+            faturamento = self.faturar(evento, recebido_em)
+            if faturamento is not None:
+                faturadas.append(faturamento)
+        custos = self.tarifas.custos_lote([(transacao["carregador"], intervalos) for transacao, intervalos in faturadas])
+        # Um timestamp por transação, reservados de uma vez
+        timestamps = self.clock.reservar(len(faturadas))
+        for (transacao, _), (custo, tarifa), timestamp in zip(faturadas, custos, timestamps):
+            self.persistir(self._completar(transacao, custo, tarifa, timestamp))
+        return len(faturadas)
+
+    def estatisticas(self):
+        estagios = self.pipeline.estatisticas()
+        estagios["publicar"] = self.publicacao.estatisticas()
+        return {"estagios": estagios, "fila_gravador": self.gravador.fila.qsize() if self.gravador else 0,
+                "confirmacoes_pendentes": self.confirmacoes.pendentes}
+
+    def _reportar_estatisticas(self):
+        estatisticas = self.estatisticas()
+        metricas.FILA_GRAVADOR.set(estatisticas["fila_gravador"])
+        metricas.registrar_relogio(self.clock.get_time())
+        self.client.publish(self.topic_estatisticas, json.dumps(estatisticas), retain=True)
+        metricas.contar_publicada(self.topic_estatisticas)
+        resumo = ", ".join(f"{nome}: fila={e['fila']} lat={e['latencia_media_ms']}ms" for nome, e in estatisticas["estagios"].items())
+        log.info("Estágios -> %s; gravador: fila=%d", resumo, estatisticas['fila_gravador'])
+
+    # --- Ciclo de vida ---
 
     def run(self):
         if not DATABASE_URL:
-            print("ERRO: A variável de ambiente DATABASE_URL não foi definida.")
+            log.error("A variável de ambiente DATABASE_URL não foi definida.")
             return
         if not MQTT_BROKER_HOST:
-            print("ERRO: A variável de ambiente MQTT_BROKER_HOST não foi definida.")
+            log.error("A variável de ambiente MQTT_BROKER_HOST não foi definida.")
             return
 
+        if metricas.iniciar_exportador(METRICAS_PORTA):
+            log.info("Métricas em http://0.0.0.0:%s/metrics", METRICAS_PORTA)
+        self.gravador = GravadorTransacoes(DATABASE_URL, ao_gravar=self._transacoes_gravadas, pendentes_dir=PENDENTES_DIR)
+        self.tarifas.iniciar()
+        self.publicacao.iniciar()
+        self.pipeline.iniciar()
+        # SIGTERM (enviado pela API ao parar o serviço) inicia um desligamento
+        # ordenado: as filas são esvaziadas e as transações gravadas antes de sair
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._parar.set())
+
+        try:
+            if self._conectar():
+                self.client.loop_start()
+                self.beacon.iniciar()
+                while not self._parar.wait(ESTATISTICAS_INTERVALO):
+                    self._reportar_estatisticas()
+        except KeyboardInterrupt:
+            log.info("Desligando...")
+        finally:
+            self._desligar()
+
+    def _desligar(self):
+        # Com o banco fora do ar, os lotes restantes vão para o disco em vez de travar a saída
+        self.gravador.iniciar_desligamento()
+        self.beacon.parar()
+        self.tarifas.parar()
+        self.client.unsubscribe(self.topics_subscricao)
+        log.info("Processando eventos pendentes e gravando transações...")
+        self.pipeline.parar()
+        self.gravador.fechar()
+        self.publicacao.parar()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _conectar(self):
         max_retries = 5
         retry_delay = 5  # segundos
         attempts = 0
 
         while attempts < max_retries:
             try:
-                print(f"[Billing] Tentando conectar ao broker em '{MQTT_BROKER_HOST}' (Tentativa {attempts + 1}/{max_retries})...")
+                log.info("Tentando conectar ao broker em '%s' (Tentativa %d/%d)...", MQTT_BROKER_HOST, attempts + 1, max_retries)
                 self.client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
-                print("[Billing] Conexão com o broker MQTT bem-sucedida!")
-                
-                # Se a conexão for bem-sucedida, inicia o loop e sai da lógica de retry
-                self.client.loop_forever()
-                return # Sai da função run se o loop_forever for interrompido
+                log.info("Conexão com o broker MQTT bem-sucedida!")
+                return True
 
             except (socket.gaierror, ConnectionRefusedError, TimeoutError) as e:
-                print(f"[Billing] Falha na conexão: {e}. Tentando novamente em {retry_delay} segundos...")
+                log.warning("Falha na conexão: %s. Tentando novamente em %d segundos...", e, retry_delay)
                 attempts += 1
                 time.sleep(retry_delay)
-        
-        print(f"[Billing] ERRO: Não foi possível conectar ao broker após {max_retries} tentativas. Desligando.")
+
+        log.error("Não foi possível conectar ao broker após %d tentativas. Desligando.", max_retries)
+        return False
 
 if __name__ == "__main__":
+    metricas.definir_servico("billing")
     billing = BillingService()
-    billing.run()
\ No newline at end of file
+    billing.run()
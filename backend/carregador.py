@@ -1,41 +1,87 @@
-from paho.mqtt import client as mqtt_client
-import json
+from transporte import criar_cliente
 import time
 import random
 import sys
 import os
-from lamport_clock import LamportClock
+import signal
+import uuid
+from lamport_clock import criar_relogio
+from codec import codificar, decodificar
+from relogio_beacon import TOPICO_BEACON, MODO_SINCRONIA
+from spool import PublicadorConfiavel, SpoolEventos, caminho_spool
+from registro import obter_logger
+import metricas
 
 MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+TICK_SEGUNDOS = float(os.getenv("CARREGADOR_TICK", "5"))
+# Intervalo mínimo entre status publicados durante o carregamento (0 = todo ciclo).
+# Mudanças de estado (conexão/desconexão de carro) são sempre publicadas.
+STATUS_INTERVALO_MIN = float(os.getenv("CARREGADOR_STATUS_INTERVALO_MIN", "0"))
+# Medição durante a carga:
+# "leituras": leituras periódicas do medidor (energia acumulada + Lamport) em
+#             carregadores/<id>/leituras; o status só sai nas mudanças de estado
+# "status": comportamento antigo, status completo a cada ciclo
+MEDICAO = os.getenv("CARREGADOR_MEDICAO", "leituras")
+LEITURA_INTERVALO = float(os.getenv("CARREGADOR_LEITURA_INTERVALO", "60"))  # segundos
+
+log = obter_logger("carregador")
 
 class Carregador:
-    def __init__(self, carregador_id, broker_address="localhost"):
+    # Uma frota hospeda milhares de carregadores no mesmo processo: sem o
+    # __dict__ por instância
+    __slots__ = (
+        "carregador_id", "broker_address", "verbose", "clock", "carro_conectado", "sessao_id",
+        "energia_consumida", "ultimo_status_em", "leituras_sessao", "ultima_leitura_em",
+        "topic_eventos", "topic_status", "topic_leituras", "topic_relogio", "client", "publicador",
+    )
+
+    def __init__(self, carregador_id, broker_address="localhost", client=None, verbose=True, publicador=None):
         self.carregador_id = carregador_id
         self.broker_address = broker_address
-        self.clock = LamportClock()
+        self.verbose = verbose
+        self.clock = criar_relogio()
         self.carro_conectado = None
+        # Identifica a sessão de carga atual; o billing usa para não cobrar duas vezes
+        self.sessao_id = None
         self.energia_consumida = 0.0
+        self.ultimo_status_em = 0.0
+        # Leituras do medidor publicadas na sessão atual (vão no fim_carga para auditoria)
+        self.leituras_sessao = 0
+        self.ultima_leitura_em = 0.0
 
         # Tópicos MQTT
         self.topic_eventos = f"carregadores/{self.carregador_id}/eventos"
         self.topic_status = f"carregadores/{self.carregador_id}/status"
-        # Todos os carregadores escutam os eventos de todos os outros para manter o relógio sincronizado
-        self.topic_global_eventos = "carregadores/+/eventos"
+        self.topic_leituras = f"carregadores/{self.carregador_id}/leituras"
+        # Tópico usado para sincronizar o relógio: no modo "beacon" apenas o
+        # relógio agregado publicado pelo billing; no modo "global" os eventos
+        # de todos os outros carregadores (O(N) mensagens por carregador)
+        if MODO_SINCRONIA == "global":
+            self.topic_relogio = "carregadores/+/eventos"
+        else:
+            self.topic_relogio = TOPICO_BEACON
+
+        # Em modo frota (backend/frota.py) vários carregadores compartilham o
+        # mesmo cliente MQTT (e o mesmo spool); a conexão e as subscrições ficam
+        # a cargo da frota.
+        if client is not None:
+            self.client = client
+            self.publicador = publicador
+            return
 
-        # Configuração do cliente MQTT
-        self.client = mqtt_client.Client(client_id=f"carregador-{self.carregador_id}")
+        # Configuração do cliente MQTT. Sessão persistente: o broker guarda as
+        # subscrições e as mensagens QoS 1 em andamento entre reconexões.
+        self.client = criar_cliente(f"carregador-{self.carregador_id}", clean_session=False)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        # Eventos (fim_carga é cobrança) saem com QoS 1 e passam por um spool em disco
+        spool = SpoolEventos(caminho_spool(f"carregador-{self.carregador_id}"))
+        self.publicador = PublicadorConfiavel(self.client, spool)
 
         # --- IMPLEMENTAÇÃO DO LAST WILL AND TESTAMENT (LWT) ---
         # 1. Defino a mensagem do "testamento"
-        lwt_payload = json.dumps({
-            "carregador": self.carregador_id,
-            "status": "offline",
-            "carro_conectado": None,
-            "energia_consumida_kWh": 0
-        })
+        lwt_payload = codificar(self.payload_offline())
 
         # 2. Configuração do LWT:
         # Tópico: O próprio tópico de status do carregador
@@ -45,30 +91,50 @@ class Carregador:
         self.client.will_set(self.topic_status, payload=lwt_payload, qos=1, retain=True)
         # ---------------------------------------------------------
 
+    def payload_offline(self):
+        return {
+            "carregador": self.carregador_id,
+            "status": "offline",
+            "carro_conectado": None,
+            "energia_consumida_kWh": 0
+        }
+
+    def _log(self, mensagem, *args):
+        # Mensagens por evento: só aparecem com LOG_NIVEL=DEBUG (e verbose)
+        if self.verbose:
+            log.debug(mensagem, *args)
+
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print(f"Carregador {self.carregador_id} conectado ao Broker MQTT!")
-            # Subscreve ao tópico global de eventos para ouvir outras estações
-            client.subscribe(self.topic_global_eventos)
-            print(f"Carregador {self.carregador_id} subscrito a '{self.topic_global_eventos}'")
+            log.info("Carregador %s conectado ao Broker MQTT!", self.carregador_id)
+            # Subscreve ao tópico usado para sincronizar o relógio lógico
+            client.subscribe(self.topic_relogio)
+            log.info("Carregador %s subscrito a '%s'", self.carregador_id, self.topic_relogio)
+            # Depois de uma queda o broker deixou retido o 'offline' do LWT: o
+            # status atual é republicado a cada conexão
+            self.publicar_status()
+            self.publicador.ao_conectar()
         else:
-            print(f"Falha na conexão, código de retorno: {rc}\n")
+            log.error("Falha na conexão, código de retorno: %s", rc)
 
     def on_message(self, client, userdata, msg):
         # Ignora as próprias mensagens
-        if self.carregador_id in msg.topic:
+        if msg.topic == self.topic_eventos:
             return
+        metricas.contar_recebida(msg.topic)
 
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = metricas.decodificar_medindo(decodificar, msg.payload)
             received_timestamp = payload.get("timestamp")
 
             if received_timestamp is not None:
-                # Atualiza o relógio lógico ao receber um evento de outro carregador
+                # Atualiza o relógio lógico ao receber um evento ou beacon
+                local = self.clock.get_time()
+                metricas.registrar_relogio(local, self.clock.deriva(local, received_timestamp))
                 self.clock.receive_event(received_timestamp)
-                print(f"[{self.carregador_id}] Evento recebido de '{msg.topic}'. Relógio atualizado para: {self.clock.get_time()}")
-        except json.JSONDecodeError:
-            print(f"[{self.carregador_id}] Erro ao decodificar mensagem: {msg.payload.decode()}")
+                self._log("[%s] Evento recebido de '%s'. Relógio atualizado para: %d", self.carregador_id, msg.topic, self.clock.get_time())
+        except ValueError:
+            log.warning("[%s] Erro ao decodificar mensagem: %r", self.carregador_id, msg.payload)
 
 
     def publicar_evento(self, acao, carro_id=None):
@@ -78,10 +144,12 @@ class Carregador:
             "carregador": self.carregador_id,
             "carro": carro_id or self.carro_conectado,
             "acao": acao,
-            "timestamp": timestamp
+            "timestamp": timestamp,
+            "sessao": self.sessao_id
         }
-        self.client.publish(self.topic_eventos, json.dumps(payload))
-        print(f"[{self.carregador_id} | Clock: {timestamp}] Evento publicado: {payload}")
+        self.publicador.publicar(self.topic_eventos, codificar(payload), timestamp)
+        metricas.contar_publicada(self.topic_eventos)
+        self._log("[%s | Clock: %d] Evento publicado: %s", self.carregador_id, timestamp, payload)
 
     def publicar_status(self):
         """Publica o status atual do carregador."""
@@ -92,21 +160,42 @@ class Carregador:
             "energia_consumida_kWh": round(self.energia_consumida, 2),
             "timestamp": self.clock.get_time(),
         }
-        self.client.publish(self.topic_status, json.dumps(payload), retain=True) # Retain para que novos clientes saibam o último estado
+        self.client.publish(self.topic_status, codificar(payload), retain=True) # Retain para que novos clientes saibam o último estado
+        metricas.contar_publicada(self.topic_status)
+        self.ultimo_status_em = time.monotonic()
+
+    def publicar_leitura(self):
+        """Publica a leitura do medidor: energia acumulada na sessão e timestamp de Lamport."""
+        timestamp = self.clock.send_event()
+        payload = {
+            "carregador": self.carregador_id,
+            "acao": "leitura",
+            "sessao": self.sessao_id,
+            "energia_consumida_kWh": round(self.energia_consumida, 2),
+            "timestamp": timestamp,
+        }
+        # QoS 1 sem spool: uma leitura perdida é justamente o que a auditoria do billing detecta
+        self.client.publish(self.topic_leituras, codificar(payload), qos=1)
+        metricas.contar_publicada(self.topic_leituras)
+        self.leituras_sessao += 1
+        self.ultima_leitura_em = time.monotonic()
 
     def conectar_carro(self, carro_id):
         if self.carro_conectado:
-            print(f"[{self.carregador_id}] Já existe um carro conectado.")
+            self._log("[%s] Já existe um carro conectado.", self.carregador_id)
             return
 
         self.carro_conectado = carro_id
+        self.sessao_id = uuid.uuid4().hex
         self.energia_consumida = 0.0
+        self.leituras_sessao = 0
+        self.ultima_leitura_em = time.monotonic()
         self.publicar_evento("inicio_carga", self.carro_conectado)
         self.publicar_status()
 
     def finalizar_carregamento(self):
         if not self.carro_conectado:
-            print(f"[{self.carregador_id}] Nenhum carro para desconectar.")
+            self._log("[%s] Nenhum carro para desconectar.", self.carregador_id)
             return
 
         timestamp = self.clock.send_event()
@@ -115,46 +204,66 @@ class Carregador:
             "carro": self.carro_conectado,
             "acao": "fim_carga",
             "timestamp": timestamp,
-            "energia_consumida_kWh": round(self.energia_consumida, 2)
+            "sessao": self.sessao_id,
+            "energia_consumida_kWh": round(self.energia_consumida, 2),
+            "leituras": self.leituras_sessao
         }
-        self.client.publish(self.topic_eventos, json.dumps(payload))
-        print(f"[{self.carregador_id} | Clock: {timestamp}] Evento publicado: {payload}")
+        self.publicador.publicar(self.topic_eventos, codificar(payload), timestamp)
+        metricas.contar_publicada(self.topic_eventos)
+        self._log("[%s | Clock: %d] Evento publicado: %s", self.carregador_id, timestamp, payload)
 
         self.carro_conectado = None
+        self.sessao_id = None
         self.publicar_status()
 
     def simular_carregamento(self):
         if self.carro_conectado:
             # Simula um consumo de energia
             self.energia_consumida += random.uniform(0.5, 2.0)
-            self.publicar_status()
-            print(f"[{self.carregador_id}] Carro {self.carro_conectado} - Consumo: {self.energia_consumida:.2f} kWh")
+            if MEDICAO == "leituras":
+                if time.monotonic() - self.ultima_leitura_em >= LEITURA_INTERVALO:
+                    self.publicar_leitura()
+            elif time.monotonic() - self.ultimo_status_em >= STATUS_INTERVALO_MIN:
+                self.publicar_status()
+            self._log("[%s] Carro %s - Consumo: %.2f kWh", self.carregador_id, self.carro_conectado, self.energia_consumida)
+
+    def passo(self):
+        """Executa um ciclo da simulação."""
+        if not self.carro_conectado:
+            # Chance de um novo carro conectar
+            if random.random() < 0.3: # 30% de chance a cada ciclo
+                novo_carro = f"Carro_{random.randint(100, 999)}"
+                self.conectar_carro(novo_carro)
+        else:
+            # Simula o carregamento e chance de finalizar
+            self.simular_carregamento()
+            if random.random() < 0.2: # 20% de chance de finalizar
+                self.finalizar_carregamento()
 
     def run(self):
+        # SIGTERM (enviado pelo supervisor da API) segue o mesmo desligamento do Ctrl+C
+        signal.signal(signal.SIGTERM, lambda signum, frame: signal.default_int_handler(signum, frame))
         self.client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
         self.client.loop_start()
 
         # Simulação principal
         try:
             while True:
-                if not self.carro_conectado:
-                    # Chance de um novo carro conectar
-                    if random.random() < 0.3: # 30% de chance a cada 5 segundos
-                        novo_carro = f"Carro_{random.randint(100, 999)}"
-                        self.conectar_carro(novo_carro)
-                else:
-                    # Simula o carregamento e chance de finalizar
-                    self.simular_carregamento()
-                    if random.random() < 0.2: # 20% de chance de finalizar
-                        self.finalizar_carregamento()
-
-                time.sleep(5)
+                self.passo()
+                metricas.SESSOES_ATIVAS.labels(metricas.SERVICO).set(1 if self.carro_conectado else 0)
+                metricas.registrar_relogio(self.clock.get_time())
+                time.sleep(TICK_SEGUNDOS)
         except KeyboardInterrupt:
-            print(f"\n[{self.carregador_id}] Desligando...")
+            log.info("[%s] Desligando...", self.carregador_id)
             if self.carro_conectado:
                 self.finalizar_carregamento()
-            self.client.loop_stop()
+            # Uma desconexão limpa não dispara o LWT: o 'offline' é publicado aqui
+            self.client.publish(self.topic_status, codificar(self.payload_offline()), qos=1, retain=True)
+            # disconnect() entra na fila depois das publicações pendentes; o que
+            # não for confirmado a tempo continua no spool para a próxima execução
             self.client.disconnect()
+            self.client.loop_stop()
+            self.publicador.fechar()
 
 
 if __name__ == "__main__":
@@ -163,5 +272,6 @@ if __name__ == "__main__":
         sys.exit(1)
 
     carregador_id = sys.argv[1]
+    metricas.definir_servico("carregador")
     carregador = Carregador(carregador_id)
     carregador.run()
\ No newline at end of file
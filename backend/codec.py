@@ -0,0 +1,119 @@
+# Codificação dos payloads MQTT trocados entre carregadores, billing e API.
+#
+# Dois formatos convivem nos mesmos tópicos:
+# - JSON (padrão e fallback), como sempre foi;
+# - binário: o byte 0xC1 seguido de um mapa MessagePack em que as chaves e os
+#   valores enumerados conhecidos viram inteiros pequenos.
+#
+# 0xC1 nunca aparece em MessagePack válido nem no início de um JSON, então o
+# decodificador identifica o formato pelo primeiro byte, sem precisar de tópicos
+# separados ou de propriedades do MQTT v5. O formato de publicação é escolhido
+# por PAYLOAD_CODEC ("json" ou "msgpack"); a decodificação aceita sempre os dois.
+import json
+import logging
+import os
+
+try:
+    import msgpack
+except ImportError:  # msgpack é opcional; sem ele só o JSON fica disponível
+    msgpack = None
+
+PAYLOAD_CODEC = os.getenv("PAYLOAD_CODEC", "json")
+MARCADOR_BINARIO = b"\xc1"
+
+# A ordem destas tabelas faz parte do formato: só acrescente no final.
+CHAVES = [
+    "carregador", "carro", "acao", "timestamp", "status", "carro_conectado",
+    "energia_consumida_kWh", "energia_total_kWh", "custo_total_brl",
+    "timestamp_transacao", "origem", "sessao", "chave_idempotencia",
+    "leituras", "energia_medida_kWh", "leituras_recebidas", "divergencia",
+    "tarifa",
+]
+ENUMS = {
+    "acao": ["inicio_carga", "fim_carga", "leitura"],
+    "status": ["livre", "ocupado", "offline"],
+}
+
+_CHAVE_PARA_ID = {chave: i for i, chave in enumerate(CHAVES)}
+_ENUM_PARA_ID = {campo: {valor: i for i, valor in enumerate(valores)} for campo, valores in ENUMS.items()}
+
+
+class JsonCodec:
+    nome = "json"
+
+    def codificar(self, payload: dict) -> bytes:
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    def decodificar(self, dados: bytes) -> dict:
+        return json.loads(dados)
+
+
+class MsgpackCodec:
+    nome = "msgpack"
+
+    def codificar(self, payload: dict) -> bytes:
+        compacto = {}
+        for chave, valor in payload.items():
+            enum = _ENUM_PARA_ID.get(chave)
+            if enum is not None and valor in enum:
+                valor = enum[valor]
+            compacto[_CHAVE_PARA_ID.get(chave, chave)] = valor
+        return MARCADOR_BINARIO + msgpack.packb(compacto)
+
+    def decodificar(self, dados: bytes) -> dict:
+        compacto = msgpack.unpackb(dados[1:], strict_map_key=False)
+        if not isinstance(compacto, dict):
+            raise ValueError(f"payload binário deve ser um mapa, não {type(compacto).__name__}")
+        payload = {}
+        for chave, valor in compacto.items():
+            if type(chave) is int:
+                if not 0 <= chave < len(CHAVES):
+                    raise ValueError(f"chave desconhecida: {chave}")
+                chave = CHAVES[chave]
+            enum = ENUMS.get(chave)
+            if enum is not None and type(valor) is int:
+                if not 0 <= valor < len(enum):
+                    raise ValueError(f"valor desconhecido para '{chave}': {valor}")
+                valor = enum[valor]
+            payload[chave] = valor
+        return payload
+
+
+_json = JsonCodec()
+_msgpack = MsgpackCodec() if msgpack is not None else None
+
+
+def obter_codec(nome: str = PAYLOAD_CODEC):
+    if nome == "msgpack":
+        if _msgpack is None:
+            logging.getLogger("codec").warning("PAYLOAD_CODEC=msgpack, mas o pacote 'msgpack' não está instalado. Usando JSON.")
+            return _json
+        return _msgpack
+    return _json
+
+
+_codec_publicacao = obter_codec()
+
+
+def codificar(payload: dict) -> bytes:
+    """Codifica um payload no formato configurado para publicação."""
+    return _codec_publicacao.codificar(payload)
+
+
+def decodificar(dados: bytes) -> dict:
+    """
+    Decodifica um payload em qualquer um dos formatos. Levanta ValueError se
+    os dados forem inválidos ou o formato binário não estiver disponível.
+    """
+    if dados[:1] == MARCADOR_BINARIO:
+        if _msgpack is None:
+            raise ValueError("payload binário recebido, mas o pacote 'msgpack' não está instalado")
+        try:
+            return _msgpack.decodificar(dados)
+        except TypeError as e:
+            # Erros de formato do msgpack já são ValueError; este vem de chaves não hasheáveis
+            raise ValueError(f"payload binário inválido: {e}") from e
+    payload = _json.decodificar(dados)
+    if not isinstance(payload, dict):
+        raise ValueError(f"payload JSON deve ser um objeto, não {type(payload).__name__}")
+    return payload
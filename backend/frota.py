@@ -0,0 +1,215 @@
+from transporte import criar_cliente
+import asyncio
+import json
+import os
+import signal
+import sys
+import zlib
+from carregador import Carregador
+from codec import codificar, decodificar
+from spool import PublicadorConfiavel, SpoolEventos, caminho_spool
+from relogio_beacon import TOPICO_BEACON, MODO_SINCRONIA
+from registro import obter_logger
+import metricas
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+FROTA_ID = os.getenv("FROTA_ID", "frota-1")
+TICK_SEGUNDOS = float(os.getenv("FROTA_TICK", "5"))
+NUM_CONEXOES = int(os.getenv("FROTA_CONEXOES", "2"))
+# O ciclo é dividido em fatias para espalhar as publicações ao longo do tick
+# em vez de publicar todos os carregadores de uma vez
+NUM_FATIAS = int(os.getenv("FROTA_FATIAS", "10"))
+VERBOSE = os.getenv("FROTA_VERBOSE", "0") == "1"
+# Porta do exportador de métricas (/metrics) da frota; vazio desativa
+METRICAS_PORTA = os.getenv("FROTA_METRICAS_PORTA")
+
+log = obter_logger("frota")
+
+
+def topico_comandos(frota_id):
+    return f"frotas/{frota_id}/comandos"
+
+
+class Frota:
+    """
+    Hospeda vários carregadores simulados em um único processo.
+
+    Os carregadores compartilham um pequeno conjunto de clientes MQTT e são
+    avançados por um único loop asyncio. Comandos para iniciar/parar
+    carregadores chegam pelo tópico `frotas/<frota_id>/comandos`.
+    """
+
+    def __init__(self, frota_id=FROTA_ID, tick=TICK_SEGUNDOS, num_conexoes=NUM_CONEXOES):
+        self.frota_id = frota_id
+        self.tick = tick
+        self.carregadores = {}
+        self.ultimo_timestamp_global = 0
+        self.topic_comandos = topico_comandos(frota_id)
+        self.topic_status = f"frotas/{frota_id}/status"
+        self.topic_relogio = "carregadores/+/eventos" if MODO_SINCRONIA == "global" else TOPICO_BEACON
+        self.loop = None
+
+        self.clients = []
+        self.publicadores = []
+        for i in range(max(1, num_conexoes)):
+            client = criar_cliente(f"{frota_id}-{i}", clean_session=False)
+            # Um carregador de frota não tem LWT próprio; o testamento é da frota inteira
+            client.will_set(self.topic_status, payload=json.dumps({"frota": frota_id, "status": "offline"}), qos=1, retain=True)
+            # Cada conexão tem seu spool de eventos, compartilhado pelos carregadores dela
+            publicador = PublicadorConfiavel(client, SpoolEventos(caminho_spool(f"{frota_id}-{i}")))
+            client.on_connect = self._on_connect_secundario
+            self.clients.append(client)
+            self.publicadores.append(publicador)
+
+        # Apenas a primeira conexão recebe mensagens (comandos e relógio global)
+        self.clients[0].on_connect = self.on_connect
+        self.clients[0].on_message = self.on_message
+
+    def _conexao_para(self, carregador_id):
+        indice = zlib.crc32(carregador_id.encode()) % len(self.clients)
+        return self.clients[indice], self.publicadores[indice]
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("Frota %s conectada ao Broker MQTT!", self.frota_id)
+            client.subscribe(self.topic_comandos, qos=1)
+            client.subscribe(self.topic_relogio)
+            client.publish(self.topic_status, json.dumps({"frota": self.frota_id, "status": "online"}), qos=1, retain=True)
+            self.publicadores[0].ao_conectar()
+        else:
+            log.error("Falha na conexão, código de retorno: %s", rc)
+
+    def _on_connect_secundario(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.publicadores[self.clients.index(client)].ao_conectar()
+
+    def on_message(self, client, userdata, msg):
+        metricas.contar_recebida(msg.topic)
+        try:
+            payload = metricas.decodificar_medindo(decodificar, msg.payload)
+        except ValueError:
+            log.warning("Erro ao decodificar mensagem em '%s'", msg.topic)
+            return
+
+        if msg.topic == self.topic_comandos:
+            # Os comandos alteram o dicionário de carregadores; são aplicados no loop asyncio
+            self.loop.call_soon_threadsafe(self.aplicar_comando, payload)
+            return
+
+        # Em vez de entregar cada beacon/evento a cada carregador local (O(N) por
+        # mensagem), guardamos apenas o maior timestamp visto. Cada carregador incorpora esse
+        # valor no seu próximo ciclo, antes de publicar.
+        timestamp = payload.get("timestamp")
+        if isinstance(timestamp, int) and timestamp > self.ultimo_timestamp_global:
+            self.ultimo_timestamp_global = timestamp
+
+    def aplicar_comando(self, comando):
+        acao = comando.get("acao")
+        ids = comando.get("carregadores") or []
+        if acao == "iniciar":
+            for carregador_id in ids:
+                self.adicionar(carregador_id)
+        elif acao == "parar":
+            for carregador_id in ids:
+                self.remover(carregador_id)
+        elif acao == "parar_todos":
+            for carregador_id in list(self.carregadores):
+                self.remover(carregador_id)
+        else:
+            log.warning("Comando desconhecido: %s", comando)
+            return
+        metricas.FROTA_CARREGADORES.set(len(self.carregadores))
+        log.info("Comando '%s' aplicado. Carregadores ativos: %d", acao, len(self.carregadores))
+
+    def adicionar(self, carregador_id):
+        if carregador_id in self.carregadores:
+            return
+        client, publicador = self._conexao_para(carregador_id)
+        carregador = Carregador(carregador_id, client=client, verbose=VERBOSE, publicador=publicador)
+        self.carregadores[carregador_id] = carregador
+        carregador.publicar_status()
+
+    def remover(self, carregador_id):
+        carregador = self.carregadores.pop(carregador_id, None)
+        if carregador is None:
+            return
+        if carregador.carro_conectado:
+            carregador.finalizar_carregamento()
+        carregador.client.publish(carregador.topic_status, codificar(carregador.payload_offline()), qos=1, retain=True)
+
+    def _passo_carregador(self, carregador):
+        local = carregador.clock.get_time()
+        metricas.DERIVA_RELOGIO.labels(metricas.SERVICO).observe(abs(self.ultimo_timestamp_global - local))
+        if self.ultimo_timestamp_global > local:
+            carregador.clock.receive_event(self.ultimo_timestamp_global)
+        carregador.passo()
+
+    def _atualizar_metricas(self):
+        # Uma vez por ciclo completo: percorre todos os carregadores
+        sessoes = 0
+        relogio = 0
+        for carregador in self.carregadores.values():
+            sessoes += carregador.carro_conectado is not None
+            relogio = max(relogio, carregador.clock.get_time())
+        metricas.SESSOES_ATIVAS.labels(metricas.SERVICO).set(sessoes)
+        metricas.RELOGIO.labels(metricas.SERVICO).set(relogio)
+
+    async def simular(self):
+        intervalo_fatia = self.tick / NUM_FATIAS
+        fatia = 0
+        while True:
+            inicio = self.loop.time()
+            # Snapshot da lista: comandos podem adicionar/remover durante a fatia
+            for carregador in list(self.carregadores.values())[fatia::NUM_FATIAS]:
+                self._passo_carregador(carregador)
+            fatia = (fatia + 1) % NUM_FATIAS
+            decorrido = self.loop.time() - inicio
+            metricas.FROTA_FATIA.observe(decorrido)
+            if fatia == 0:
+                self._atualizar_metricas()
+            if decorrido > intervalo_fatia:
+                log.warning("Fatia atrasada: %.3fs (limite %.3fs) com %d carregadores", decorrido, intervalo_fatia, len(self.carregadores))
+            await asyncio.sleep(max(0, intervalo_fatia - decorrido))
+
+    async def run(self, carregadores_iniciais=()):
+        self.loop = asyncio.get_running_loop()
+        # SIGTERM (enviado pela API ao parar a frota) cancela a simulação e
+        # permite publicar o status 'offline' de cada carregador
+        self.loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        if metricas.iniciar_exportador(METRICAS_PORTA):
+            log.info("Métricas em http://0.0.0.0:%s/metrics", METRICAS_PORTA)
+        for client in self.clients:
+            client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
+            client.loop_start()
+
+        for carregador_id in carregadores_iniciais:
+            self.adicionar(carregador_id)
+
+        try:
+            await self.simular()
+        finally:
+            log.info("Desligando %d carregadores...", len(self.carregadores))
+            for carregador_id in list(self.carregadores):
+                self.remover(carregador_id)
+            self.clients[0].publish(self.topic_status, json.dumps({"frota": self.frota_id, "status": "offline"}), qos=1, retain=True)
+            for client in self.clients:
+                # disconnect() entra na fila depois das publicações pendentes
+                client.disconnect()
+                client.loop_stop()
+            for publicador in self.publicadores:
+                publicador.fechar()
+
+
+if __name__ == "__main__":
+    # Uso: python frota.py [FROTA_ID] [QUANTIDADE_INICIAL] [ID_CARREGADOR ...]
+    frota_id = sys.argv[1] if len(sys.argv) > 1 else FROTA_ID
+    quantidade = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    iniciais = [f"{frota_id}-CP{i:05d}" for i in range(quantidade)] + sys.argv[3:]
+
+    metricas.definir_servico("frota")
+    frota = Frota(frota_id)
+    try:
+        asyncio.run(frota.run(iniciais))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,92 @@
+from transporte import criar_cliente
+from codec import decodificar
+from log_eventos import LogEventos, LOG_EVENTOS_DIR
+from registro import obter_logger
+import metricas
+import os
+import signal
+import socket
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+METRICAS_PORTA = os.getenv("GRAVADOR_EVENTOS_METRICAS_PORTA")
+
+log = obter_logger("gravador-eventos")
+
+
+class GravadorEventos:
+    """
+    Grava no log de eventos (backend/log_eventos.py) tudo o que os
+    carregadores publicam em status, eventos e leituras, na ordem de chegada.
+
+    A sessão MQTT é persistente (clean_session=False, QoS 1): enquanto o
+    gravador reinicia, o broker guarda os eventos e leituras, que são gravados
+    quando ele volta. É esse log que a API relê no startup e que o
+    backend/replay.py usa para reprocessar o billing.
+    """
+
+    def __init__(self, diretorio=LOG_EVENTOS_DIR):
+        self.log_eventos = LogEventos(diretorio)
+        self.topicos = ["carregadores/+/status", "carregadores/+/eventos", "carregadores/+/leituras"]
+        self.client = criar_cliente("gravador-eventos", clean_session=False)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.gravadas = 0
+        self._parar = threading.Event()
+
+    def on_connect(self, client, userdata, flags, rc):
+        log.info("Gravador de eventos conectado! Gravando em '%s'", self.log_eventos.diretorio)
+        client.subscribe([(topico, 1) for topico in self.topicos])
+
+    def on_message(self, client, userdata, msg):
+        metricas.contar_recebida(msg.topic)
+        # O timestamp de Lamport vai no cabeçalho do registro para as consultas por
+        # intervalo; o payload é gravado como chegou
+        try:
+            payload = metricas.decodificar_medindo(decodificar, msg.payload)
+        except ValueError as e:
+            log.warning("Payload inválido em '%s': %s", msg.topic, e)
+            return
+        timestamp = payload.get("timestamp") if isinstance(payload, dict) else None
+        self.log_eventos.adicionar(msg.topic, msg.payload, timestamp if isinstance(timestamp, int) else None)
+        self.gravadas += 1
+
+    def run(self):
+        if metricas.iniciar_exportador(METRICAS_PORTA):
+            log.info("Métricas em http://0.0.0.0:%s/metrics", METRICAS_PORTA)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._parar.set())
+        try:
+            if self._conectar():
+                self.client.loop_start()
+                while not self._parar.wait(60):
+                    log.info("%d mensagens gravadas (segmento atual: %s)", self.gravadas, self.log_eventos.caminho)
+        except KeyboardInterrupt:
+            log.info("Desligando...")
+        finally:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.log_eventos.fechar()
+
+    def _conectar(self):
+        max_retries = 5
+        retry_delay = 5  # segundos
+        for tentativa in range(1, max_retries + 1):
+            try:
+                log.info("Tentando conectar ao broker em '%s' (Tentativa %d/%d)...", MQTT_BROKER_HOST, tentativa, max_retries)
+                self.client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
+                return True
+            except (socket.gaierror, ConnectionRefusedError, TimeoutError) as e:
+                log.warning("Falha na conexão: %s. Tentando novamente em %d segundos...", e, retry_delay)
+                time.sleep(retry_delay)
+        log.error("Não foi possível conectar ao broker após %d tentativas. Desligando.", max_retries)
+        return False
+
+
+if __name__ == "__main__":
+    metricas.definir_servico("gravador-eventos")
+    GravadorEventos().run()
@@ -0,0 +1,283 @@
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
+import metricas
+from registro import obter_logger
+
+log = obter_logger("gravador")
+
+DB_POOL_MIN = int(os.getenv("BILLING_DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("BILLING_DB_POOL_MAX", "4"))
+BATCH_SIZE = int(os.getenv("BILLING_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("BILLING_FLUSH_INTERVAL", "0.5"))  # segundos
+FILA_MAX = int(os.getenv("BILLING_FILA_MAX", "10000"))
+# Tentativas de um lote durante o desligamento; fora dele o gravador insiste
+# até o banco voltar (a fila cheia segura o consumo do MQTT)
+MAX_TENTATIVAS = 5
+ESPERA_MAX = 5  # segundos entre tentativas
+# Lotes que não puderam ser gravados antes de o billing sair; regravados no próximo início
+PENDENTES_DIR = os.getenv("BILLING_PENDENTES_DIR", "spool/billing")
+# As migrações são aplicadas pela API (ou init_db.py); o billing espera o
+# esquema chegar à última versão de migracoes/ antes de gravar
+DIRETORIO_MIGRACOES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migracoes")
+
+# Transações repetidas (mesma chave de idempotência) são ignoradas pelo banco;
+# o RETURNING informa quais foram de fato inseridas
+SQL_INSERT = """
+    INSERT INTO transacoes (carro_id, carregador_id, energia_total_kWh, custo_total_brl, timestamp_transacao, chave_idempotencia,
+                            energia_medida_kwh, leituras_recebidas, leituras_esperadas, divergencia, tarifa)
+    VALUES %s
+    ON CONFLICT (chave_idempotencia) DO NOTHING
+    RETURNING chave_idempotencia;
+"""
+
+_FIM = object()
+
+
+class EsquemaDesatualizado(Exception):
+    pass
+
+
+def versao_esquema_necessaria(diretorio=DIRETORIO_MIGRACOES):
+    """Maior versão `NNNN_nome.sql` em migracoes/ (0 se o diretório não existir)."""
+    try:
+        arquivos = os.listdir(diretorio)
+    except FileNotFoundError:
+        return 0
+    return max((int(m.group(1)) for m in map(re.compile(r"(\d+)_\w+\.sql").fullmatch, arquivos) if m), default=0)
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class GravadorTransacoes:
+    """
+    Grava transações no banco em lotes, a partir de uma thread dedicada.
+
+    As transações entram numa fila limitada; a thread de escrita agrupa o que
+    estiver na fila em um único INSERT multi-linha, disparado quando o lote
+    atinge `batch_size` ou quando `flush_interval` segundos se passam desde a
+    primeira transação pendente. As conexões vêm de um pool persistente,
+    criado na primeira gravação (e de novo, se falhar): o billing sobe mesmo
+    com o banco fora do ar.
+    Depois de cada commit, `ao_gravar` (se informado) recebe as transações do
+    lote que foram inseridas (as duplicadas ficam de fora).
+
+    Nenhum lote é descartado: se o banco falha, o gravador tenta de novo até
+    ele voltar, e enquanto isso a fila enche e segura quem envia. No
+    desligamento (`iniciar_desligamento`/`fechar`) o lote que ainda falhar
+    MAX_TENTATIVAS vezes vai para um arquivo em `pendentes_dir`, regravado
+    quando um gravador com o mesmo diretório iniciar.
+    """
+
+    def __init__(self, database_url, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 fila_max=FILA_MAX, pool_min=DB_POOL_MIN, pool_max=DB_POOL_MAX, ao_gravar=None,
+                 pendentes_dir=None):
+        self.database_url = database_url
+        self.pendentes_dir = pendentes_dir
+        self.ao_gravar = ao_gravar
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fila = queue.Queue(maxsize=fila_max)
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.pool = None
+        self.versao_esquema = versao_esquema_necessaria()
+        self._esquema_ok = False
+        self._thread = threading.Thread(target=self._loop, name="gravador-transacoes", daemon=True)
+        self._fechado = False
+        self._desligando = threading.Event()
+        self._thread.start()
+
+    def enviar(self, transacao, confirmar=None):
+        """
+        Enfileira uma transação para gravação. Se a fila estiver cheia, bloqueia
+        o chamador até haver espaço (backpressure sobre o consumo MQTT).
+        `confirmar()` é chamado quando a transação está segura: gravada (ou já
+        existente) no banco ou, no desligamento, guardada em disco.
+        """
+        if self._fechado:
+            raise RuntimeError("Gravador de transações já foi fechado.")
+        item = (transacao, confirmar)
+        try:
+            self.fila.put_nowait(item)
+        except queue.Full:
+            log.warning("Fila de transações cheia (%d). Aguardando o gravador...", self.fila.maxsize)
+            self.fila.put(item)
+
+    def iniciar_desligamento(self):
+        """
+        Deixa de esperar o banco indefinidamente: um lote que falhar
+        MAX_TENTATIVAS vezes vai para o disco, para que o desligamento termine.
+        """
+        self._desligando.set()
+
+    def fechar(self):
+        """Grava tudo o que estiver pendente e libera o pool de conexões."""
+        if self._fechado:
+            return
+        self._fechado = True
+        self.iniciar_desligamento()
+        self.fila.put(_FIM)
+        self._thread.join()
+        if self.pool is not None:
+            self.pool.closeall()
+
+    def _loop(self):
+        self._regravar_pendentes()
+        while True:
+            item = self.fila.get()
+            if item is _FIM:
+                return
+
+            lote = [item]
+            prazo = time.monotonic() + self.flush_interval
+            fim = False
+            while len(lote) < self.batch_size:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self.fila.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is _FIM:
+                    fim = True
+                    break
+                lote.append(item)
+
+            self._gravar_lote([transacao for transacao, _ in lote])
+            for _, confirmar in lote:
+                if confirmar is not None:
+                    confirmar()
+            if fim:
+                return
+
+    def _conexao(self):
+        # Chamado só pela thread de escrita
+        if self.pool is None:
+            self.pool = pg_pool.ThreadedConnectionPool(self.pool_min, self.pool_max, self.database_url)
+        return self.pool.getconn()
+
+    def _verificar_esquema(self, conn):
+        """Falha (e o lote espera) enquanto as migrações que o INSERT usa não foram aplicadas."""
+        with conn.cursor() as cur:
+            cur.execute("SELECT coalesce(max(versao), 0) FROM schema_migracoes")
+            versao = cur.fetchone()[0]
+        conn.rollback()
+        if versao < self.versao_esquema:
+            raise EsquemaDesatualizado(f"esquema do banco na versão {versao}, o billing precisa da {self.versao_esquema}: aguardando as migrações")
+        self._esquema_ok = True
+
+    def _gravar_lote(self, lote):
+        recebidas = len(lote)
+        # Chaves repetidas no mesmo lote: o banco grava uma, então só a primeira
+        # segue (senão as duas passariam no filtro de `inseridas` e seriam publicadas)
+        unicas = {}
+        for t in lote:
+            unicas.setdefault(t['chave_idempotencia'], t)
+        lote = list(unicas.values())
+        valores = [
+            (t['carro'], t['carregador'], t['energia_total_kWh'], t['custo_total_brl'], t['timestamp_transacao'], t['chave_idempotencia'],
+             t.get('energia_medida_kWh'), t.get('leituras_recebidas'), t.get('leituras'), t.get('divergencia'), t.get('tarifa'))
+            for t in lote
+        ]
+
+        inicio = time.perf_counter()
+        tentativa = 0
+        while True:
+            tentativa += 1
+            conn = None
+            try:
+                conn = self._conexao()
+                if not self._esquema_ok:
+                    self._verificar_esquema(conn)
+                with conn.cursor() as cur:
+                    inseridas = {linha[0] for linha in execute_values(cur, SQL_INSERT, valores, page_size=len(valores), fetch=True)}
+                conn.commit()
+                self.pool.putconn(conn)
+                break
+            except (psycopg2.Error, EsquemaDesatualizado) as e:
+                log.warning("Erro ao salvar lote de %d transações (tentativa %d): %s", len(lote), tentativa, e)
+                if conn is not None:
+                    # Conexões quebradas são descartadas do pool
+                    quebrada = conn.closed != 0
+                    if not quebrada:
+                        try:
+                            conn.rollback()
+                        except psycopg2.Error:
+                            quebrada = True
+                    self.pool.putconn(conn, close=quebrada)
+                if self._desligando.is_set() and tentativa >= MAX_TENTATIVAS and self.pendentes_dir:
+                    self._guardar_pendente(lote)
+                    return
+                time.sleep(min(2 ** (tentativa - 1) * 0.1, ESPERA_MAX))
+
+        # Inclui as novas tentativas: é o atraso que o lote de fato sofreu
+        metricas.GRAVACAO_BANCO.observe(time.perf_counter() - inicio)
+        metricas.LOTE_BANCO.observe(len(lote))
+        metricas.TRANSACOES_GRAVADAS.inc(len(inseridas))
+        metricas.FILA_GRAVADOR.set(self.fila.qsize())
+        duplicadas = recebidas - len(inseridas)
+        if duplicadas:
+            metricas.TRANSACOES_DUPLICADAS.inc(duplicadas)
+            log.info("%d transações duplicadas ignoradas", duplicadas)
+        if self.ao_gravar is not None:
+            try:
+                self.ao_gravar([t for t in lote if t['chave_idempotencia'] in inseridas])
+            except Exception as e:
+                log.error("Erro no callback após gravar lote: %r", e)
+
+    # --- Lotes pendentes em disco ---
+
+    def _guardar_pendente(self, lote):
+        os.makedirs(self.pendentes_dir, exist_ok=True)
+        caminho = os.path.join(self.pendentes_dir, f"lote-{time.time_ns()}-{os.getpid()}.json")
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(lote, arquivo)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        # O rename é atômico: o arquivo final está sempre completo
+        os.replace(temporario, caminho)
+        metricas.LOTES_PENDENTES.inc()
+        log.error("Banco indisponível no desligamento: lote de %d transações guardado em '%s'", len(lote), caminho)
+
+    def _regravar_pendentes(self):
+        """Grava os lotes que ficaram em disco; cada arquivo é tomado (rename) por um só gravador."""
+        if not self.pendentes_dir:
+            return
+        # Arquivo tomado por um processo que caiu antes de terminar: volta para a fila
+        for tomado in glob.glob(os.path.join(self.pendentes_dir, "lote-*.json.*")):
+            caminho, _, pid = tomado.rpartition(".")
+            if pid.isdigit() and not _processo_vivo(int(pid)):
+                os.replace(tomado, caminho)
+        for caminho in sorted(glob.glob(os.path.join(self.pendentes_dir, "lote-*.json"))):
+            tomado = f"{caminho}.{os.getpid()}"
+            try:
+                os.rename(caminho, tomado)
+            except FileNotFoundError:
+                continue  # outro worker do billing já pegou
+            try:
+                with open(tomado, encoding="utf-8") as arquivo:
+                    lote = json.load(arquivo)
+            except (OSError, ValueError) as e:
+                log.error("Lote pendente ilegível em '%s': %s", tomado, e)
+                continue
+            log.info("Regravando lote pendente de %d transações de '%s'", len(lote), caminho)
+            self._gravar_lote(lote)
+            os.remove(tomado)
@@ -1,6 +1,42 @@
+import os
 import threading
+import time
+
+# "lamport": contador escalar; "hibrido": relógio lógico híbrido (HLC), com o
+# tempo físico em ms nos bits altos. Todos os serviços devem usar o mesmo modo.
+RELOGIO_MODO = os.getenv("RELOGIO_MODO", "lamport")
+
+# Bits do contador lógico no timestamp híbrido: (ms << 16) | contador. Cabe no
+# BIGINT de timestamp_transacao até o ano ~6400.
+BITS_LOGICO = 16
+MASCARA_LOGICO = (1 << BITS_LOGICO) - 1
+
+
+def criar_relogio(modo=None):
+    """Relógio do modo configurado (RELOGIO_MODO); a interface é a mesma."""
+    return RelogioHibrido() if (modo or RELOGIO_MODO) == "hibrido" else LamportClock()
+
+
+def timestamp_hibrido(epoch_s, contador=0):
+    """Timestamp híbrido de um instante (s desde a época): limite para consultas por horário."""
+    return (int(epoch_s * 1000) << BITS_LOGICO) | contador
+
+
+def epoch_do_timestamp(timestamp):
+    """Instante físico (s desde a época) de um timestamp híbrido."""
+    return (timestamp >> BITS_LOGICO) / 1000
+
 
 class LamportClock:
+    """
+    Relógio de Lamport. As leituras (get_time) não usam a trava: o valor é um
+    int trocado por atribuição, que o interpretador lê de forma atômica. Só as
+    escritas são serializadas, e `reservar` tira vários timestamps de uma vez
+    para quem publica em lote.
+    """
+
+    __slots__ = ("time", "_lock")
+
     def __init__(self):
         self.time = 0
         self._lock = threading.Lock()
@@ -22,6 +58,16 @@ class LamportClock:
             self.time += 1
             return self.time
 
+    def reservar(self, quantidade):
+        """
+        Reserva `quantidade` timestamps consecutivos numa única operação e
+        devolve o range deles (equivale a chamar send_event várias vezes).
+        """
+        with self._lock:
+            inicio = self.time + 1
+            self.time += quantidade
+            return range(inicio, self.time + 1)
+
     def receive_event(self, received_timestamp):
         """
         Atualiza o relógio ao receber uma mensagem.
@@ -31,5 +77,54 @@ class LamportClock:
             return self.time
 
     def get_time(self):
+        return self.time
+
+    def deriva(self, local, recebido):
+        """Distância entre dois timestamps, em ticks."""
+        return abs(local - recebido)
+
+
+class RelogioHibrido(LamportClock):
+    """
+    Relógio lógico híbrido (HLC, Kulkarni et al.): o timestamp é o maior tempo
+    físico visto (ms) seguido de um contador lógico, no mesmo int do campo
+    `timestamp`. Preserva a ordem causal como o Lamport, fica próximo do
+    horário real (permite filtrar eventos por horário, ver timestamp_hibrido)
+    e não depende de sincronia entre os nós além da do NTP.
+
+    Se o contador estoura dentro do mesmo ms, o tempo lógico avança 1 ms.
+    """
+
+    __slots__ = ("_agora_ms",)
+
+    def __init__(self, agora_ms=None):
+        super().__init__()
+        self._agora_ms = agora_ms or (lambda: time.time_ns() // 1_000_000)
+
+    def _avancar(self, minimo):
+        # Chamado com a trava: o próximo timestamp é > minimo e >= o tempo físico
+        fisico = self._agora_ms() << BITS_LOGICO
+        self.time = fisico if fisico > minimo else minimo + 1
+        return self.time
+
+    def tick(self):
+        with self._lock:
+            return self._avancar(self.time)
+
+    def send_event(self):
+        with self._lock:
+            return self._avancar(self.time)
+
+    def reservar(self, quantidade):
         with self._lock:
-            return self.time
\ No newline at end of file
+            inicio = self._avancar(self.time)
+            self.time += quantidade - 1
+            return range(inicio, self.time + 1)
+
+    def receive_event(self, received_timestamp):
+        with self._lock:
+            return self._avancar(max(self.time, received_timestamp))
+
+    def deriva(self, local, recebido):
+        """Distância entre dois timestamps, em ms."""
+        return abs((local >> BITS_LOGICO) - (recebido >> BITS_LOGICO))
@@ -0,0 +1,161 @@
+# Log segmentado, só de acréscimo, das mensagens dos carregadores (eventos,
+# status e leituras), usado para reconstruir o estado da API e reprocessar o
+# billing (backend/replay.py).
+#
+# Cada segmento começa com CABECALHO_SEGMENTO e guarda registros
+#   timestamp de Lamport (q, -1 se ausente), recebido em (d, epoch),
+#   tamanho do tópico (H), tamanho do payload (I), tópico, payload
+# com o payload exatamente como chegou do broker (JSON ou binário). Ao fechar
+# um segmento é gravado ao lado um índice `.idx` com as faixas de timestamp e
+# de horário, que permite pular segmentos inteiros numa consulta por intervalo.
+# Sem depender de outros módulos do backend: a API importa este arquivo como
+# backend.log_eventos.
+import glob
+import json
+import os
+import struct
+import threading
+import time
+
+LOG_EVENTOS_DIR = os.getenv("LOG_EVENTOS_DIR", "log_eventos")
+LOG_EVENTOS_SEGMENTO_MB = float(os.getenv("LOG_EVENTOS_SEGMENTO_MB", "64"))
+# Segmentos mantidos em disco; os mais antigos são apagados (0 = todos)
+LOG_EVENTOS_MAX_SEGMENTOS = int(os.getenv("LOG_EVENTOS_MAX_SEGMENTOS", "100"))
+
+CABECALHO_SEGMENTO = b"LOGEV1\n"
+_REGISTRO = struct.Struct(">qdHI")
+
+
+def listar_segmentos(diretorio):
+    return sorted(glob.glob(os.path.join(diretorio, "segmento-*.log")))
+
+
+def _indice(segmento):
+    try:
+        with open(segmento[:-4] + ".idx") as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None  # segmento aberto ou interrompido por uma queda: é lido inteiro
+
+
+class LogEventos:
+    """
+    Escritor do log. As gravações vão para um buffer que é descarregado no
+    arquivo a cada `flush_intervalo` segundos (e ao trocar de segmento); cada
+    execução começa um segmento novo.
+    """
+
+    def __init__(self, diretorio=LOG_EVENTOS_DIR, tamanho_segmento_mb=LOG_EVENTOS_SEGMENTO_MB,
+                 max_segmentos=LOG_EVENTOS_MAX_SEGMENTOS, flush_intervalo=1.0):
+        self.diretorio = diretorio
+        self.tamanho_segmento = int(tamanho_segmento_mb * 1024 * 1024)
+        self.max_segmentos = max_segmentos
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+        existentes = listar_segmentos(diretorio)
+        self._numero = int(os.path.basename(existentes[-1])[9:-4]) + 1 if existentes else 0
+        self._arquivo = None
+        self._abrir_segmento()
+
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._descarregar_periodicamente, args=(flush_intervalo,), name="log-eventos", daemon=True)
+        self._thread.start()
+
+    def _abrir_segmento(self):
+        self.caminho = os.path.join(self.diretorio, f"segmento-{self._numero:08d}.log")
+        self._arquivo = open(self.caminho, "ab", buffering=1024 * 1024)
+        self._arquivo.write(CABECALHO_SEGMENTO)
+        self._tamanho = len(CABECALHO_SEGMENTO)
+        self._faixa = {"ts_min": None, "ts_max": None, "recebido_min": None, "recebido_max": None, "registros": 0}
+
+    def _fechar_segmento(self):
+        self._arquivo.close()
+        with open(self.caminho[:-4] + ".idx", "w") as arquivo:
+            json.dump(self._faixa, arquivo)
+        if self.max_segmentos:
+            for antigo in listar_segmentos(self.diretorio)[:-self.max_segmentos]:
+                os.remove(antigo)
+                if os.path.exists(antigo[:-4] + ".idx"):
+                    os.remove(antigo[:-4] + ".idx")
+
+    def adicionar(self, topico: str, payload: bytes, timestamp: int | None, recebido_em: float | None = None):
+        recebido_em = time.time() if recebido_em is None else recebido_em
+        timestamp = -1 if timestamp is None else timestamp
+        topico_bytes = topico.encode()
+        registro = _REGISTRO.pack(timestamp, recebido_em, len(topico_bytes), len(payload)) + topico_bytes + payload
+        with self._lock:
+            self._arquivo.write(registro)
+            self._tamanho += len(registro)
+            faixa = self._faixa
+            if timestamp >= 0:
+                faixa["ts_min"] = timestamp if faixa["ts_min"] is None else min(faixa["ts_min"], timestamp)
+                faixa["ts_max"] = timestamp if faixa["ts_max"] is None else max(faixa["ts_max"], timestamp)
+            if faixa["recebido_min"] is None:
+                faixa["recebido_min"] = recebido_em
+            faixa["recebido_max"] = recebido_em
+            faixa["registros"] += 1
+            if self._tamanho >= self.tamanho_segmento:
+                self._fechar_segmento()
+                self._numero += 1
+                self._abrir_segmento()
+
+    def _descarregar_periodicamente(self, intervalo):
+        while not self._parar.wait(intervalo):
+            with self._lock:
+                self._arquivo.flush()
+
+    def fechar(self):
+        self._parar.set()
+        with self._lock:
+            self._fechar_segmento()
+
+
+def ler_log(diretorio=LOG_EVENTOS_DIR, ts_de=None, ts_ate=None, desde=None, ate=None, sufixos=None):
+    """
+    Percorre o log em ordem de chegada, gerando (topico, payload, timestamp,
+    recebido_em). `ts_de`/`ts_ate` filtram pelo timestamp de Lamport e
+    `desde`/`ate` pelo horário de recebimento (epoch), com limites inclusivos;
+    `sufixos` restringe os tópicos (por exemplo ("/eventos", "/leituras")).
+    Registros sem timestamp não passam por um filtro de timestamp.
+    """
+    for segmento in listar_segmentos(diretorio):
+        faixa = _indice(segmento)
+        if faixa is not None and faixa["registros"]:
+            if ts_de is not None and (faixa["ts_max"] is None or faixa["ts_max"] < ts_de):
+                continue
+            if ts_ate is not None and (faixa["ts_min"] is None or faixa["ts_min"] > ts_ate):
+                continue
+            if desde is not None and faixa["recebido_max"] < desde:
+                continue
+            if ate is not None and faixa["recebido_min"] > ate:
+                continue
+
+        with open(segmento, "rb") as arquivo:
+            dados = arquivo.read()
+        if not dados.startswith(CABECALHO_SEGMENTO):
+            continue
+        posicao = len(CABECALHO_SEGMENTO)
+        while posicao + _REGISTRO.size <= len(dados):
+            timestamp, recebido_em, tam_topico, tam_payload = _REGISTRO.unpack_from(dados, posicao)
+            inicio = posicao + _REGISTRO.size
+            fim = inicio + tam_topico + tam_payload
+            if fim > len(dados):
+                break  # registro truncado por uma queda no meio da escrita
+            posicao = fim
+            if ts_de is not None and (timestamp < 0 or timestamp < ts_de):
+                continue
+            if ts_ate is not None and (timestamp < 0 or timestamp > ts_ate):
+                continue
+            if desde is not None and recebido_em < desde:
+                continue
+            if ate is not None and recebido_em > ate:
+                continue
+            topico = dados[inicio:inicio + tam_topico].decode()
+            if sufixos is not None and not topico.endswith(sufixos):
+                continue
+            yield topico, dados[inicio + tam_topico:fim], (None if timestamp < 0 else timestamp), recebido_em
+
+
+def resumo(diretorio=LOG_EVENTOS_DIR):
+    """Segmentos do log com suas faixas (segmentos sem índice aparecem com None)."""
+    return [{"segmento": os.path.basename(s), "bytes": os.path.getsize(s), "faixa": _indice(s)} for s in listar_segmentos(diretorio)]
@@ -0,0 +1,145 @@
+# Métricas no formato do Prometheus para carregadores, frota, billing e API.
+#
+# A API expõe /metrics; billing e frota sobem um exportador HTTP próprio
+# (iniciar_exportador) quando a porta é configurada. O prometheus_client é
+# opcional: sem ele as métricas viram no-ops e os serviços funcionam igual.
+import functools
+import re
+import time
+
+try:
+    import prometheus_client
+except ImportError:  # prometheus_client é opcional
+    prometheus_client = None
+
+# Latências de processamento (s): de dezenas de microssegundos a segundos
+BUCKETS_LATENCIA = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+BUCKETS_LOTE = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# Diferença entre o relógio local e o recebido: ticks de Lamport ou, no modo
+# híbrido, ms
+BUCKETS_DERIVA = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+
+class _MetricaNula:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+
+def _contador(nome, descricao, rotulos):
+    return prometheus_client.Counter(nome, descricao, rotulos) if prometheus_client else _MetricaNula()
+
+
+def _histograma(nome, descricao, rotulos, buckets):
+    return prometheus_client.Histogram(nome, descricao, rotulos, buckets=buckets) if prometheus_client else _MetricaNula()
+
+
+def _medidor(nome, descricao, rotulos):
+    return prometheus_client.Gauge(nome, descricao, rotulos) if prometheus_client else _MetricaNula()
+
+
+# --- MQTT ---
+MENSAGENS_RECEBIDAS = _contador("mqtt_mensagens_recebidas_total", "Mensagens MQTT recebidas", ["servico", "topico"])
+MENSAGENS_PUBLICADAS = _contador("mqtt_mensagens_publicadas_total", "Mensagens MQTT publicadas", ["servico", "topico"])
+DECODIFICACAO = _histograma("payload_decodificacao_segundos", "Tempo para decodificar um payload", ["servico"], BUCKETS_LATENCIA)
+ERROS_DECODIFICACAO = _contador("payload_erros_decodificacao_total", "Payloads inválidos descartados", ["servico"])
+
+# --- Relógio de Lamport ---
+RELOGIO = _medidor("relogio_lamport", "Valor atual do relógio de Lamport", ["servico"])
+DERIVA_RELOGIO = _histograma("relogio_lamport_deriva", "Diferença absoluta entre o relógio local e o timestamp recebido (ticks ou ms)", ["servico"], BUCKETS_DERIVA)
+
+# --- Sessões de carga ---
+SESSOES_ATIVAS = _medidor("sessoes_carga_ativas", "Sessões de carga em andamento", ["servico"])
+
+# --- Frota ---
+FROTA_CARREGADORES = _medidor("frota_carregadores", "Carregadores simulados pela frota", [])
+FROTA_FATIA = _histograma("frota_fatia_segundos", "Tempo para avançar uma fatia de carregadores", [], BUCKETS_LATENCIA)
+
+# --- Billing ---
+ESTAGIO_LATENCIA = _histograma("pipeline_estagio_latencia_segundos", "Espera na fila mais processamento de um item", ["estagio"], BUCKETS_LATENCIA)
+ESTAGIO_FILA = _medidor("pipeline_estagio_fila", "Itens aguardando em cada estágio", ["estagio"])
+ESTAGIO_ERROS = _contador("pipeline_estagio_erros_total", "Itens que falharam em cada estágio", ["estagio"])
+GRAVACAO_BANCO = _histograma("banco_gravacao_lote_segundos", "Tempo para gravar (e confirmar) um lote de transações", [], BUCKETS_LATENCIA)
+LOTE_BANCO = _histograma("banco_gravacao_lote_tamanho", "Transações por lote gravado", [], BUCKETS_LOTE)
+TRANSACOES_GRAVADAS = _contador("billing_transacoes_gravadas_total", "Transações novas gravadas", [])
+TRANSACOES_DUPLICADAS = _contador("billing_transacoes_duplicadas_total", "Transações ignoradas por idempotência", [])
+DIVERGENCIAS_MEDICAO = _contador("billing_divergencias_medicao_total", "Sessões com total do fim_carga inconsistente com as leituras do medidor", ["tipo"])
+LOTES_PENDENTES = _contador("billing_lotes_pendentes_total", "Lotes guardados em disco por falta de banco no desligamento", [])
+FILA_GRAVADOR = _medidor("banco_gravacao_fila", "Transações aguardando o gravador", [])
+
+# --- API ---
+WEBSOCKET_CLIENTES = _medidor("websocket_clientes", "Clientes WebSocket conectados", [])
+WEBSOCKET_FILA = _medidor("websocket_fila_mensagens", "Mensagens aguardando envio (soma e maior fila entre clientes)", ["agregacao"])
+WEBSOCKET_ENVIADAS = _contador("websocket_mensagens_enviadas_total", "Frames enviados aos clientes WebSocket", [])
+WEBSOCKET_DESCARTADAS = _contador("websocket_mensagens_descartadas_total", "Frames descartados por clientes lentos", [])
+CONSULTA_BANCO = _histograma("banco_consulta_segundos", "Tempo das consultas de leitura da API", ["consulta"], BUCKETS_LATENCIA)
+SUPERVISOR_WORKERS = _medidor("supervisor_workers", "Processos supervisionados pela API por estado", ["estado"])
+SUPERVISOR_REINICIOS = _contador("supervisor_reinicios_total", "Processos reiniciados depois de cair", ["tipo"])
+
+
+# Nome do serviço deste processo, usado no rótulo "servico"
+SERVICO = "desconhecido"
+
+
+def definir_servico(nome):
+    global SERVICO
+    SERVICO = nome
+
+
+@functools.lru_cache(maxsize=4096)
+def topico_metrica(topico):
+    """
+    Normaliza o tópico para um rótulo de baixa cardinalidade: o ID do
+    carregador, da frota ou do worker vira '+'.
+    """
+    return re.sub(r"^(carregadores|frotas|billing)/[^/]+/", r"\1/+/", topico) if topico.count("/") >= 2 else topico
+
+
+def contar_recebida(topico):
+    MENSAGENS_RECEBIDAS.labels(SERVICO, topico_metrica(topico)).inc()
+
+
+def contar_publicada(topico):
+    MENSAGENS_PUBLICADAS.labels(SERVICO, topico_metrica(topico)).inc()
+
+
+def decodificar_medindo(decodificar, dados):
+    """Chama `decodificar(dados)` registrando o tempo e os payloads inválidos."""
+    inicio = time.perf_counter()
+    try:
+        return decodificar(dados)
+    except ValueError:
+        ERROS_DECODIFICACAO.labels(SERVICO).inc()
+        raise
+    finally:
+        DECODIFICACAO.labels(SERVICO).observe(time.perf_counter() - inicio)
+
+
+def registrar_relogio(local, deriva=None):
+    """Valor do relógio local e, se houver, a deriva (clock.deriva) em relação ao recebido."""
+    RELOGIO.labels(SERVICO).set(local)
+    if deriva is not None:
+        DERIVA_RELOGIO.labels(SERVICO).observe(deriva)
+
+
+def iniciar_exportador(porta):
+    """Sobe o endpoint HTTP /metrics deste processo, se a porta foi configurada."""
+    if not porta or prometheus_client is None:
+        return False
+    prometheus_client.start_http_server(int(porta))
+    return True
+
+
+def gerar():
+    """Texto de exposição (conteúdo, content-type) para o /metrics da API."""
+    if prometheus_client is None:
+        return b"# prometheus_client nao instalado\n", "text/plain; charset=utf-8"
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
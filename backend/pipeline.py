@@ -0,0 +1,180 @@
+import collections
+import queue
+import threading
+import time
+import zlib
+import metricas
+from registro import obter_logger
+
+log = obter_logger("pipeline")
+
+_FIM = object()
+
+
+class Estagio:
+    """
+    Um estágio de processamento com fila limitada e um pool de workers.
+
+    Cada worker tem sua própria fila e os itens são distribuídos pelo hash da
+    chave (por exemplo, o ID do carregador), o que preserva a ordem dos itens
+    de uma mesma chave mesmo com vários workers. O resultado de `funcao` segue
+    para o próximo estágio; None descarta o item.
+
+    Um item pode levar uma função `confirmar` (ver ConfirmacoesMqtt), chamada
+    quando o item termina: descartado, com erro ou saindo do último estágio.
+    Com `repassa_confirmacao`, `funcao(item, confirmar)` assume a chamada (por
+    exemplo, só depois de gravar no banco).
+    """
+
+    def __init__(self, nome, funcao, workers=1, fila_max=1000, repassa_confirmacao=False):
+        self.nome = nome
+        self.funcao = funcao
+        self.repassa_confirmacao = repassa_confirmacao
+        self.filas = [queue.Queue(maxsize=fila_max) for _ in range(max(1, workers))]
+        self.proximo = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self.processados = 0
+        self.erros = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+        self._metrica_latencia = metricas.ESTAGIO_LATENCIA.labels(nome)
+        self._metrica_erros = metricas.ESTAGIO_ERROS.labels(nome)
+
+    def enviar(self, item, chave=None, confirmar=None):
+        """Enfileira um item; bloqueia se a fila do worker estiver cheia (backpressure)."""
+        indice = 0
+        if chave is not None and len(self.filas) > 1:
+            indice = zlib.crc32(chave.encode()) % len(self.filas)
+        self.filas[indice].put((time.monotonic(), chave, item, confirmar))
+
+    def iniciar(self):
+        for i, fila in enumerate(self.filas):
+            thread = threading.Thread(target=self._worker, args=(fila,), name=f"{self.nome}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def parar(self):
+        """Processa o que já está nas filas e encerra os workers."""
+        for fila in self.filas:
+            fila.put(_FIM)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self, fila):
+        while True:
+            entrada = fila.get()
+            if entrada is _FIM:
+                return
+            enfileirado_em, chave, item, confirmar = entrada
+            try:
+                if self.repassa_confirmacao:
+                    resultado = self.funcao(item, confirmar)
+                    confirmar = None
+                else:
+                    resultado = self.funcao(item)
+            except Exception as e:
+                with self._lock:
+                    self.erros += 1
+                self._metrica_erros.inc()
+                log.error("Erro no estágio '%s': %r", self.nome, e)
+                if confirmar is not None:
+                    confirmar()
+                continue
+
+            latencia = time.monotonic() - enfileirado_em
+            with self._lock:
+                self.processados += 1
+                self._latencia_total += latencia
+                self._latencia_max = max(self._latencia_max, latencia)
+            self._metrica_latencia.observe(latencia)
+
+            if resultado is not None and self.proximo is not None:
+                self.proximo.enviar(resultado, chave, confirmar)
+            elif confirmar is not None:
+                confirmar()
+
+    def estatisticas(self):
+        """
+        Profundidade das filas e latência (espera na fila + processamento) do
+        estágio. A latência máxima é a observada desde a leitura anterior.
+        """
+        with self._lock:
+            processados = self.processados
+            media = self._latencia_total / processados if processados else 0.0
+            maxima = self._latencia_max
+            self._latencia_max = 0.0
+            erros = self.erros
+        fila = sum(f.qsize() for f in self.filas)
+        metricas.ESTAGIO_FILA.labels(self.nome).set(fila)
+        return {
+            "fila": fila,
+            "workers": len(self.filas),
+            "processados": processados,
+            "erros": erros,
+            "latencia_media_ms": round(media * 1000, 3),
+            "latencia_max_ms": round(maxima * 1000, 3),
+        }
+
+
+class Pipeline:
+    """Encadeia estágios: a saída de cada um é a entrada do seguinte."""
+
+    def __init__(self, estagios):
+        self.estagios = estagios
+        for atual, seguinte in zip(estagios, estagios[1:]):
+            atual.proximo = seguinte
+
+    def enviar(self, item, chave=None, confirmar=None):
+        self.estagios[0].enviar(item, chave, confirmar)
+
+    def iniciar(self):
+        for estagio in self.estagios:
+            estagio.iniciar()
+
+    def parar(self):
+        # Na ordem: cada estágio só para depois que o anterior entregou tudo
+        for estagio in self.estagios:
+            estagio.parar()
+
+    def estatisticas(self):
+        return {estagio.nome: estagio.estatisticas() for estagio in self.estagios}
+
+
+def _nada():
+    pass
+
+
+class ConfirmacoesMqtt:
+    """
+    PUBACKs manuais (cliente com manual_ack) enviados só quando a mensagem
+    terminou de ser processada, para que o broker reentregue o que estava nas
+    filas se o processo cair. `registrar` é chamado na ordem de chegada e
+    devolve a função `confirmar` da mensagem; os PUBACKs saem na mesma ordem
+    (como pede o MQTT 3.1.1), então uma mensagem lenta segura as seguintes.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+        self._fila = collections.deque()  # [mid, qos, pronta] na ordem de chegada
+
+    def registrar(self, mid, qos):
+        if not qos:
+            return _nada
+        registro = [mid, qos, False]
+        with self._lock:
+            self._fila.append(registro)
+        return lambda: self._confirmar(registro)
+
+    def _confirmar(self, registro):
+        with self._lock:
+            registro[2] = True
+            while self._fila and self._fila[0][2]:
+                mid, qos, _ = self._fila.popleft()
+                self.client.ack(mid, qos)
+
+    @property
+    def pendentes(self):
+        return len(self._fila)
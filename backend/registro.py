@@ -0,0 +1,102 @@
+# Logging dos serviços (carregadores, frota, billing e API).
+#
+# Substitui os print() incondicionais: cada mensagem tem nível (LOG_NIVEL,
+# padrão INFO; as mensagens por evento são DEBUG) e passa por um limite de taxa
+# por mensagem, para que um erro repetido a cada evento não inunde a saída.
+# LOG_FORMATO=json emite uma linha JSON por registro, com os campos passados em
+# extra={"campos": {...}}.
+import json
+import logging
+import os
+import threading
+import time
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.getenv("LOG_FORMATO", "texto")
+# Registros por segundo permitidos para uma mesma mensagem (0 = sem limite)
+LOG_LIMITE_POR_SEGUNDO = float(os.getenv("LOG_LIMITE_POR_SEGUNDO", "10"))
+LOG_RAJADA = int(os.getenv("LOG_RAJADA", "20"))
+
+
+class LimiteTaxa(logging.Filter):
+    """
+    Balde de fichas por (logger, nível, texto da mensagem sem argumentos). Os
+    registros descartados são contados e informados no próximo que passar.
+    """
+
+    def __init__(self, por_segundo=LOG_LIMITE_POR_SEGUNDO, rajada=LOG_RAJADA):
+        super().__init__()
+        self.por_segundo = por_segundo
+        self.rajada = rajada
+        self._baldes = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.por_segundo <= 0:
+            return True
+        chave = (record.name, record.levelno, record.msg)
+        agora = time.monotonic()
+        with self._lock:
+            fichas, atualizado_em, suprimidas = self._baldes.get(chave, (self.rajada, agora, 0))
+            fichas = min(self.rajada, fichas + (agora - atualizado_em) * self.por_segundo)
+            if fichas < 1:
+                self._baldes[chave] = (fichas, agora, suprimidas + 1)
+                return False
+            self._baldes[chave] = (fichas - 1, agora, 0)
+        if suprimidas:
+            record.suprimidas = suprimidas
+        return True
+
+
+class FormatoTexto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record):
+        texto = super().format(record)
+        campos = getattr(record, "campos", None)
+        if campos:
+            texto += " " + " ".join(f"{chave}={valor}" for chave, valor in campos.items())
+        suprimidas = getattr(record, "suprimidas", 0)
+        if suprimidas:
+            texto += f" ({suprimidas} mensagens iguais suprimidas)"
+        return texto
+
+
+class FormatoJson(logging.Formatter):
+    def format(self, record):
+        registro = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        registro.update(getattr(record, "campos", None) or {})
+        suprimidas = getattr(record, "suprimidas", 0)
+        if suprimidas:
+            registro["suprimidas"] = suprimidas
+        if record.exc_info:
+            registro["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(registro, default=str, ensure_ascii=False)
+
+
+_configurado = False
+
+
+def configurar_logging():
+    """Instala o handler dos serviços no logger raiz (uma única vez por processo)."""
+    global _configurado
+    if _configurado:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(FormatoJson() if LOG_FORMATO == "json" else FormatoTexto())
+    handler.addFilter(LimiteTaxa())
+    raiz = logging.getLogger()
+    raiz.addHandler(handler)
+    raiz.setLevel(LOG_NIVEL)
+    _configurado = True
+
+
+def obter_logger(nome):
+    configurar_logging()
+    return logging.getLogger(nome)
@@ -0,0 +1,48 @@
+import os
+import threading
+from codec import codificar
+
+TOPICO_BEACON = "relogio/beacon"
+INTERVALO_BEACON = float(os.getenv("RELOGIO_BEACON_INTERVALO", "5"))  # segundos
+# "beacon": carregadores sincronizam o relógio apenas pelo beacon agregado
+# "global": comportamento antigo, cada carregador escuta carregadores/+/eventos
+MODO_SINCRONIA = os.getenv("CLOCK_SYNC_MODE", "beacon")
+
+
+class BeaconRelogio:
+    """
+    Publica periodicamente o relógio de Lamport de um serviço que já observa
+    todos os eventos (o billing) no tópico retido `relogio/beacon`.
+
+    Os carregadores escutam só esse tópico em vez de receber o evento de todos
+    os outros carregadores. A ordenação de Lamport continua garantida, pois ela
+    só depende de mesclar o relógio nas mensagens efetivamente consumidas; o
+    beacon apenas mantém os relógios da frota próximos entre si.
+    """
+
+    def __init__(self, client, clock, origem, intervalo=INTERVALO_BEACON):
+        self.client = client
+        self.clock = clock
+        self.origem = origem
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._ultimo_publicado = None
+        self._thread = threading.Thread(target=self._loop, name="beacon-relogio", daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            timestamp = self.clock.get_time()
+            # Sem eventos novos não há por que republicar o mesmo valor
+            if timestamp == self._ultimo_publicado:
+                continue
+            payload = {"origem": self.origem, "timestamp": timestamp}
+            self.client.publish(TOPICO_BEACON, codificar(payload), qos=0, retain=True)
+            self._ultimo_publicado = timestamp
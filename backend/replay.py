@@ -0,0 +1,120 @@
+# Reprocessamento do billing a partir do log de eventos gravado por
+# backend/gravador_eventos.py, o mais rápido possível (sem esperar o tempo real
+# entre os eventos). As transações vão para o banco pelo GravadorTransacoes;
+# sessões já cobradas são ignoradas pela chave de idempotência, então repetir
+# um intervalo não duplica cobranças.
+#
+# Uso:
+#   python backend/replay.py billing [--de-ts N] [--ate-ts N] [--desde ISO] [--ate ISO]
+#   python backend/replay.py resumo
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from billing import BillingService, DATABASE_URL
+from codec import decodificar
+from gravador_transacoes import GravadorTransacoes
+from log_eventos import LOG_EVENTOS_DIR, ler_log, resumo
+from registro import obter_logger
+import metricas
+
+# Segundos de log lidos antes de --desde só para montar a medição das sessões
+# que começaram antes do intervalo (sem isso elas seriam auditadas como
+# "leituras_perdidas")
+REPLAY_AQUECIMENTO = float(os.getenv("REPLAY_AQUECIMENTO", "3600"))
+# Eventos por lote: as sessões encerradas num lote são precificadas juntas
+REPLAY_LOTE = int(os.getenv("REPLAY_LOTE", "5000"))
+
+log = obter_logger("replay")
+
+
+def _epoch(texto):
+    if texto is None:
+        return None
+    data = datetime.fromisoformat(texto)
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return data.timestamp()
+
+
+def reprocessar_billing(gravador, diretorio=LOG_EVENTOS_DIR, ts_de=None, ts_ate=None, desde=None, ate=None,
+                        aquecimento=REPLAY_AQUECIMENTO, tamanho_lote=REPLAY_LOTE):
+    """
+    Passa por `BillingService.processar_lote` os eventos e leituras do log
+    dentro do intervalo (timestamp de Lamport e/ou horário de recebimento) e
+    devolve as contagens. Os preços por horário usam o horário de recebimento
+    gravado. Os registros anteriores ao intervalo que ainda são lidos
+    (aquecimento) só alimentam a medição das sessões, sem gerar cobrança.
+    """
+    billing = BillingService()
+    billing.gravador = gravador
+    # Uma carga só das tarifas, sem a thread de recarga
+    billing.tarifas.carregar()
+    contagem = {"lidos": 0, "processados": 0, "aquecimento": 0, "invalidos": 0, "transacoes": 0}
+    lote = []
+    inicio = time.perf_counter()
+    leitura_desde = None if desde is None else desde - aquecimento
+
+    for topico, dados, timestamp, recebido_em in ler_log(diretorio, ts_ate=ts_ate, desde=leitura_desde, ate=ate, sufixos=("/eventos", "/leituras")):
+        contagem["lidos"] += 1
+        try:
+            evento = decodificar(dados)
+        except ValueError:
+            contagem["invalidos"] += 1
+            continue
+        if not isinstance(evento, dict) or "timestamp" not in evento:
+            contagem["invalidos"] += 1
+            continue
+
+        if (ts_de is not None and (timestamp is None or timestamp < ts_de)) or (desde is not None and recebido_em < desde):
+            contagem["aquecimento"] += 1
+            if evento.get("acao") == "fim_carga":
+                # Sessão encerrada antes do intervalo: descarta a medição dela
+                medicao = billing.medicoes.get(evento.get("carregador"))
+                if medicao is not None and medicao["sessao"] == evento.get("sessao"):
+                    del billing.medicoes[evento.get("carregador")]
+            else:
+                billing.faturar(evento, recebido_em)
+            continue
+
+        lote.append((evento, recebido_em))
+        contagem["processados"] += 1
+        if len(lote) >= tamanho_lote:
+            contagem["transacoes"] += billing.processar_lote(lote)
+            lote = []
+
+    if lote:
+        contagem["transacoes"] += billing.processar_lote(lote)
+    gravador.fechar()
+    duracao = time.perf_counter() - inicio
+    contagem["duracao_s"] = round(duracao, 3)
+    contagem["eventos_por_s"] = round(contagem["processados"] / duracao, 1) if duracao > 0 else None
+    return contagem
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocessa o billing a partir do log de eventos")
+    parser.add_argument("comando", choices=["billing", "resumo"])
+    parser.add_argument("--dir", default=LOG_EVENTOS_DIR, help="diretório do log de eventos")
+    parser.add_argument("--de-ts", type=int, help="menor timestamp de Lamport (inclusivo)")
+    parser.add_argument("--ate-ts", type=int, help="maior timestamp de Lamport (inclusivo)")
+    parser.add_argument("--desde", help="recebidos a partir de (ISO 8601; sem fuso = UTC)")
+    parser.add_argument("--ate", help="recebidos até (ISO 8601; sem fuso = UTC)")
+    args = parser.parse_args()
+
+    if args.comando == "resumo":
+        print(json.dumps(resumo(args.dir), indent=2))
+        return
+
+    if not DATABASE_URL:
+        log.error("A variável de ambiente DATABASE_URL não foi definida.")
+        return
+    metricas.definir_servico("replay")
+    log.info("Reprocessando o billing a partir de '%s'...", args.dir)
+    contagem = reprocessar_billing(GravadorTransacoes(DATABASE_URL), args.dir, args.de_ts, args.ate_ts, _epoch(args.desde), _epoch(args.ate))
+    print(json.dumps(contagem, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import struct
+import threading
+from paho.mqtt import client as mqtt_client
+from registro import obter_logger
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_MAX_EVENTOS = int(os.getenv("SPOOL_MAX_EVENTOS", "100000"))
+# Quantas confirmações acumular no arquivo antes de reescrevê-lo só com os pendentes
+SPOOL_COMPACTAR = int(os.getenv("SPOOL_COMPACTAR", "10000"))
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "0") == "1"
+MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "100"))
+MAX_FILA_MQTT = int(os.getenv("MQTT_MAX_FILA", "10000"))
+
+log = obter_logger("spool")
+
+# Registros do arquivo: 'E' (evento) seq, timestamp, tamanho do tópico, tamanho do payload;
+# 'A' (confirmado) seq
+_CABECALHO_EVENTO = struct.Struct(">cQqHI")
+_CABECALHO_ACK = struct.Struct(">cQ")
+
+
+class SpoolEventos:
+    """
+    Spool local, só de acréscimo, dos eventos ainda não confirmados pelo broker.
+
+    Cada evento é gravado antes de ser publicado e marcado como confirmado
+    quando chega o PUBACK. Se o processo cair, os pendentes são recarregados do
+    arquivo na próxima execução. O arquivo é reescrito apenas com os pendentes
+    depois de SPOOL_COMPACTAR confirmações.
+    """
+
+    def __init__(self, caminho, max_eventos=SPOOL_MAX_EVENTOS, fsync=SPOOL_FSYNC):
+        self.caminho = caminho
+        self.max_eventos = max_eventos
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pendentes: dict[int, tuple[str, bytes, int]] = {}
+        self._proximo_seq = 0
+        self._confirmados_no_arquivo = 0
+
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        if os.path.exists(caminho):
+            self._carregar()
+        self._arquivo = open(caminho, "ab")
+
+    def _carregar(self):
+        with open(self.caminho, "rb") as arquivo:
+            dados = arquivo.read()
+        posicao = 0
+        while posicao < len(dados):
+            tipo = dados[posicao:posicao + 1]
+            try:
+                if tipo == b"E":
+                    _, seq, timestamp, tam_topico, tam_payload = _CABECALHO_EVENTO.unpack_from(dados, posicao)
+                    posicao += _CABECALHO_EVENTO.size
+                    fim = posicao + tam_topico + tam_payload
+                    if fim > len(dados):
+                        break  # registro truncado por uma queda no meio da escrita
+                    topico = dados[posicao:posicao + tam_topico].decode()
+                    self._pendentes[seq] = (topico, dados[posicao + tam_topico:fim], timestamp)
+                    posicao = fim
+                elif tipo == b"A":
+                    _, seq = _CABECALHO_ACK.unpack_from(dados, posicao)
+                    posicao += _CABECALHO_ACK.size
+                    self._pendentes.pop(seq, None)
+                else:
+                    break
+            except struct.error:
+                break
+            self._proximo_seq = max(self._proximo_seq, seq + 1)
+
+        if self._pendentes:
+            log.info("%d eventos pendentes recuperados de '%s'", len(self._pendentes), self.caminho)
+        # Começa um arquivo limpo só com os pendentes
+        self._reescrever()
+
+    def _registro_evento(self, seq, topico, payload, timestamp):
+        topico_bytes = topico.encode()
+        return _CABECALHO_EVENTO.pack(b"E", seq, timestamp, len(topico_bytes), len(payload)) + topico_bytes + payload
+
+    def _reescrever(self):
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "wb") as arquivo:
+            for seq, (topico, payload, timestamp) in self._pendentes.items():
+                arquivo.write(self._registro_evento(seq, topico, payload, timestamp))
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, self.caminho)
+        self._confirmados_no_arquivo = 0
+
+    def adicionar(self, topico: str, payload: bytes, timestamp: int) -> int:
+        with self._lock:
+            if len(self._pendentes) >= self.max_eventos:
+                seq_antigo = next(iter(self._pendentes))
+                log.warning("Limite de %d eventos pendentes atingido; descartando o seq %d", self.max_eventos, seq_antigo)
+                self._pendentes.pop(seq_antigo)
+                self._arquivo.write(_CABECALHO_ACK.pack(b"A", seq_antigo))
+
+            seq = self._proximo_seq
+            self._proximo_seq += 1
+            self._pendentes[seq] = (topico, payload, timestamp)
+            self._arquivo.write(self._registro_evento(seq, topico, payload, timestamp))
+            self._arquivo.flush()
+            if self.fsync:
+                os.fsync(self._arquivo.fileno())
+            return seq
+
+    def confirmar(self, seq: int):
+        with self._lock:
+            if self._pendentes.pop(seq, None) is None:
+                return
+            # Confirmações não precisam de flush imediato: se forem perdidas numa
+            # queda, o evento só é reenviado (e o billing é idempotente)
+            self._arquivo.write(_CABECALHO_ACK.pack(b"A", seq))
+            self._confirmados_no_arquivo += 1
+            if self._confirmados_no_arquivo >= SPOOL_COMPACTAR:
+                self._arquivo.close()
+                self._reescrever()
+                self._arquivo = open(self.caminho, "ab")
+
+    def pendentes(self) -> list[tuple[int, str, bytes, int]]:
+        """Eventos não confirmados em ordem de timestamp de Lamport."""
+        with self._lock:
+            itens = [(seq, topico, payload, timestamp) for seq, (topico, payload, timestamp) in self._pendentes.items()]
+        itens.sort(key=lambda item: (item[3], item[0]))
+        return itens
+
+    def __len__(self):
+        return len(self._pendentes)
+
+    def fechar(self):
+        with self._lock:
+            self._arquivo.flush()
+            self._arquivo.close()
+
+
+class PublicadorConfiavel:
+    """
+    Publica eventos com QoS 1 passando pelo spool.
+
+    Enquanto desconectado, o próprio paho guarda as mensagens (até
+    MQTT_MAX_FILA) e as reenvia ao reconectar; o spool cobre a queda do
+    processo e o estouro dessa fila. Na conexão, os eventos do spool que não
+    estão com o paho são reenviados em ordem de Lamport. Até MQTT_MAX_INFLIGHT
+    mensagens ficam em voo ao mesmo tempo, para a confirmação não limitar a
+    taxa de publicação.
+    """
+
+    def __init__(self, client, spool: SpoolEventos, qos=1, max_inflight=MAX_INFLIGHT):
+        self.client = client
+        self.spool = spool
+        self.qos = qos
+        self._lock = threading.Lock()
+        self._mid_para_seq: dict[int, int] = {}
+        client.max_inflight_messages_set(max_inflight)
+        client.max_queued_messages_set(MAX_FILA_MQTT)
+        client.on_publish = self.on_publish
+
+    def publicar(self, topico: str, payload: bytes, timestamp: int):
+        seq = self.spool.adicionar(topico, payload, timestamp)
+        self._enviar(seq, topico, payload)
+
+    def _enviar(self, seq, topico, payload):
+        info = self.client.publish(topico, payload, qos=self.qos)
+        if info.rc not in (mqtt_client.MQTT_ERR_SUCCESS, mqtt_client.MQTT_ERR_NO_CONN):
+            # Fila do paho cheia: o evento fica só no spool até a próxima conexão
+            return
+        with self._lock:
+            self._mid_para_seq[info.mid] = seq
+        # O PUBACK pode ter chegado antes do mapeamento acima; on_publish o ignorou
+        if info.rc == mqtt_client.MQTT_ERR_SUCCESS and info.is_published():
+            self._confirmar(info.mid)
+
+    def on_publish(self, client, userdata, mid):
+        self._confirmar(mid)
+
+    def _confirmar(self, mid):
+        with self._lock:
+            seq = self._mid_para_seq.pop(mid, None)
+        if seq is not None:
+            self.spool.confirmar(seq)
+
+    def ao_conectar(self):
+        with self._lock:
+            com_o_paho = set(self._mid_para_seq.values())
+        reenviar = [p for p in self.spool.pendentes() if p[0] not in com_o_paho]
+        if reenviar:
+            log.info("Reenviando %d eventos pendentes", len(reenviar))
+        for seq, topico, payload, _ in reenviar:
+            self._enviar(seq, topico, payload)
+
+    def fechar(self):
+        self.spool.fechar()
+
+
+def caminho_spool(nome):
+    return os.path.join(SPOOL_DIR, f"{nome}.spool")
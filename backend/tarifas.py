@@ -0,0 +1,263 @@
+# Tarifas de energia por carregador e por local, com preços por horário
+# (migracoes/0005_tarifas.sql).
+#
+# As tarifas ficam em memória, compiladas num índice de intervalos da semana,
+# e são recarregadas do banco por uma thread a cada TARIFAS_TTL segundos ou
+# quando chega uma mensagem no tópico de controle; a precificação de um evento
+# nunca consulta o banco. O numpy é opcional: com ele, os lotes (replay) são
+# precificados de forma vetorizada.
+import bisect
+import functools
+import os
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import psycopg2
+from registro import obter_logger
+
+try:
+    import numpy
+except ImportError:  # numpy é opcional; sem ele os lotes são precificados um a um
+    numpy = None
+
+# Preço usado enquanto as tarifas não foram carregadas (ou sem a tarifa 'padrao')
+PRECO_PADRAO_KWH = float(os.getenv("TARIFA_PRECO_PADRAO_KWH", "0.75"))
+TARIFAS_TTL = float(os.getenv("TARIFAS_TTL", "300"))  # segundos
+# {"acao": "recarregar"} neste tópico faz todos os workers recarregarem as tarifas
+TOPICO_CONTROLE = "billing/controle/tarifas"
+
+DIA = 86400
+SEMANA = 7 * DIA
+# 1970-01-01 foi uma quinta: somar 3 dias faz a semana começar na segunda
+_AJUSTE_SEGUNDA = 3 * DIA
+
+log = obter_logger("tarifas")
+
+
+@functools.lru_cache(maxsize=64)
+def _zona(fuso):
+    try:
+        return ZoneInfo(fuso)
+    except (ZoneInfoNotFoundError, ValueError):
+        log.warning("Fuso '%s' desconhecido; usando UTC", fuso)
+        return timezone.utc
+
+
+@functools.lru_cache(maxsize=65536)
+def _deslocamento(fuso, hora):
+    """Diferença para UTC (s) do fuso na hora `hora` desde a época."""
+    return datetime.fromtimestamp(hora * 3600, _zona(fuso)).utcoffset().total_seconds()
+
+
+def segundo_da_semana(instante, fuso):
+    """Segundos desde segunda 00:00, no horário local do fuso, de um instante epoch."""
+    return (instante + _deslocamento(fuso, int(instante // 3600)) + _AJUSTE_SEGUNDA) % SEMANA
+
+
+def compilar(preco_base, janelas):
+    """
+    Transforma as janelas (dia_semana, inicio_s, fim_s, preco), em ordem de
+    prioridade crescente, numa função por partes da semana: limites ordenados
+    (o primeiro é 0) e o preço de cada trecho.
+    """
+    trechos = []
+    for dia, inicio, fim, preco in janelas:
+        if fim <= inicio:
+            # Atravessa a meia-noite: o resto fica para o dia seguinte
+            trechos.append((dia * DIA + inicio, (dia + 1) * DIA, preco))
+            if fim:
+                proximo = (dia + 1) % 7
+                trechos.append((proximo * DIA, proximo * DIA + fim, preco))
+        else:
+            trechos.append((dia * DIA + inicio, dia * DIA + fim, preco))
+
+    pontos = sorted({0, *(a for a, _, _ in trechos), *(b for _, b, _ in trechos if b < SEMANA)})
+    limites, precos = [], []
+    for i, ponto in enumerate(pontos):
+        fim_trecho = pontos[i + 1] if i + 1 < len(pontos) else SEMANA
+        preco = preco_base
+        for a, b, preco_janela in trechos:
+            # O último trecho que cobre vence (maior prioridade)
+            if a <= ponto and fim_trecho <= b:
+                preco = preco_janela
+        if not precos or precos[-1] != preco:
+            limites.append(ponto)
+            precos.append(preco)
+    return limites, precos
+
+
+class Tarifa:
+    """Tarifa compilada: o preço de um instante sai de uma busca binária nos limites."""
+
+    __slots__ = ("id", "nome", "fuso", "limites", "precos", "_limites_np", "_precos_np")
+
+    def __init__(self, id, nome, preco_kwh, janelas=(), fuso="UTC"):
+        self.id = id
+        self.nome = nome
+        self.fuso = fuso
+        self.limites, self.precos = compilar(preco_kwh, janelas)
+        self._limites_np = numpy.array(self.limites, dtype=numpy.float64) if numpy is not None else None
+        self._precos_np = numpy.array(self.precos, dtype=numpy.float64) if numpy is not None else None
+
+    def preco_em(self, instante):
+        if len(self.precos) == 1:
+            return self.precos[0]
+        return self.precos[bisect.bisect_right(self.limites, segundo_da_semana(instante, self.fuso)) - 1]
+
+    def custo(self, intervalos):
+        """Custo de uma lista de (instante, energia_kWh)."""
+        return sum(self.preco_em(instante) * energia for instante, energia in intervalos)
+
+    def custos_vetorizado(self, instantes, energias):
+        """Custo de cada (instante, energia) de dois arrays numpy."""
+        if len(self.precos) == 1:
+            return energias * self.precos[0]
+        horas = numpy.floor_divide(instantes, 3600).astype(numpy.int64)
+        unicas, inverso = numpy.unique(horas, return_inverse=True)
+        deslocamentos = numpy.array([_deslocamento(self.fuso, int(h)) for h in unicas])[inverso]
+        segundos = numpy.mod(instantes + deslocamentos + _AJUSTE_SEGUNDA, SEMANA)
+        indices = numpy.searchsorted(self._limites_np, segundos, side="right") - 1
+        return self._precos_np[indices] * energias
+
+
+def intervalos_consumo(perfil, energia_total, fim_em):
+    """
+    Divide a energia cobrada de uma sessão entre os trechos do perfil de
+    leituras [(instante, energia acumulada), ...] terminado em (fim_em,
+    energia_total). Cada trecho é precificado no instante do meio dele; a
+    energia anterior ao primeiro ponto fica no instante desse ponto. O
+    acumulado é limitado a [0, energia_total] e nunca decresce, então os
+    trechos somam exatamente energia_total.
+    """
+    intervalos = []
+    instante_anterior, energia_anterior = None, 0.0
+    for instante, energia in (*perfil, (fim_em, energia_total)):
+        energia = min(max(energia, energia_anterior), energia_total)
+        if energia > energia_anterior:
+            meio = instante if instante_anterior is None else (instante_anterior + instante) / 2
+            intervalos.append((meio, energia - energia_anterior))
+        instante_anterior, energia_anterior = instante, energia
+    return intervalos
+
+
+class _Indice:
+    """Tarifas e atribuições de uma carga do banco; substituído inteiro a cada recarga."""
+
+    def __init__(self, padrao, por_carregador=None, por_local=None):
+        self.padrao = padrao
+        self.por_carregador = por_carregador or {}
+        # Prefixos do mais longo para o mais curto
+        self.por_local = sorted((por_local or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.resolvidas: dict[str, Tarifa] = {}
+
+    def tarifa(self, carregador_id):
+        tarifa = self.resolvidas.get(carregador_id)
+        if tarifa is None:
+            tarifa = self.por_carregador.get(carregador_id)
+            if tarifa is None:
+                tarifa = next((t for prefixo, t in self.por_local if carregador_id and carregador_id.startswith(prefixo)), self.padrao)
+            self.resolvidas[carregador_id] = tarifa
+        return tarifa
+
+
+class MotorTarifas:
+    """
+    Tarifa de cada carregador e custo das sessões. `iniciar` carrega as
+    tarifas e sobe a thread de recarga; `invalidar` antecipa a próxima recarga.
+    Se o banco falhar, as tarifas anteriores continuam valendo.
+    """
+
+    def __init__(self, database_url, ttl=TARIFAS_TTL):
+        self.database_url = database_url
+        self.ttl = ttl
+        self._indice = _Indice(Tarifa(None, "padrao", PRECO_PADRAO_KWH))
+        self._recarregar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self.carregar()
+        self._thread = threading.Thread(target=self._loop, name="tarifas", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._recarregar.set()
+
+    def invalidar(self):
+        self._recarregar.set()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self._recarregar.wait(self.ttl)
+            self._recarregar.clear()
+            if not self._parar.is_set():
+                self.carregar()
+
+    def carregar(self):
+        try:
+            conn = psycopg2.connect(self.database_url)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, nome, preco_kwh, fuso FROM tarifas")
+                    linhas_tarifas = cur.fetchall()
+                    cur.execute("SELECT tarifa_id, dias_semana, inicio, fim, preco_kwh FROM tarifas_janelas ORDER BY prioridade, id")
+                    linhas_janelas = cur.fetchall()
+                    cur.execute("SELECT tipo, alvo, tarifa_id FROM tarifas_atribuicoes")
+                    linhas_atribuicoes = cur.fetchall()
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            log.warning("Falha ao carregar as tarifas (mantendo as atuais): %s", e)
+            return False
+
+        janelas: dict[int, list] = {}
+        for tarifa_id, dias, inicio, fim, preco in linhas_janelas:
+            inicio_s = inicio.hour * 3600 + inicio.minute * 60 + inicio.second
+            fim_s = fim.hour * 3600 + fim.minute * 60 + fim.second
+            for dia in dias:
+                janelas.setdefault(tarifa_id, []).append((dia, inicio_s, fim_s, float(preco)))
+        tarifas = {
+            tarifa_id: Tarifa(tarifa_id, nome, float(preco), janelas.get(tarifa_id, ()), fuso)
+            for tarifa_id, nome, preco, fuso in linhas_tarifas
+        }
+        padrao = next((t for t in tarifas.values() if t.nome == "padrao"), self._indice.padrao)
+        por_carregador = {alvo: tarifas[tarifa_id] for tipo, alvo, tarifa_id in linhas_atribuicoes if tipo == "carregador"}
+        por_local = {alvo: tarifas[tarifa_id] for tipo, alvo, tarifa_id in linhas_atribuicoes if tipo == "local"}
+        self._indice = _Indice(padrao, por_carregador, por_local)
+        log.info("Tarifas carregadas: %d tarifas, %d atribuições", len(tarifas), len(linhas_atribuicoes))
+        return True
+
+    def tarifa(self, carregador_id) -> Tarifa:
+        return self._indice.tarifa(carregador_id)
+
+    def custo(self, carregador_id, intervalos):
+        """(custo em R$, tarifa) de uma sessão."""
+        tarifa = self.tarifa(carregador_id)
+        return tarifa.custo(intervalos), tarifa
+
+    def custos_lote(self, sessoes):
+        """
+        Custo de várias sessões [(carregador_id, intervalos), ...], na mesma
+        ordem. Com numpy, os trechos de todas as sessões de uma mesma tarifa são
+        precificados numa única operação vetorizada.
+        """
+        tarifas = [self.tarifa(carregador_id) for carregador_id, _ in sessoes]
+        if numpy is None:
+            return [(tarifa.custo(intervalos), tarifa) for tarifa, (_, intervalos) in zip(tarifas, sessoes)]
+
+        custos = [0.0] * len(sessoes)
+        grupos: dict[int, list[int]] = {}
+        for i, tarifa in enumerate(tarifas):
+            if sessoes[i][1]:
+                grupos.setdefault(id(tarifa), []).append(i)
+        for indices in grupos.values():
+            tarifa = tarifas[indices[0]]
+            trechos = [trecho for i in indices for trecho in sessoes[i][1]]
+            valores = numpy.array(trechos, dtype=numpy.float64)
+            por_trecho = tarifa.custos_vetorizado(valores[:, 0], valores[:, 1])
+            # Soma os trechos de cada sessão
+            inicios = numpy.cumsum([0] + [len(sessoes[i][1]) for i in indices[:-1]])
+            for i, custo in zip(indices, numpy.add.reduceat(por_trecho, inicios)):
+                custos[i] = float(custo)
+        return list(zip(custos, tarifas))
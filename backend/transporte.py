@@ -0,0 +1,688 @@
+# Transporte MQTT dos serviços: o paho falando com um broker externo (padrão)
+# ou um broker embutido no próprio processo.
+#
+# O broker embutido (BrokerLocal) implementa o que os serviços usam do MQTT:
+# curingas + e #, mensagens retidas, LWT, QoS 0 e 1, sessões persistentes e
+# subscrições compartilhadas ($share/<grupo>/...). Serviços no mesmo processo
+# falam com ele pelo ClienteLocal, que tem a mesma interface do cliente do paho
+# e entrega os payloads por referência, sem pacotes MQTT nem TCP. O
+# ServidorMqtt expõe o mesmo broker em TCP (MQTT 3.1.1) para os processos
+# remotos, que continuam usando o paho.
+#
+# MQTT_TRANSPORTE=local faz criar_cliente() usar o broker embutido;
+# MQTT_BROKER_EMBUTIDO_PORTA faz a API subir o ServidorMqtt (nó único, sem
+# Mosquitto) e usar o transporte local para o próprio cliente.
+# Sem depender de outros módulos do backend: a API importa este arquivo como
+# backend.transporte.
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import queue
+import struct
+import threading
+from paho.mqtt import client as mqtt_client
+
+MQTT_TRANSPORTE = os.getenv("MQTT_TRANSPORTE", "mqtt")
+# Mensagens QoS 1 guardadas por sessão persistente desconectada
+MQTT_BROKER_MAX_PENDENTES = int(os.getenv("MQTT_BROKER_MAX_PENDENTES", "10000"))
+# Porta TCP do broker embutido; vazio desativa
+MQTT_BROKER_EMBUTIDO_PORTA = os.getenv("MQTT_BROKER_EMBUTIDO_PORTA")
+
+log = logging.getLogger("transporte")
+
+
+def criar_cliente(client_id, clean_session=True, manual_ack=False):
+    """
+    Cliente MQTT do transporte configurado (mesma interface nos dois casos).
+    Com `manual_ack`, o PUBACK de cada mensagem recebida só sai em client.ack().
+    """
+    if MQTT_TRANSPORTE == "local":
+        return ClienteLocal(client_id, clean_session, obter_broker())
+    return mqtt_client.Client(client_id=client_id, clean_session=clean_session, manual_ack=manual_ack)
+
+
+# --- Broker ---
+
+class _No:
+    """Nível da árvore de subscrições (um segmento do filtro)."""
+
+    __slots__ = ("filhos", "assinantes", "grupos")
+
+    def __init__(self):
+        self.filhos: dict[str, _No] = {}
+        self.assinantes: dict[str, int] = {}  # client_id -> QoS
+        self.grupos: dict[str, dict[str, int]] = {}  # grupo compartilhado -> {client_id: QoS}
+
+
+class _Sessao:
+    __slots__ = ("client_id", "persistente", "entregar", "fechar", "subscricoes", "pendentes", "will")
+
+    def __init__(self, client_id, persistente):
+        self.client_id = client_id
+        self.persistente = persistente
+        # entregar(topico, payload, qos, retain); None enquanto desconectada
+        self.entregar = None
+        self.fechar = None
+        self.subscricoes: set[str] = set()
+        self.pendentes = collections.deque(maxlen=MQTT_BROKER_MAX_PENDENTES)
+        self.will = None
+
+
+def _separar_compartilhada(filtro):
+    """'$share/grupo/a/b' -> ('grupo', 'a/b'); filtros comuns -> (None, filtro)."""
+    if filtro.startswith("$share/"):
+        _, grupo, resto = filtro.split("/", 2)
+        return grupo, resto
+    return None, filtro
+
+
+def corresponde(filtro, topico):
+    """Compara um tópico com um filtro MQTT (curingas + e #)."""
+    partes_filtro = filtro.split("/")
+    partes_topico = topico.split("/")
+    if topico.startswith("$") and partes_filtro[0] in ("+", "#"):
+        return False
+    for i, parte in enumerate(partes_filtro):
+        if parte == "#":
+            return True
+        if i >= len(partes_topico) or (parte != "+" and parte != partes_topico[i]):
+            return False
+    return len(partes_filtro) == len(partes_topico)
+
+
+class BrokerLocal:
+    """
+    Roteamento em memória. As subscrições ficam numa árvore por segmento do
+    filtro, então publicar custa o número de níveis do tópico, não o número de
+    subscrições. A entrega é feita fora da trava, pela função `entregar` de
+    cada sessão (fila do ClienteLocal ou conexão TCP do ServidorMqtt).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._raiz = _No()
+        self._sessoes: dict[str, _Sessao] = {}
+        self._retidas: dict[str, tuple[bytes, int]] = {}
+        self._rodizio = itertools.count()
+
+    # --- Sessões ---
+
+    def conectar(self, client_id, clean_session, entregar, fechar=None, will=None):
+        """
+        Registra a conexão de um cliente e devolve se havia sessão anterior. Uma
+        conexão com o mesmo client_id derruba a anterior (sem LWT).
+        """
+        with self._lock:
+            sessao = self._sessoes.get(client_id)
+            anterior_fechar = sessao.fechar if sessao is not None and sessao.entregar is not None else None
+            presente = sessao is not None and not clean_session
+            if sessao is not None and clean_session:
+                self._remover_subscricoes(sessao)
+            if not presente:
+                sessao = self._sessoes[client_id] = _Sessao(client_id, not clean_session)
+            sessao.persistente = not clean_session
+            sessao.entregar = entregar
+            sessao.fechar = fechar
+            sessao.will = will
+            pendentes = list(sessao.pendentes)
+            sessao.pendentes.clear()
+        if anterior_fechar is not None:
+            anterior_fechar()
+        for topico, payload, qos in pendentes:
+            entregar(topico, payload, qos, False)
+        return presente
+
+    def desconectar(self, client_id, entregar, publicar_will):
+        """
+        Fim da conexão. `entregar` identifica a conexão: se ela já foi
+        substituída por outra com o mesmo client_id, nada acontece.
+        """
+        with self._lock:
+            sessao = self._sessoes.get(client_id)
+            if sessao is None or sessao.entregar != entregar:
+                return
+            will = sessao.will if publicar_will else None
+            sessao.entregar = None
+            sessao.fechar = None
+            sessao.will = None
+            if not sessao.persistente:
+                self._remover_subscricoes(sessao)
+                del self._sessoes[client_id]
+        if will is not None:
+            self.publicar(*will)
+
+    def guardar_pendente(self, client_id, topico, payload, qos):
+        """Devolve à sessão uma mensagem QoS 1 que não chegou a ser confirmada."""
+        with self._lock:
+            sessao = self._sessoes.get(client_id)
+            if sessao is not None and sessao.persistente:
+                sessao.pendentes.append((topico, payload, qos))
+
+    # --- Subscrições ---
+
+    def _no(self, filtro, criar):
+        no = self._raiz
+        for parte in filtro.split("/"):
+            proximo = no.filhos.get(parte)
+            if proximo is None:
+                if not criar:
+                    return None
+                proximo = no.filhos[parte] = _No()
+            no = proximo
+        return no
+
+    def subscrever(self, client_id, filtro, qos):
+        grupo, filtro_real = _separar_compartilhada(filtro)
+        with self._lock:
+            sessao = self._sessoes.get(client_id)
+            if sessao is None:
+                return
+            no = self._no(filtro_real, criar=True)
+            if grupo is None:
+                no.assinantes[client_id] = qos
+            else:
+                no.grupos.setdefault(grupo, {})[client_id] = qos
+            sessao.subscricoes.add(filtro)
+            entregar = sessao.entregar
+            retidas = [] if grupo is not None else [
+                (topico, payload, min(qos, qos_retida))
+                for topico, (payload, qos_retida) in self._retidas.items() if corresponde(filtro_real, topico)
+            ]
+        if entregar is not None:
+            for topico, payload, qos_entrega in retidas:
+                entregar(topico, payload, qos_entrega, True)
+
+    def cancelar(self, client_id, filtro):
+        with self._lock:
+            sessao = self._sessoes.get(client_id)
+            if sessao is not None:
+                self._remover(client_id, filtro)
+                sessao.subscricoes.discard(filtro)
+
+    def _remover(self, client_id, filtro):
+        grupo, filtro_real = _separar_compartilhada(filtro)
+        no = self._no(filtro_real, criar=False)
+        if no is None:
+            return
+        if grupo is None:
+            no.assinantes.pop(client_id, None)
+        else:
+            membros = no.grupos.get(grupo, {})
+            membros.pop(client_id, None)
+            if not membros:
+                no.grupos.pop(grupo, None)
+
+    def _remover_subscricoes(self, sessao):
+        for filtro in sessao.subscricoes:
+            self._remover(sessao.client_id, filtro)
+        sessao.subscricoes.clear()
+
+    def _coletar(self, no, partes, i, destinos, grupos):
+        if "#" in no.filhos and not (i == 0 and partes[0].startswith("$")):
+            self._juntar(no.filhos["#"], destinos, grupos)
+        if i == len(partes):
+            self._juntar(no, destinos, grupos)
+            return
+        filho = no.filhos.get(partes[i])
+        if filho is not None:
+            self._coletar(filho, partes, i + 1, destinos, grupos)
+        filho = no.filhos.get("+")
+        if filho is not None and not (i == 0 and partes[0].startswith("$")):
+            self._coletar(filho, partes, i + 1, destinos, grupos)
+
+    @staticmethod
+    def _juntar(no, destinos, grupos):
+        for client_id, qos in no.assinantes.items():
+            # Várias subscrições que casam: uma entrega, com o maior QoS
+            if qos > destinos.get(client_id, -1):
+                destinos[client_id] = qos
+        for grupo, membros in no.grupos.items():
+            grupos.setdefault(grupo, {}).update(membros)
+
+    # --- Publicação ---
+
+    def publicar(self, topico, payload, qos=0, retain=False):
+        payload = b"" if payload is None else payload
+        entregas = []
+        with self._lock:
+            if retain:
+                if payload:
+                    self._retidas[topico] = (payload, qos)
+                else:
+                    self._retidas.pop(topico, None)
+            destinos: dict[str, int] = {}
+            grupos: dict[str, dict[str, int]] = {}
+            self._coletar(self._raiz, topico.split("/"), 0, destinos, grupos)
+            for membros in grupos.values():
+                # Subscrição compartilhada: um membro por mensagem, em rodízio entre os conectados
+                conectados = [c for c in membros if self._sessoes[c].entregar is not None] or list(membros)
+                escolhido = conectados[next(self._rodizio) % len(conectados)]
+                destinos[escolhido] = max(destinos.get(escolhido, -1), membros[escolhido])
+            for client_id, qos_subscricao in destinos.items():
+                sessao = self._sessoes[client_id]
+                qos_entrega = min(qos, qos_subscricao)
+                if sessao.entregar is not None:
+                    entregas.append((sessao.entregar, qos_entrega))
+                elif qos_entrega > 0:
+                    sessao.pendentes.append((topico, payload, qos_entrega))
+        for entregar, qos_entrega in entregas:
+            entregar(topico, payload, qos_entrega, False)
+
+
+_broker: BrokerLocal | None = None
+_broker_lock = threading.Lock()
+
+
+def obter_broker():
+    """Broker embutido do processo (criado no primeiro uso)."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = BrokerLocal()
+        return _broker
+
+
+# --- Cliente em processo ---
+
+class MensagemLocal:
+    __slots__ = ("topic", "payload", "qos", "retain", "mid")
+
+    def __init__(self, topic, payload, qos, retain):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = 0
+
+
+class InfoPublicacao:
+    __slots__ = ("rc", "mid")
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+    def is_published(self):
+        return self.rc == mqtt_client.MQTT_ERR_SUCCESS
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+_PARAR = object()
+
+
+class ClienteLocal:
+    """
+    Cliente do BrokerLocal com a interface do cliente do paho usada pelos
+    serviços (callbacks da API VERSION1). Como no paho, os callbacks rodam na
+    thread do loop (loop_start/loop_forever), nunca na de quem publica.
+    """
+
+    def __init__(self, client_id="", clean_session=True, broker=None, userdata=None):
+        self._client_id = client_id
+        self.clean_session = clean_session
+        self.broker = broker or obter_broker()
+        self._userdata = userdata
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_disconnect = None
+        self._will = None
+        self._conectado = False
+        self._fila: queue.SimpleQueue = queue.SimpleQueue()
+        self._mids = itertools.count(1)
+        self._sem_conexao: list[tuple] = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Configurações do paho sem efeito no transporte em memória
+    def max_inflight_messages_set(self, valor):
+        pass
+
+    def max_queued_messages_set(self, valor):
+        pass
+
+    def ack(self, mid, qos):
+        # Entrega por referência no mesmo processo: não há PUBACK a enviar
+        return mqtt_client.MQTT_ERR_SUCCESS
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self._will = (topic, payload, qos, retain)
+
+    def is_connected(self):
+        return self._conectado
+
+    def _entregar(self, topico, payload, qos, retain):
+        self._fila.put(MensagemLocal(topico, payload, qos, retain))
+
+    def connect(self, host=None, port=None, keepalive=60, *args, **kwargs):
+        presente = self.broker.conectar(self._client_id, self.clean_session, self._entregar, self._substituido, self._will)
+        with self._lock:
+            self._conectado = True
+            pendentes, self._sem_conexao = self._sem_conexao, []
+        self._fila.put(("conectado", {"session present": int(presente)}))
+        for mid, topico, payload, qos, retain in pendentes:
+            self.broker.publicar(topico, payload, qos, retain)
+            self._fila.put(("publicado", mid))
+        return mqtt_client.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect()
+
+    def _substituido(self):
+        self._conectado = False
+        self._fila.put(("desconectado", 7))
+
+    def disconnect(self, *args, **kwargs):
+        if self._conectado:
+            self._conectado = False
+            self.broker.desconectar(self._client_id, self._entregar, publicar_will=False)
+            self._fila.put(("desconectado", 0))
+        return mqtt_client.MQTT_ERR_SUCCESS
+
+    def encerrar_abruptamente(self):
+        """Simula a queda do processo: a conexão some e o LWT é publicado."""
+        if self._conectado:
+            self._conectado = False
+            self.broker.desconectar(self._client_id, self._entregar, publicar_will=True)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        mid = next(self._mids)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self._lock:
+            if not self._conectado:
+                # Como o paho: guarda até conectar
+                self._sem_conexao.append((mid, topic, payload, qos, retain))
+                return InfoPublicacao(mqtt_client.MQTT_ERR_NO_CONN, mid)
+        self.broker.publicar(topic, payload, qos, retain)
+        if self.on_publish is not None:
+            self._fila.put(("publicado", mid))
+        return InfoPublicacao(mqtt_client.MQTT_ERR_SUCCESS, mid)
+
+    def subscribe(self, topic, qos=0, *args, **kwargs):
+        filtros = topic if isinstance(topic, list) else [(topic, qos)]
+        for filtro, qos_filtro in filtros:
+            self.broker.subscrever(self._client_id, filtro, min(qos_filtro, 1))
+        return mqtt_client.MQTT_ERR_SUCCESS, next(self._mids)
+
+    def unsubscribe(self, topic, *args, **kwargs):
+        for filtro in topic if isinstance(topic, list) else [topic]:
+            self.broker.cancelar(self._client_id, filtro)
+        return mqtt_client.MQTT_ERR_SUCCESS, next(self._mids)
+
+    # --- Loop ---
+
+    def _despachar(self, item):
+        if isinstance(item, MensagemLocal):
+            if self.on_message is not None:
+                self.on_message(self, self._userdata, item)
+            return
+        tipo, valor = item
+        if tipo == "conectado" and self.on_connect is not None:
+            self.on_connect(self, self._userdata, valor, 0)
+        elif tipo == "publicado" and self.on_publish is not None:
+            self.on_publish(self, self._userdata, valor)
+        elif tipo == "desconectado" and self.on_disconnect is not None:
+            self.on_disconnect(self, self._userdata, valor)
+
+    def loop_forever(self, *args, **kwargs):
+        while True:
+            item = self._fila.get()
+            if item is _PARAR:
+                return mqtt_client.MQTT_ERR_SUCCESS
+            try:
+                self._despachar(item)
+            except Exception:
+                log.exception("Erro num callback do cliente '%s'", self._client_id)
+
+    def loop_start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.loop_forever, name=f"mqtt-local-{self._client_id}", daemon=True)
+            self._thread.start()
+        return mqtt_client.MQTT_ERR_SUCCESS
+
+    def loop_stop(self, *args, **kwargs):
+        self._fila.put(_PARAR)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        return mqtt_client.MQTT_ERR_SUCCESS
+
+
+# --- Servidor MQTT (TCP) ---
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def _tamanho_restante(tamanho):
+    codificado = bytearray()
+    while True:
+        byte = tamanho % 128
+        tamanho //= 128
+        codificado.append(byte | 0x80 if tamanho else byte)
+        if not tamanho:
+            return bytes(codificado)
+
+
+def _texto(dados, posicao):
+    (tamanho,) = struct.unpack_from(">H", dados, posicao)
+    inicio = posicao + 2
+    return dados[inicio:inicio + tamanho], inicio + tamanho
+
+
+def _pacote_publish(topico, payload, qos, retain, packet_id):
+    topico_bytes = topico.encode()
+    corpo = struct.pack(">H", len(topico_bytes)) + topico_bytes
+    if qos:
+        corpo += struct.pack(">H", packet_id)
+    corpo += payload
+    return bytes([PUBLISH << 4 | qos << 1 | int(retain)]) + _tamanho_restante(len(corpo)) + corpo
+
+
+class _ConexaoMqtt:
+    """Uma conexão TCP de um cliente remoto, atendida no loop do ServidorMqtt."""
+
+    def __init__(self, servidor, leitor, escritor):
+        self.servidor = servidor
+        self.broker = servidor.broker
+        self.loop = servidor.loop
+        self.leitor = leitor
+        self.escritor = escritor
+        self.client_id = None
+        self.ids = itertools.cycle(range(1, 65536))
+        # Entregas QoS 1 aguardando PUBACK: packet id -> (tópico, payload)
+        self.em_voo: dict[int, tuple[str, bytes]] = {}
+        self.encerrada = False
+
+    def entregar(self, topico, payload, qos, retain):
+        # Chamado de qualquer thread; a escrita acontece no loop do servidor
+        self.loop.call_soon_threadsafe(self._enviar_publish, topico, payload, qos, retain)
+
+    def _enviar_publish(self, topico, payload, qos, retain):
+        if self.encerrada:
+            if qos:
+                self.broker.guardar_pendente(self.client_id, topico, payload, qos)
+            return
+        packet_id = 0
+        if qos:
+            packet_id = next(self.ids)
+            self.em_voo[packet_id] = (topico, payload)
+        self.escritor.write(_pacote_publish(topico, bytes(payload), qos, retain, packet_id))
+
+    def fechar(self):
+        self.loop.call_soon_threadsafe(self.escritor.close)
+
+    async def _ler_pacote(self, timeout):
+        primeiro = await asyncio.wait_for(self.leitor.readexactly(1), timeout)
+        tamanho, multiplicador = 0, 1
+        while True:
+            byte = (await self.leitor.readexactly(1))[0]
+            tamanho += (byte & 0x7F) * multiplicador
+            if not byte & 0x80:
+                break
+            multiplicador *= 128
+            if multiplicador > 128 ** 3:
+                raise ValueError("tamanho restante inválido")
+        corpo = await self.leitor.readexactly(tamanho) if tamanho else b""
+        return primeiro[0] >> 4, primeiro[0] & 0x0F, corpo
+
+    async def atender(self):
+        publicar_will = True
+        try:
+            tipo, _, corpo = await self._ler_pacote(10)
+            if tipo != CONNECT:
+                return
+            keepalive = self._conectar(corpo)
+            # Sem pacotes por 1,5x o keepalive, o cliente é dado como perdido (LWT)
+            timeout = keepalive * 1.5 if keepalive else None
+            while True:
+                tipo, flags, corpo = await self._ler_pacote(timeout)
+                if tipo == DISCONNECT:
+                    publicar_will = False
+                    return
+                self._tratar(tipo, flags, corpo)
+                await self.escritor.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            self.encerrada = True
+            if self.client_id is not None:
+                self.broker.desconectar(self.client_id, self.entregar, publicar_will)
+                for topico, payload in self.em_voo.values():
+                    self.broker.guardar_pendente(self.client_id, topico, payload, 1)
+            self.escritor.close()
+
+    def _conectar(self, corpo):
+        _, posicao = _texto(corpo, 0)  # nome do protocolo
+        nivel, flags, keepalive = struct.unpack_from(">BBH", corpo, posicao)
+        posicao += 4
+        client_id, posicao = _texto(corpo, posicao)
+        self.client_id = client_id.decode() or f"anonimo-{id(self)}"
+        will = None
+        if flags & 0x04:
+            will_topico, posicao = _texto(corpo, posicao)
+            will_payload, posicao = _texto(corpo, posicao)
+            will = (will_topico.decode(), bytes(will_payload), (flags >> 3) & 0x03, bool(flags & 0x20))
+        clean_session = bool(flags & 0x02)
+        presente = self.broker.conectar(self.client_id, clean_session, self.entregar, self.fechar, will)
+        self.escritor.write(bytes([CONNACK << 4, 2, int(presente), 0]))
+        return keepalive
+
+    def _tratar(self, tipo, flags, corpo):
+        if tipo == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topico, posicao = _texto(corpo, 0)
+            packet_id = None
+            if qos:
+                (packet_id,) = struct.unpack_from(">H", corpo, posicao)
+                posicao += 2
+            self.broker.publicar(topico.decode(), corpo[posicao:], min(qos, 1), bool(flags & 0x01))
+            if qos == 1:
+                self.escritor.write(bytes([PUBACK << 4, 2]) + struct.pack(">H", packet_id))
+            elif qos == 2:
+                self.escritor.write(bytes([PUBREC << 4, 2]) + struct.pack(">H", packet_id))
+        elif tipo == PUBREL:
+            self.escritor.write(bytes([PUBCOMP << 4, 2]) + corpo[:2])
+        elif tipo == PUBACK:
+            (packet_id,) = struct.unpack_from(">H", corpo, 0)
+            self.em_voo.pop(packet_id, None)
+        elif tipo == SUBSCRIBE:
+            (packet_id,) = struct.unpack_from(">H", corpo, 0)
+            posicao, filtros = 2, []
+            while posicao < len(corpo):
+                filtro, posicao = _texto(corpo, posicao)
+                filtros.append((filtro.decode(), min(corpo[posicao], 1)))
+                posicao += 1
+            # O SUBACK sai antes das mensagens retidas
+            self.escritor.write(bytes([SUBACK << 4]) + _tamanho_restante(2 + len(filtros)) + struct.pack(">H", packet_id) + bytes(q for _, q in filtros))
+            for filtro, qos in filtros:
+                self.broker.subscrever(self.client_id, filtro, qos)
+        elif tipo == UNSUBSCRIBE:
+            (packet_id,) = struct.unpack_from(">H", corpo, 0)
+            posicao = 2
+            while posicao < len(corpo):
+                filtro, posicao = _texto(corpo, posicao)
+                self.broker.cancelar(self.client_id, filtro.decode())
+            self.escritor.write(bytes([UNSUBACK << 4, 2]) + struct.pack(">H", packet_id))
+        elif tipo == PINGREQ:
+            self.escritor.write(bytes([PINGRESP << 4, 0]))
+
+
+class ServidorMqtt:
+    """
+    Expõe um BrokerLocal em TCP (MQTT 3.1.1) numa thread própria, para os
+    processos que usam o paho (carregadores, billing) num nó sem Mosquitto.
+    """
+
+    def __init__(self, broker=None, host="0.0.0.0", porta=1883):
+        self.broker = broker or obter_broker()
+        self.host = host
+        self.porta = porta
+        self.loop = None
+        self._servidor = None
+        self._pronto = threading.Event()
+        self._erro = None
+        self._thread = None
+
+    def iniciar(self):
+        """Sobe o servidor; repassa o erro se a porta não pôde ser aberta (ex.: já em uso)."""
+        self._thread = threading.Thread(target=self._executar, name="servidor-mqtt", daemon=True)
+        self._thread.start()
+        self._pronto.wait()
+        if self._erro is not None:
+            self._thread.join()
+            raise self._erro
+        log.info("Broker MQTT embutido ouvindo em %s:%d", self.host, self.porta)
+
+    def _executar(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def atender(leitor, escritor):
+            await _ConexaoMqtt(self, leitor, escritor).atender()
+
+        try:
+            self._servidor = loop.run_until_complete(asyncio.start_server(atender, self.host, self.porta))
+        except Exception as e:
+            self._erro = e
+            loop.close()
+            self._pronto.set()
+            return
+        # Porta 0: o sistema escolhe uma livre
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+        self.loop = loop
+        self._pronto.set()
+        loop.run_forever()
+        # Parada: fecha o socket de escuta e encerra as conexões abertas
+        self._servidor.close()
+        tarefas = asyncio.all_tasks(loop)
+        for tarefa in tarefas:
+            tarefa.cancel()
+        loop.run_until_complete(asyncio.gather(*tarefas, return_exceptions=True))
+        loop.close()
+
+    def parar(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop = None
+
+
+def iniciar_broker_embutido(porta=MQTT_BROKER_EMBUTIDO_PORTA):
+    """
+    Sobe o broker embutido em TCP, se a porta foi configurada, e passa este
+    processo para o transporte local. Devolve o servidor (ou None).
+    """
+    global MQTT_TRANSPORTE
+    if not porta:
+        return None
+    servidor = ServidorMqtt(obter_broker(), porta=int(porta))
+    servidor.iniciar()
+    MQTT_TRANSPORTE = "local"
+    return servidor
@@ -0,0 +1,47 @@
+# Microbenchmark dos codecs de payload (backend/codec.py): tamanho da mensagem
+# e tempo de codificação/decodificação para os payloads de evento, status e
+# transação. Uso: python benchmarks/bench_codec.py [ITERACOES]
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from codec import JsonCodec, MsgpackCodec, msgpack
+
+PAYLOADS = {
+    "evento": {"carregador": "CP00042", "carro": "Carro_512", "acao": "fim_carga", "timestamp": 183745, "energia_consumida_kWh": 23.71},
+    "status": {"carregador": "CP00042", "status": "ocupado", "carro_conectado": "Carro_512", "energia_consumida_kWh": 12.4, "timestamp": 183740},
+    "transacao": {"carro": "Carro_512", "carregador": "CP00042", "energia_total_kWh": 23.71, "custo_total_brl": 17.78, "timestamp_transacao": 183750},
+}
+
+
+def medir(codec, payload, iteracoes):
+    dados = codec.codificar(payload)
+    assert codec.decodificar(dados) == payload
+    codificar = timeit.timeit(lambda: codec.codificar(payload), number=iteracoes)
+    decodificar = timeit.timeit(lambda: codec.decodificar(dados), number=iteracoes)
+    return {
+        "bytes": len(dados),
+        "codificar_us": round(codificar / iteracoes * 1e6, 3),
+        "decodificar_us": round(decodificar / iteracoes * 1e6, 3),
+    }
+
+
+def main():
+    iteracoes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    codecs = [JsonCodec()]
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+    else:
+        print("[Bench] Pacote 'msgpack' não instalado; medindo apenas JSON.", file=sys.stderr)
+
+    resultado = {"benchmark": "codec", "iteracoes": iteracoes, "resultados": {}}
+    for nome, payload in PAYLOADS.items():
+        resultado["resultados"][nome] = {codec.nome: medir(codec, payload, iteracoes) for codec in codecs}
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+# Benchmark de ponta a ponta do pipeline MQTT. Carregadores sintéticos (a
+# própria classe Carregador, com os mesmos formatos de evento e status)
+# publicam num Mosquitto local e são medidos:
+#
+#   billing         eventos fim_carga/s sustentados pelo BillingService (em
+#                   processo; grava no Postgres de DATABASE_URL ou, com
+#                   --sem-banco, num gravador em memória; com --broker-local,
+#                   sem Mosquitto: tudo passa pelo broker embutido em memória)
+#   websocket       latência carregador -> WebSocket (p50/p90/p99) através de
+#                   uma API já em execução (uvicorn api.main:app)
+#   estado-inicial  latência de /api/estado-inicial com N dashboards
+#   memoria         memória por carregador (tracemalloc)
+#   estado-api      memória e serialização do estado dos carregadores na API:
+#                   dict de payloads (antes) x TabelaCarregadores (depois)
+#
+# O resultado sai em JSON (stdout ou --saida) para comparar versões.
+# Uso: python benchmarks/bench_pipeline.py [billing|websocket|estado-inicial|memoria|estado-api|todos] [opções]
+# ATENÇÃO: o modo billing grava transações reais; use um banco de teste.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import transporte
+from carregador import Carregador
+from codec import decodificar
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+TOKEN_API = os.getenv("TOKEN_API")
+
+
+def percentis(amostras_s):
+    """p50/p90/p99/máximo em ms (rank mais próximo)."""
+    if not amostras_s:
+        return {"amostras": 0}
+    ordenadas = sorted(amostras_s)
+
+    def p(fracao):
+        return round(ordenadas[min(len(ordenadas) - 1, int(fracao * len(ordenadas)))] * 1000, 3)
+
+    return {
+        "amostras": len(ordenadas),
+        "p50_ms": p(0.50),
+        "p90_ms": p(0.90),
+        "p99_ms": p(0.99),
+        "max_ms": round(ordenadas[-1] * 1000, 3),
+    }
+
+
+class PublicadorMedido:
+    """Publica com QoS 1 direto no paho e guarda o instante de envio de cada evento."""
+
+    def __init__(self, client):
+        self.client = client
+        self.enviados = {}
+
+    def publicar(self, topico, payload, timestamp):
+        self.enviados[(topico, timestamp)] = time.perf_counter()
+        self.client.publish(topico, payload, qos=1)
+
+
+class ClienteNulo:
+    """Cliente MQTT que descarta tudo; usado só para medir memória."""
+
+    def publish(self, *args, **kwargs):
+        return None
+
+
+class GeradorCarga:
+    """
+    N carregadores sintéticos num único cliente MQTT. Cada sessão gera
+    inicio_carga, fim_carga e os status correspondentes, como um carregador real.
+    """
+
+    def __init__(self, prefixo, quantidade):
+        self.client = transporte.criar_cliente(f"bench-{prefixo}-{os.getpid()}")
+        self.client.max_inflight_messages_set(1000)
+        self.publicador = PublicadorMedido(self.client)
+        self.carregadores = [
+            Carregador(f"{prefixo}{i:05d}", client=self.client, verbose=False, publicador=self.publicador)
+            for i in range(quantidade)
+        ]
+
+    def conectar(self):
+        self.client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
+        self.client.loop_start()
+
+    def desconectar(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def sessoes(self, por_carregador, taxa=None):
+        """Publica as sessões intercalando os carregadores; `taxa` limita sessões/s."""
+        intervalo = 1 / taxa if taxa else 0
+        proxima = time.perf_counter()
+        for n in range(por_carregador):
+            for carregador in self.carregadores:
+                carregador.conectar_carro(f"Carro_{n % 900 + 100}")
+                carregador.simular_carregamento()
+                carregador.finalizar_carregamento()
+                if intervalo:
+                    proxima += intervalo
+                    espera = proxima - time.perf_counter()
+                    if espera > 0:
+                        time.sleep(espera)
+
+
+class GravadorMemoria:
+    """Substitui o GravadorTransacoes quando não há Postgres: 'grava' na hora."""
+
+    def __init__(self, ao_gravar):
+        self.ao_gravar = ao_gravar
+        self.fila = queue.Queue()
+
+    def enviar(self, transacao, confirmar=None):
+        self.ao_gravar([transacao])
+        if confirmar is not None:
+            confirmar()
+
+    def iniciar_desligamento(self):
+        pass
+
+    def fechar(self):
+        pass
+
+
+def bench_billing(args):
+    import billing
+    from gravador_transacoes import GravadorTransacoes
+
+    esperadas = args.carregadores * args.sessoes
+    servico = billing.BillingService()
+    if args.sem_banco or not billing.DATABASE_URL:
+        servico.gravador = GravadorMemoria(servico._transacoes_gravadas)
+        gravador = "memoria"
+    else:
+        servico.gravador = GravadorTransacoes(billing.DATABASE_URL, ao_gravar=servico._transacoes_gravadas)
+        gravador = "postgres"
+        servico.tarifas.carregar()
+    servico.publicacao.iniciar()
+    servico.pipeline.iniciar()
+
+    # As transações publicadas pelo billing marcam o fim do processamento de cada evento
+    recebidas = []
+    todas = threading.Event()
+    observador = transporte.criar_cliente(f"bench-observador-{os.getpid()}")
+
+    def on_message(client, userdata, msg):
+        transacao = decodificar(msg.payload)
+        if str(transacao.get("carregador", "")).startswith(args.prefixo):
+            recebidas.append(time.perf_counter())
+            if len(recebidas) >= esperadas:
+                todas.set()
+
+    observador.on_message = on_message
+    observador.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
+    observador.subscribe(servico.topic_transacoes, qos=1)
+    observador.loop_start()
+    servico.client.connect(MQTT_BROKER_HOST, MQTT_PORT, 60)
+    servico.client.loop_start()
+
+    gerador = GeradorCarga(args.prefixo, args.carregadores)
+    gerador.conectar()
+    time.sleep(1)  # subscrições estabelecidas
+
+    inicio = time.perf_counter()
+    gerador.sessoes(args.sessoes, args.taxa)
+    fim_publicacao = time.perf_counter()
+    concluido = todas.wait(args.timeout)
+    fim = recebidas[-1] if recebidas else time.perf_counter()
+    estagios = servico.estatisticas()["estagios"]
+
+    gerador.desconectar()
+    servico._desligar()
+    observador.disconnect()
+    observador.loop_stop()
+
+    duracao = fim - inicio
+    return {
+        "gravador": gravador,
+        "carregadores": args.carregadores,
+        "sessoes_por_carregador": args.sessoes,
+        "transacoes_esperadas": esperadas,
+        "transacoes_recebidas": len(recebidas),
+        "concluido": concluido,
+        "publicacao_eventos_por_s": round(2 * esperadas / (fim_publicacao - inicio), 1),
+        "billing_fim_carga_por_s": round(len(recebidas) / duracao, 1) if duracao > 0 else None,
+        "duracao_s": round(duracao, 3),
+        "estagios": estagios,
+    }
+
+
+async def _dashboard(ws, latencias, enviados, parar):
+    while not parar.is_set():
+        try:
+            texto = await asyncio.wait_for(ws.recv(), timeout=0.5)
+        except asyncio.TimeoutError:
+            continue
+        agora = time.perf_counter()
+        mensagem = json.loads(texto)
+        itens = mensagem.get("mensagens", []) if mensagem.get("topic") == "lote" else [mensagem]
+        for item in itens:
+            payload = item.get("payload") or {}
+            enviado = enviados.get((item.get("topic"), payload.get("timestamp")))
+            if enviado is not None:
+                latencias.append(agora - enviado)
+
+
+async def _bench_websocket(args):
+    import websockets
+
+    url_ws = args.api.replace("http", "ws", 1).rstrip("/") + f"/ws?token={TOKEN_API or ''}"
+    gerador = GeradorCarga(args.prefixo, args.carregadores)
+    latencias = []
+    parar = asyncio.Event()
+    conexoes = [await websockets.connect(url_ws, max_size=None) for _ in range(args.dashboards)]
+    tarefas = [asyncio.create_task(_dashboard(ws, latencias, gerador.publicador.enviados, parar)) for ws in conexoes]
+
+    gerador.conectar()
+    inicio = time.perf_counter()
+    await asyncio.to_thread(gerador.sessoes, args.sessoes, args.taxa)
+    eventos = len(gerador.publicador.enviados)
+    esperadas = eventos * args.dashboards
+    limite = time.perf_counter() + args.timeout
+    while len(latencias) < esperadas and time.perf_counter() < limite:
+        await asyncio.sleep(0.1)
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+    for ws in conexoes:
+        await ws.close()
+    gerador.desconectar()
+
+    return {
+        "dashboards": args.dashboards,
+        "eventos_publicados": eventos,
+        "entregas_esperadas": esperadas,
+        "entregas_recebidas": len(latencias),
+        "duracao_s": round(duracao, 3),
+        "latencia": percentis(latencias),
+    }
+
+
+def bench_websocket(args):
+    return asyncio.run(_bench_websocket(args))
+
+
+def bench_estado_inicial(args):
+    url = args.api.rstrip("/") + "/api/estado-inicial"
+    cabecalhos = {"Authorization": TOKEN_API or "", "Accept-Encoding": args.encoding}
+    latencias = []
+    tamanhos = []
+    erros = []
+    lock = threading.Lock()
+
+    def dashboard():
+        for _ in range(args.requisicoes):
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=cabecalhos), timeout=30) as resposta:
+                    corpo = resposta.read()
+            except OSError as e:
+                with lock:
+                    erros.append(repr(e))
+                continue
+            with lock:
+                latencias.append(time.perf_counter() - inicio)
+                tamanhos.append(len(corpo))
+
+    threads = [threading.Thread(target=dashboard) for _ in range(args.dashboards)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    return {
+        "dashboards": args.dashboards,
+        "requisicoes_por_dashboard": args.requisicoes,
+        "accept_encoding": args.encoding,
+        "requisicoes_por_s": round(len(latencias) / duracao, 1) if duracao > 0 else None,
+        "bytes_resposta": max(tamanhos) if tamanhos else 0,
+        "erros": len(erros),
+        "latencia": percentis(latencias),
+    }
+
+
+def bench_memoria(args):
+    cliente = ClienteNulo()
+    publicador = PublicadorMedido(cliente)
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    carregadores = [Carregador(f"{args.prefixo}{i:05d}", client=cliente, verbose=False, publicador=publicador) for i in range(args.carregadores)]
+    livres = tracemalloc.take_snapshot()
+    for i, carregador in enumerate(carregadores):
+        carregador.conectar_carro(f"Carro_{i % 900 + 100}")
+    publicador.enviados.clear()
+    ocupados = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    def diferenca(a, b):
+        return sum(estatistica.size_diff for estatistica in b.compare_to(a, "filename"))
+
+    return {
+        "carregadores": args.carregadores,
+        "bytes_por_carregador_livre": round(diferenca(antes, livres) / args.carregadores, 1),
+        "bytes_por_carregador_em_sessao": round(diferenca(antes, ocupados) / args.carregadores, 1),
+    }
+
+
+def bench_estado_api(args):
+    from api.estado_carregadores import TabelaCarregadores
+
+    def payloads():
+        # Status como chegam do broker: cada payload decodificado é um dict novo
+        for i in range(args.carregadores):
+            ocupado = i % 2 == 0
+            yield f"{args.prefixo}{i:05d}", decodificar(json.dumps({
+                "carregador": f"{args.prefixo}{i:05d}",
+                "status": "ocupado" if ocupado else "livre",
+                "carro_conectado": f"Carro_{i % 900 + 100}" if ocupado else None,
+                "energia_consumida_kWh": round(i % 500 * 0.37, 2),
+                "timestamp": 1000 + i,
+            }).encode())
+
+    resultado = {"carregadores": args.carregadores}
+    for nome, criar, serializar in (
+        ("dict", dict, lambda estado: json.dumps(estado)),
+        ("tabela", TabelaCarregadores, lambda estado: estado.json()),
+    ):
+        tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+        estado = criar()
+        for carregador_id, payload in payloads():
+            estado[carregador_id] = payload
+        depois = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        inicio = time.perf_counter()
+        texto = serializar(estado)
+        serializacao = time.perf_counter() - inicio
+        resultado[nome] = {
+            "bytes_por_carregador": round(sum(e.size_diff for e in depois.compare_to(antes, "filename")) / args.carregadores, 1),
+            "serializacao_ms": round(serializacao * 1000, 2),
+            "json_bytes": len(texto),
+        }
+        del estado
+    return resultado
+
+
+BENCHMARKS = {
+    "billing": bench_billing,
+    "websocket": bench_websocket,
+    "estado-inicial": bench_estado_inicial,
+    "memoria": bench_memoria,
+    "estado-api": bench_estado_api,
+}
+
+
+def commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do pipeline MQTT")
+    parser.add_argument("benchmark", choices=[*BENCHMARKS, "todos"], nargs="?", default="todos")
+    parser.add_argument("--carregadores", type=int, default=100)
+    parser.add_argument("--sessoes", type=int, default=10, help="sessões de carga por carregador")
+    parser.add_argument("--taxa", type=float, default=None, help="limite de sessões/s (padrão: sem limite)")
+    parser.add_argument("--dashboards", type=int, default=10)
+    parser.add_argument("--requisicoes", type=int, default=50, help="requisições por dashboard em estado-inicial")
+    parser.add_argument("--encoding", default="gzip", help="Accept-Encoding em estado-inicial")
+    parser.add_argument("--api", default=os.getenv("BENCH_API_URL", "http://localhost:8000"))
+    parser.add_argument("--prefixo", default="BENCH")
+    parser.add_argument("--sem-banco", action="store_true", help="billing sem Postgres (gravador em memória)")
+    parser.add_argument("--broker-local", action="store_true", help="billing pelo broker embutido (backend/transporte.py), sem Mosquitto")
+    parser.add_argument("--timeout", type=float, default=60, help="espera máxima pelas entregas (s)")
+    parser.add_argument("--saida", help="arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    nomes = list(BENCHMARKS) if args.benchmark == "todos" else [args.benchmark]
+    if args.broker_local:
+        transporte.MQTT_TRANSPORTE = "local"
+    resultado = {
+        "benchmark": "pipeline",
+        "executado_em": datetime.now(timezone.utc).isoformat(),
+        "commit": commit_atual(),
+        "python": platform.python_version(),
+        "broker": "local" if args.broker_local else f"{MQTT_BROKER_HOST}:{MQTT_PORT}",
+        "resultados": {},
+    }
+    for nome in nomes:
+        print(f"[Bench] Executando '{nome}'...", file=sys.stderr)
+        try:
+            # Os logs dos serviços vão para stderr; o stdout fica só com o JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                resultado["resultados"][nome] = BENCHMARKS[nome](args)
+        except Exception as e:
+            # Broker/API/banco fora do ar ou dependência ausente: registra e segue
+            resultado["resultados"][nome] = {"erro": repr(e)}
+
+    texto = json.dumps(resultado, indent=2)
+    if args.saida:
+        with open(args.saida, "w") as arquivo:
+            arquivo.write(texto)
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS transacoes (
+    id SERIAL PRIMARY KEY,
+    carro_id VARCHAR(255) NOT NULL,
+    carregador_id VARCHAR(255) NOT NULL,
+    energia_total_kWh NUMERIC(10, 2) NOT NULL,
+    custo_total_brl NUMERIC(10, 2) NOT NULL,
+    timestamp_transacao BIGINT NOT NULL,
+    registrado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
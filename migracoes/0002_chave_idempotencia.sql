@@ -0,0 +1,6 @@
+-- Chave de idempotência: carregador + sessão de carga. Vários workers de
+-- billing (ou a reentrega de um fim_carga) nunca geram cobrança duplicada.
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR(255);
+
+CREATE UNIQUE INDEX IF NOT EXISTS transacoes_chave_idempotencia_idx
+    ON transacoes (chave_idempotencia);
@@ -0,0 +1,75 @@
+-- Índices das consultas de transações por carregador/carro (paginadas por id,
+-- que cresce junto com registrado_em). registrado_em só cresce, então um BRIN
+-- cobre varreduras por período com custo mínimo de escrita.
+CREATE INDEX IF NOT EXISTS transacoes_carregador_id_idx
+    ON transacoes (carregador_id, id DESC);
+CREATE INDEX IF NOT EXISTS transacoes_carro_id_idx
+    ON transacoes (carro_id, id DESC);
+CREATE INDEX IF NOT EXISTS transacoes_registrado_brin_idx
+    ON transacoes USING BRIN (registrado_em);
+
+-- Agregados mantidos incrementalmente a cada INSERT em transacoes: receita e
+-- energia por carregador por hora e por carro por dia. O gatilho é por comando
+-- e usa a tabela de transição, então um lote de N transações gera um único
+-- UPSERT agregado. Transações ignoradas por idempotência (ON CONFLICT DO
+-- NOTHING) não aparecem na tabela de transição.
+CREATE TABLE IF NOT EXISTS rollup_carregador_hora (
+    hora TIMESTAMP WITH TIME ZONE NOT NULL,
+    carregador_id VARCHAR(255) NOT NULL,
+    sessoes BIGINT NOT NULL,
+    energia_kwh NUMERIC(18, 2) NOT NULL,
+    receita_brl NUMERIC(18, 2) NOT NULL,
+    PRIMARY KEY (carregador_id, hora)
+);
+CREATE INDEX IF NOT EXISTS rollup_carregador_hora_hora_idx ON rollup_carregador_hora (hora);
+
+CREATE TABLE IF NOT EXISTS rollup_carro_dia (
+    dia DATE NOT NULL,
+    carro_id VARCHAR(255) NOT NULL,
+    sessoes BIGINT NOT NULL,
+    energia_kwh NUMERIC(18, 2) NOT NULL,
+    custo_brl NUMERIC(18, 2) NOT NULL,
+    PRIMARY KEY (carro_id, dia)
+);
+CREATE INDEX IF NOT EXISTS rollup_carro_dia_dia_idx ON rollup_carro_dia (dia);
+
+CREATE OR REPLACE FUNCTION atualizar_rollups_transacoes() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO rollup_carregador_hora AS r (hora, carregador_id, sessoes, energia_kwh, receita_brl)
+    SELECT date_trunc('hour', registrado_em), carregador_id, count(*), sum(energia_total_kwh), sum(custo_total_brl)
+    FROM novas GROUP BY 1, 2 ORDER BY 2, 1  -- ordem fixa evita deadlock entre workers
+    ON CONFLICT (carregador_id, hora) DO UPDATE SET
+        sessoes = r.sessoes + EXCLUDED.sessoes,
+        energia_kwh = r.energia_kwh + EXCLUDED.energia_kwh,
+        receita_brl = r.receita_brl + EXCLUDED.receita_brl;
+
+    INSERT INTO rollup_carro_dia AS r (dia, carro_id, sessoes, energia_kwh, custo_brl)
+    SELECT (registrado_em AT TIME ZONE 'UTC')::date, carro_id, count(*), sum(energia_total_kwh), sum(custo_total_brl)
+    FROM novas GROUP BY 1, 2 ORDER BY 2, 1
+    ON CONFLICT (carro_id, dia) DO UPDATE SET
+        sessoes = r.sessoes + EXCLUDED.sessoes,
+        energia_kwh = r.energia_kwh + EXCLUDED.energia_kwh,
+        custo_brl = r.custo_brl + EXCLUDED.custo_brl;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transacoes_rollups ON transacoes;
+CREATE TRIGGER transacoes_rollups
+    AFTER INSERT ON transacoes
+    REFERENCING NEW TABLE AS novas
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_rollups_transacoes();
+
+-- Preenche os agregados a partir do histórico. Bancos criados pelo antigo
+-- init_db.py já têm os agregados populados e não são somados de novo.
+INSERT INTO rollup_carregador_hora (hora, carregador_id, sessoes, energia_kwh, receita_brl)
+SELECT date_trunc('hour', registrado_em), carregador_id, count(*), sum(energia_total_kwh), sum(custo_total_brl)
+FROM transacoes
+WHERE NOT EXISTS (SELECT 1 FROM rollup_carregador_hora)
+GROUP BY 1, 2;
+
+INSERT INTO rollup_carro_dia (dia, carro_id, sessoes, energia_kwh, custo_brl)
+SELECT (registrado_em AT TIME ZONE 'UTC')::date, carro_id, count(*), sum(energia_total_kwh), sum(custo_total_brl)
+FROM transacoes
+WHERE NOT EXISTS (SELECT 1 FROM rollup_carro_dia)
+GROUP BY 1, 2;
@@ -0,0 +1,11 @@
+-- Conciliação de cada cobrança com as leituras do medidor da sessão:
+-- última energia lida, leituras recebidas pelo billing e as informadas pelo
+-- carregador no fim_carga, e o tipo de divergência encontrada (se houver).
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS energia_medida_kwh NUMERIC(10, 2);
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS leituras_recebidas INTEGER;
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS leituras_esperadas INTEGER;
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS divergencia VARCHAR(64);
+
+-- Só as transações divergentes entram no índice da auditoria
+CREATE INDEX IF NOT EXISTS transacoes_divergencia_idx
+    ON transacoes (id DESC) WHERE divergencia IS NOT NULL;
@@ -0,0 +1,37 @@
+-- Tarifas de energia. Cada tarifa tem um preço base e janelas por dia da
+-- semana (0 = segunda ... 6 = domingo) e horário local, no fuso da tarifa,
+-- com preço próprio. Uma janela com fim <= início atravessa a meia-noite
+-- (fim '00:00' = até a meia-noite). Janelas sobrepostas: vale a de maior
+-- prioridade.
+CREATE TABLE IF NOT EXISTS tarifas (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(255) NOT NULL UNIQUE,
+    preco_kwh NUMERIC(10, 4) NOT NULL,
+    fuso VARCHAR(64) NOT NULL DEFAULT 'America/Sao_Paulo'
+);
+
+CREATE TABLE IF NOT EXISTS tarifas_janelas (
+    id SERIAL PRIMARY KEY,
+    tarifa_id INTEGER NOT NULL REFERENCES tarifas (id) ON DELETE CASCADE,
+    dias_semana SMALLINT[] NOT NULL DEFAULT '{0,1,2,3,4,5,6}',
+    inicio TIME NOT NULL,
+    fim TIME NOT NULL,
+    preco_kwh NUMERIC(10, 4) NOT NULL,
+    prioridade INTEGER NOT NULL DEFAULT 0
+);
+
+-- Tarifa de cada carregador ('carregador', alvo = ID) ou local ('local', alvo =
+-- prefixo dos IDs dos carregadores do local; vale o prefixo mais longo). Sem
+-- atribuição, vale a tarifa 'padrao'.
+CREATE TABLE IF NOT EXISTS tarifas_atribuicoes (
+    tipo VARCHAR(16) NOT NULL CHECK (tipo IN ('carregador', 'local')),
+    alvo VARCHAR(255) NOT NULL,
+    tarifa_id INTEGER NOT NULL REFERENCES tarifas (id) ON DELETE CASCADE,
+    PRIMARY KEY (tipo, alvo)
+);
+
+-- O preço fixo usado até aqui
+INSERT INTO tarifas (nome, preco_kwh) VALUES ('padrao', 0.75) ON CONFLICT (nome) DO NOTHING;
+
+-- Tarifa aplicada em cada cobrança
+ALTER TABLE transacoes ADD COLUMN IF NOT EXISTS tarifa VARCHAR(255);
@@ -0,0 +1,12 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from backend import metricas, registro  # noqa: E402
+
+# Os serviços do backend importam `metricas` e `registro` pelo nome (rodam de
+# dentro de backend/) e a API como `backend.metricas`. Nos testes os dois
+# convivem no mesmo processo: o mesmo módulo atende aos dois nomes, senão as
+# métricas seriam registradas duas vezes no prometheus_client.
+sys.modules.setdefault("metricas", metricas)
+sys.modules.setdefault("registro", registro)
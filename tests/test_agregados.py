@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.agregados import TOPICO_RESUMO, AgregadosFrota  # noqa: E402
+
+# Meia-noite UTC
+MEIA_NOITE = 20000 * 86400
+
+
+@pytest.fixture
+def agregados():
+    return AgregadosFrota(fuso="UTC")
+
+
+def test_contagem_por_status_e_por_local(agregados):
+    agregados.registrar_status({"carregador": "SP01-CP1", "status": "livre"}, 0)
+    agregados.registrar_status({"carregador": "SP01-CP2", "status": "ocupado"}, 0)
+    agregados.registrar_status({"carregador": "RJ01-CP1", "status": "livre"}, 0)
+    agregados.registrar_status({"carregador": "CP9", "status": "offline"}, 0)
+    agregados.registrar_status({"carregador": "SP01-CP1", "status": "ocupado"}, 1)
+    agregados.registrar_status({"carregador": "SP01-CP1", "status": "desconhecido"}, 2)
+
+    resumo = agregados.resumo(2)
+    assert resumo["carregadores"] == {"livre": 1, "ocupado": 2, "offline": 1, "total": 4}
+    assert resumo["locais"]["SP01"] == {"livre": 0, "ocupado": 2, "offline": 0, "potencia_kW": 0.0}
+    assert resumo["locais"]["sem_local"]["offline"] == 1
+    assert agregados.sessoes_ativas == 2
+
+
+def test_potencia_pelas_leituras_e_zerada_no_fim(agregados):
+    agregados.registrar_evento({"carregador": "SP01-CP1", "acao": "inicio_carga"}, 0)
+    agregados.registrar_leitura({"carregador": "SP01-CP1", "energia_consumida_kWh": 1.0}, 60)
+    agregados.registrar_leitura({"carregador": "SP01-CP2", "energia_consumida_kWh": 5.0}, 60)  # primeira leitura: só referência
+    assert agregados.resumo(60)["potencia_kW"] == 60.0
+    assert agregados.resumo(60)["locais"]["SP01"]["potencia_kW"] == 60.0
+
+    agregados.registrar_status({"carregador": "SP01-CP1", "status": "livre"}, 90)
+    assert agregados.resumo(90)["potencia_kW"] == 0.0
+
+
+def test_energia_do_dia_divide_a_sessao_na_meia_noite(agregados):
+    agregados.registrar_evento({"carregador": "CP1", "acao": "inicio_carga"}, MEIA_NOITE - 120)
+    agregados.registrar_leitura({"carregador": "CP1", "energia_consumida_kWh": 1.0}, MEIA_NOITE - 60)
+    assert agregados.resumo(MEIA_NOITE - 1)["energia_hoje_kWh"] == 1.0
+    assert agregados.resumo(MEIA_NOITE)["energia_hoje_kWh"] == 0.0
+
+    agregados.registrar_leitura({"carregador": "CP1", "energia_consumida_kWh": 2.0}, MEIA_NOITE + 60)
+    # O fim de carga soma o que foi consumido depois da última leitura
+    agregados.registrar_evento({"carregador": "CP1", "acao": "fim_carga", "energia_consumida_kWh": 2.5}, MEIA_NOITE + 90)
+    assert agregados.resumo(MEIA_NOITE + 90)["energia_hoje_kWh"] == 1.5
+
+
+def test_sessoes_nas_janelas_de_minutos(agregados):
+    for agora in (0, 10 * 60, 50 * 60, 59 * 60):
+        agregados.registrar_evento({"carregador": "CP1", "acao": "inicio_carga"}, agora)
+    agregados.registrar_evento({"carregador": "CP1", "acao": "fim_carga"}, 59 * 60)
+
+    sessoes = agregados.resumo(59 * 60 + 30)["sessoes"]
+    assert sessoes["iniciadas"] == {"5min": 1, "15min": 2, "60min": 4}
+    assert sessoes["finalizadas"] == {"5min": 1, "15min": 1, "60min": 1}
+    # Uma hora depois o buffer circular não conta mais as antigas
+    assert agregados.resumo(2 * 3600)["sessoes"]["iniciadas"]["60min"] == 0
+
+
+class ManagerFalso:
+    def __init__(self):
+        self.active_connections = [object()]
+        self.enviados = []
+
+    def broadcast(self, texto, topico, payload):
+        self.enviados.append((json.loads(texto), topico))
+
+
+def test_resumo_enviado_so_quando_algo_mudou(agregados):
+    manager = ManagerFalso()
+
+    async def cenario():
+        tarefa = asyncio.create_task(agregados.executar(manager, intervalo=0.01))
+        agregados.registrar_status({"carregador": "CP1", "status": "livre"}, 0)
+        await asyncio.sleep(0.1)
+        agregados.registrar_status({"carregador": "CP1", "status": "ocupado"}, 1)
+        await asyncio.sleep(0.1)
+        tarefa.cancel()
+
+    asyncio.run(cenario())
+    assert [mensagem["payload"]["versao"] for mensagem, _ in manager.enviados] == [1, 2]
+    assert {topico for _, topico in manager.enviados} == {TOPICO_RESUMO}
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+pytest.importorskip("asyncpg")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api import banco  # noqa: E402
+
+
+class ConexaoFalsa:
+    def __init__(self, aplicadas):
+        self.aplicadas = set(aplicadas)
+        self.comandos = []
+
+    async def execute(self, sql, *parametros):
+        self.comandos.append(" ".join(sql.split())[:40])
+        if sql.startswith("INSERT INTO schema_migracoes"):
+            self.aplicadas.add(parametros[0])
+
+    async def fetch(self, sql):
+        return [{"versao": versao} for versao in self.aplicadas]
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.comandos.append("BEGIN")
+        yield
+        self.comandos.append("COMMIT")
+
+
+def test_migracoes_em_ordem_de_versao():
+    versoes = [versao for versao, _, _ in banco.listar_migracoes()]
+    assert versoes == sorted(versoes) and versoes[0] == 1
+
+
+def test_migrar_aplica_so_as_pendentes_sob_a_trava(monkeypatch, tmp_path):
+    for arquivo in ("0002_b.sql", "0001_a.sql", "0003_c.sql", "leia-me.txt"):
+        (tmp_path / arquivo).write_text(f"-- {arquivo}")
+    monkeypatch.setattr(banco, "DIRETORIO_MIGRACOES", str(tmp_path))
+    conn = ConexaoFalsa(aplicadas={1})
+
+    asyncio.run(banco.migrar(conn))
+
+    assert conn.aplicadas == {1, 2, 3}
+    assert conn.comandos[0].startswith("SELECT pg_advisory_lock")
+    assert conn.comandos[-1].startswith("SELECT pg_advisory_unlock")
+    assert [c for c in conn.comandos if c.startswith("--")] == ["-- 0002_b.sql", "-- 0003_c.sql"]
+    assert conn.comandos.count("BEGIN") == conn.comandos.count("COMMIT") == 2
+
+
+def test_estatisticas_por_consulta():
+    estatisticas = banco.EstatisticasConsultas()
+    estatisticas.registrar("serie", 0.002)
+    estatisticas.registrar("serie", 0.004, erro=True)
+    assert estatisticas.resumo() == {"serie": {"chamadas": 2, "erros": 1, "media_ms": 3.0, "max_ms": 4.0}}
@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+import bench_pipeline  # noqa: E402
+import transporte  # noqa: E402
+from transporte import BrokerLocal  # noqa: E402
+
+
+def test_percentis_por_rank_mais_proximo():
+    assert bench_pipeline.percentis([]) == {"amostras": 0}
+    resultado = bench_pipeline.percentis([i / 1000 for i in range(100, 0, -1)])
+    assert resultado == {"amostras": 100, "p50_ms": 51.0, "p90_ms": 91.0, "p99_ms": 100.0, "max_ms": 100.0}
+
+
+def test_billing_sem_banco_pelo_broker_local(monkeypatch):
+    pytest.importorskip("dotenv")
+    pytest.importorskip("psycopg2")
+    monkeypatch.setattr(transporte, "MQTT_TRANSPORTE", "local")
+    monkeypatch.setattr(transporte, "_broker", BrokerLocal())
+    args = argparse.Namespace(carregadores=5, sessoes=2, taxa=None, prefixo="TESTE", sem_banco=True, timeout=10)
+
+    resultado = bench_pipeline.bench_billing(args)
+
+    assert resultado["gravador"] == "memoria"
+    assert resultado["concluido"]
+    assert resultado["transacoes_recebidas"] == resultado["transacoes_esperadas"] == 10
+    assert all(estagio["erros"] == 0 for estagio in resultado["estagios"].values())
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from backend import codec  # noqa: E402
+from backend.codec import MARCADOR_BINARIO, JsonCodec, decodificar  # noqa: E402
+
+msgpack = pytest.importorskip("msgpack")
+
+PAYLOADS = [
+    {"carregador": "CP1", "carro": "Carro_1", "acao": "fim_carga", "timestamp": 42, "sessao": "abc",
+     "energia_consumida_kWh": 12.5, "leituras": 3},
+    {"carregador": "CP1", "status": "ocupado", "carro_conectado": None, "energia_consumida_kWh": 0, "timestamp": 7},
+    # Chave e valor de enum desconhecidos passam como texto
+    {"carregador": "CP1", "status": "manutencao", "campo_novo": [1, 2]},
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+@pytest.mark.parametrize("nome", ["json", "msgpack"])
+def test_ida_e_volta(nome, payload):
+    assert decodificar(codec.obter_codec(nome).codificar(payload)) == payload
+
+
+def test_binario_e_menor_e_marcado():
+    dados = codec.obter_codec("msgpack").codificar(PAYLOADS[0])
+    assert dados[:1] == MARCADOR_BINARIO
+    assert len(dados) < len(JsonCodec().codificar(PAYLOADS[0]))
+
+
+@pytest.mark.parametrize("dados", [
+    MARCADOR_BINARIO + msgpack.packb({-1: "x"}),
+    MARCADOR_BINARIO + msgpack.packb({len(codec.CHAVES): "x"}),
+    MARCADOR_BINARIO + msgpack.packb({4: -1}),
+    MARCADOR_BINARIO + msgpack.packb({4: 3}),
+    MARCADOR_BINARIO + msgpack.packb([1, 2]),
+    MARCADOR_BINARIO + b"\xff",
+    MARCADOR_BINARIO,
+    b"[1, 2]",
+    b"nao e json",
+])
+def test_payload_invalido_levanta_value_error(dados):
+    with pytest.raises(ValueError):
+        decodificar(dados)
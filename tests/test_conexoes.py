@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api import conexoes  # noqa: E402
+from api.conexoes import ClienteWebSocket, ConnectionManager, FiltroSubscricao  # noqa: E402
+
+
+class WebSocketFalso:
+    """Guarda o que foi enviado; com `travado`, o envio nunca termina (cliente lento)."""
+
+    def __init__(self, travado=False):
+        self.enviadas = []
+        self.fechado = False
+        self.travado = travado
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, mensagem):
+        if self.travado:
+            await asyncio.Event().wait()
+        self.enviadas.append(json.loads(mensagem))
+
+    async def close(self):
+        self.fechado = True
+
+
+def rodar(corrotina):
+    return asyncio.run(corrotina)
+
+
+def test_broadcast_chega_a_todos_em_ordem():
+    async def cenario():
+        manager = ConnectionManager()
+        websockets = [WebSocketFalso(), WebSocketFalso()]
+        for websocket in websockets:
+            await manager.connect(websocket)
+        for i in range(3):
+            manager.broadcast(json.dumps({"topic": "t", "payload": {"i": i}}))
+        await asyncio.sleep(0.01)
+        return websockets
+
+    for websocket in rodar(cenario()):
+        assert [m["payload"]["i"] for m in websocket.enviadas] == [0, 1, 2]
+
+
+def test_cliente_lento_e_desconectado_sem_atrasar_os_demais(monkeypatch):
+    monkeypatch.setattr(conexoes, "WS_POLITICA_LENTO", "desconectar")
+
+    async def cenario():
+        manager = ConnectionManager()
+        rapido, lento = WebSocketFalso(), WebSocketFalso(travado=True)
+        await manager.connect(rapido)
+        cliente_lento = await manager.connect(lento)
+        cliente_lento.fila = asyncio.Queue(maxsize=1)
+        for i in range(3):
+            manager.broadcast(json.dumps({"topic": "t", "payload": {"i": i}}))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return manager, rapido, lento
+
+    manager, rapido, lento = rodar(cenario())
+    assert len(rapido.enviadas) == 3
+    assert lento.fechado and lento not in manager.active_connections
+    assert rapido in manager.active_connections
+
+
+def test_descartar_mantem_as_mais_recentes_e_desiste_depois_do_limite(monkeypatch):
+    monkeypatch.setattr(conexoes, "WS_POLITICA_LENTO", "descartar")
+    monkeypatch.setattr(conexoes, "WS_MAX_DESCARTES", 2)
+
+    async def cenario():
+        cliente = ClienteWebSocket(WebSocketFalso(), fila_max=2)
+        resultados = [cliente.enfileirar(str(i)) for i in range(5)]
+        return resultados, [cliente.fila.get_nowait() for _ in range(cliente.fila.qsize())], cliente.descartes_total
+
+    resultados, fila, descartes = rodar(cenario())
+    assert resultados == [True, True, True, True, False]
+    assert fila == ["3", "4"]
+    assert descartes == 3
+
+
+@pytest.mark.parametrize("filtro, topico, casa", [
+    ("carregadores/+/status", "carregadores/CP1/status", True),
+    ("carregadores/+/status", "carregadores/CP1/eventos", False),
+    ("carregadores/#", "carregadores/CP1/eventos", True),
+    ("carregadores/CP1/status", "carregadores/CP1", False),
+    ("carregadores/+", "carregadores/CP1/status", False),
+])
+def test_topico_corresponde(filtro, topico, casa):
+    assert conexoes.topico_corresponde(filtro, topico) is casa
+
+
+def test_filtro_de_mensagem_valida_as_listas():
+    filtro = FiltroSubscricao.de_mensagem({"carregadores": ["CP1"], "eventos": ["fim_carga"], "delta": True})
+    assert filtro.aceita("carregadores/CP1/status", {"carregador": "CP1"})
+    assert not filtro.aceita("carregadores/CP2/status", {"carregador": "CP2"})
+    assert not filtro.aceita("carregadores/CP1/eventos", {"carregador": "CP1", "acao": "inicio_carga"})
+    assert filtro.delta
+    with pytest.raises(ValueError):
+        FiltroSubscricao.de_mensagem({"carregadores": "CP1"})
+
+
+def _status(**campos):
+    return dict({"carregador": "CP1", "status": "livre", "carro_conectado": None, "energia_consumida_kWh": 0}, **campos)
+
+
+def test_delta_envia_so_os_campos_alterados():
+    async def cenario():
+        cliente = ClienteWebSocket(WebSocketFalso())
+        cliente.filtro = FiltroSubscricao(delta=True)
+        topico = "carregadores/CP1/status"
+        item = {"topic": topico}
+        primeiro = cliente.preparar(topico, _status(), item)
+        segundo = cliente.preparar(topico, _status(status="ocupado", carro_conectado="Carro_1"), {"topic": topico})
+        repetido = cliente.preparar(topico, _status(status="ocupado", carro_conectado="Carro_1"), {"topic": topico})
+        return item, primeiro, segundo, repetido
+
+    item, primeiro, segundo, repetido = rodar(cenario())
+    assert primeiro is item
+    assert segundo == {"topic": "carregadores/CP1/status", "carregador": "CP1", "delta": {"status": "ocupado", "carro_conectado": "Carro_1"}}
+    assert repetido is None
+
+
+def test_descarte_volta_a_enviar_o_status_completo(monkeypatch):
+    monkeypatch.setattr(conexoes, "WS_POLITICA_LENTO", "descartar")
+
+    async def cenario():
+        cliente = ClienteWebSocket(WebSocketFalso(), fila_max=1)
+        cliente.filtro = FiltroSubscricao(delta=True)
+        topico = "carregadores/CP1/status"
+        cliente.enfileirar(json.dumps(cliente.preparar(topico, _status(), {"topic": topico})))
+        delta = cliente.preparar(topico, _status(status="ocupado"), {"topic": topico})
+        cliente.enfileirar(json.dumps(delta))  # descarta o status completo
+        item = {"topic": topico}
+        return delta, item, cliente.preparar(topico, _status(status="ocupado", energia_consumida_kWh=1.5), item)
+
+    delta, item, depois = rodar(cenario())
+    assert "delta" in delta
+    assert depois is item
+
+
+def test_subscrever_envia_o_estado_atual_filtrado():
+    async def cenario():
+        manager = ConnectionManager()
+        websocket = WebSocketFalso()
+        await manager.connect(websocket)
+        carregadores = {"CP1": _status(), "CP2": _status(carregador="CP2")}
+        manager.subscrever(websocket, FiltroSubscricao(carregadores=["CP2"]), carregadores)
+        manager.broadcast("{}", "carregadores/CP1/status", _status(status="ocupado"))
+        await asyncio.sleep(0.01)
+        return websocket.enviadas
+
+    assert rodar(cenario()) == [{"topic": "carregadores/CP2/status", "payload": _status(carregador="CP2")}]
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.conflacao import ConflacaoStatus  # noqa: E402
+
+
+class ManagerFalso:
+    def __init__(self, falhar=0):
+        self.frames = []
+        self.falhar = falhar
+
+    def broadcast_lote(self, itens):
+        if self.falhar:
+            self.falhar -= 1
+            raise RuntimeError("falha no frame")
+        self.frames.append(itens)
+
+
+def test_ultimo_status_de_cada_topico_vence():
+    conflacao = ConflacaoStatus(fps=4)
+    conflacao.registrar("carregadores/CP1/status", {"status": "livre"})
+    conflacao.registrar("carregadores/CP2/status", {"status": "livre"})
+    conflacao.registrar("carregadores/CP1/status", {"status": "ocupado"})
+
+    assert conflacao.drenar() == [
+        ("carregadores/CP1/status", {"status": "ocupado"}),
+        ("carregadores/CP2/status", {"status": "livre"}),
+    ]
+    assert conflacao.drenar() == []
+
+
+def test_fps_zero_desativa():
+    assert not ConflacaoStatus(fps=0).ativa
+
+
+def test_executar_envia_um_frame_por_intervalo_e_sobrevive_a_erros():
+    async def cenario():
+        conflacao = ConflacaoStatus(fps=100)
+        manager = ManagerFalso(falhar=1)
+        tarefa = asyncio.create_task(conflacao.executar(manager))
+        conflacao.registrar("carregadores/CP1/status", {"status": "livre"})
+        await asyncio.sleep(0.05)  # o primeiro frame falha
+        conflacao.registrar("carregadores/CP1/status", {"status": "ocupado"})
+        await asyncio.sleep(0.05)
+        tarefa.cancel()
+        return manager.frames
+
+    assert asyncio.run(cenario()) == [[("carregadores/CP1/status", {"status": "ocupado"})]]
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import re
+import sys
+
+import pytest
+
+pytest.importorskip("asyncpg")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api import consultas_billing  # noqa: E402
+
+
+@pytest.fixture
+def consultas(monkeypatch):
+    executadas = []
+
+    async def consultar(nome, sql, *parametros):
+        executadas.append((nome, " ".join(sql.split()), parametros))
+        return []
+
+    monkeypatch.setattr(consultas_billing, "consultar", consultar)
+    return executadas
+
+
+def _where(sql):
+    encontrado = re.search(r"FROM transacoes (WHERE .*?)? ?ORDER BY", sql)
+    return encontrado.group(1)
+
+
+def test_listar_sem_filtros_usa_so_o_limite(consultas):
+    asyncio.run(consultas_billing.listar_transacoes(None, None, None, 50))
+    _, sql, parametros = consultas[0]
+    assert _where(sql) is None
+    assert sql.endswith("ORDER BY id DESC LIMIT $1;")
+    assert parametros == (50,)
+
+
+def test_listar_numera_os_parametros_dos_filtros_informados(consultas):
+    asyncio.run(consultas_billing.listar_transacoes(None, "Carro_1", 900, 20, divergentes=True))
+    _, sql, parametros = consultas[0]
+    assert _where(sql) == "WHERE carro_id = $1 AND id < $2 AND divergencia IS NOT NULL"
+    assert sql.endswith("LIMIT $3;")
+    assert parametros == ("Carro_1", 900, 20)
+
+
+@pytest.mark.parametrize("granularidade, truncar", [("hora", "hour"), ("dia", "day")])
+def test_serie_usa_a_granularidade_do_postgres(consultas, granularidade, truncar):
+    asyncio.run(consultas_billing.resumo_frota(granularidade, "inicio", "fim"))
+    assert consultas[0][2] == (truncar, "inicio", "fim")
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pydantic")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from fastapi import HTTPException  # noqa: E402
+from api import coordenacao  # noqa: E402
+from api.coordenacao import TOPICO_DIFUSAO, Coordenacao, _assinatura  # noqa: E402
+
+CHAVE = "segredo"
+
+
+class BrokerFalso:
+    """Entrega cada publicação a todos os workers, como o broker faria com as subscrições deles."""
+
+    def __init__(self):
+        self.workers = []
+        self.publicadas = []
+
+    def publish(self, topico, payload, qos=0):
+        self.publicadas.append((topico, payload))
+        for worker in self.workers:
+            worker.tratar_mensagem(topico, json.loads(payload))
+
+
+@pytest.fixture
+def workers(tmp_path):
+    criados = []
+    broker = BrokerFalso()
+
+    def criar(nome, chave=CHAVE):
+        worker = Coordenacao(arquivo=str(tmp_path / "dono.lock"), chave=chave)
+        worker.worker_id = nome
+        worker.client = broker
+        worker.loop = asyncio.get_running_loop()
+        broker.workers.append(worker)
+        criados.append(worker)
+        return worker
+
+    yield criar, broker
+    for worker in criados:
+        worker.fechar()
+
+
+def test_um_dono_por_arquivo_de_trava(workers):
+    criar, _ = workers
+
+    async def cenario():
+        primeiro, segundo = criar("w1"), criar("w2")
+        assert primeiro.tentar_assumir()
+        assert not segundo.tentar_assumir()
+        primeiro.fechar()
+        assert segundo.tentar_assumir()
+
+    asyncio.run(cenario())
+
+
+def test_operacao_encaminhada_ao_dono(workers):
+    criar, broker = workers
+    chamadas = []
+
+    async def cenario():
+        dono, outro = criar("dono"), criar("outro")
+        dono.tentar_assumir()
+
+        async def iniciar_carregadores(quantidade: int):
+            chamadas.append(quantidade)
+            if quantidade > 10:
+                raise HTTPException(status_code=409, detail="Carregadores demais")
+            return {"iniciados": quantidade}
+
+        for worker in (dono, outro):
+            worker.operacao(iniciar_carregadores)
+        encaminhada = outro.operacao(iniciar_carregadores)
+
+        assert await encaminhada(quantidade=3) == {"iniciados": 3}
+        with pytest.raises(HTTPException) as erro:
+            await encaminhada(quantidade=20)
+        assert (erro.value.status_code, erro.value.detail) == (409, "Carregadores demais")
+
+    asyncio.run(cenario())
+    assert chamadas == [3, 20]
+    # Requisições e respostas vão assinadas
+    assert all("assinatura" in json.loads(payload) for _, payload in broker.publicadas)
+
+
+def test_difusao_roda_nos_outros_workers(workers):
+    criar, broker = workers
+    limpezas = []
+
+    async def cenario():
+        primeiro, segundo = criar("w1"), criar("w2")
+        for worker in (primeiro, segundo):
+            worker.registrar_difusao("limpar", lambda nome=worker.worker_id: limpezas.append(nome))
+        primeiro.difundir("limpar")
+        await asyncio.sleep(0)
+
+        sem_chave = criar("w3", chave=None)
+        sem_chave.difundir("limpar")
+        await asyncio.sleep(0)
+
+    asyncio.run(cenario())
+    assert limpezas == ["w2"]
+    assert [topico for topico, _ in broker.publicadas] == [TOPICO_DIFUSAO]
+
+
+def _assinada(mensagem, chave=CHAVE, **campos):
+    mensagem = {"id": "m1", "emitido_em": time.time(), **mensagem, **campos}
+    mensagem["assinatura"] = _assinatura(chave, mensagem)
+    return mensagem
+
+
+def test_autenticacao_recusa_forjadas_velhas_e_repetidas():
+    worker = Coordenacao(chave=CHAVE)
+    valida = _assinada({"acao": "limpar"})
+
+    assert not worker._autentica({"acao": "limpar", "id": "m0", "emitido_em": time.time()})
+    assert not worker._autentica(_assinada({"acao": "limpar"}, chave="outra"))
+    assert not worker._autentica({**valida, "acao": "parar"})  # conteúdo alterado
+    assert not worker._autentica(_assinada({"acao": "limpar"}, id="m2", emitido_em=time.time() - 2 * coordenacao.API_CONTROLE_TIMEOUT))
+    assert worker._autentica(valida)
+    assert not worker._autentica(valida)  # repetida
+    assert not Coordenacao(chave=None)._autentica(valida)
+
+
+def test_sem_chave_operacao_encaminhada_responde_503():
+    worker = Coordenacao(chave=None)
+    with pytest.raises(HTTPException) as erro:
+        worker._assinar({"operacao": "parar"})
+    assert erro.value.status_code == 503
@@ -0,0 +1,88 @@
+import json
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.estado_carregadores import TabelaCarregadores  # noqa: E402
+
+
+def _status(status="ocupado", carro="Carro_1", energia=1.25, timestamp=42, carregador="CP1"):
+    return {"carregador": carregador, "status": status, "carro_conectado": carro, "energia_consumida_kWh": energia, "timestamp": timestamp}
+
+
+@pytest.mark.parametrize("payload", [
+    _status(),
+    _status("livre", None, 0, 7),  # offline/livre mandam energia como int
+    {"carregador": "CP1", "status": "offline"},  # LWT
+    {"carregador": "CP1"},
+    _status(status="manutencao"),
+    _status(carro=123),
+    _status(energia="1.5"),
+    _status(energia=2 ** 60),
+    _status(energia=float("inf")),
+    _status(timestamp=2 ** 70),
+    _status(timestamp=None),
+    _status(carregador="CP1-antigo"),
+    {**_status(), "sessao": "s1", "potencia_kW": 7.4},
+])
+def test_payload_volta_igual(payload):
+    tabela = TabelaCarregadores()
+    tabela["CP1"] = payload
+    lido = tabela["CP1"]
+    assert lido == payload
+    assert {k: type(v) for k, v in lido.items()} == {k: type(v) for k, v in payload.items()}
+    assert json.loads(tabela.json()) == {"CP1": payload}
+
+
+def test_json_igual_ao_do_dict():
+    tabela = TabelaCarregadores()
+    esperado = {}
+    for i, payload in enumerate([_status(), _status("livre", None, 0), {"carregador": "CP3", "status": "offline"}, {**_status(), "extra": [1]}]):
+        carregador = f"CP{i}é"
+        payload = {**payload, "carregador": carregador}
+        tabela[carregador] = esperado[carregador] = payload
+    assert tabela.json() == json.dumps(esperado)
+
+
+def test_status_novo_substitui_o_anterior_inteiro():
+    tabela = TabelaCarregadores()
+    tabela["CP1"] = {**_status(), "sessao": "s1"}
+    tabela["CP1"] = {"carregador": "CP1", "status": "offline"}
+    assert tabela["CP1"] == {"carregador": "CP1", "status": "offline"}
+    assert tabela.status("CP1") == "offline"
+    tabela["CP1"] = _status(status="manutencao")
+    assert tabela.status("CP1") == "manutencao"
+    assert tabela.status("CP9") is None
+
+
+def test_atualizar_energia_so_de_carregador_conhecido():
+    tabela = TabelaCarregadores()
+    assert not tabela.atualizar_energia("CP1", 1.0)
+    tabela["CP1"] = _status(energia="texto")
+    assert tabela.atualizar_energia("CP1", 3)
+    assert tabela["CP1"] == _status(energia=3)
+    assert tabela.atualizar_energia("CP1", math.nan)
+    assert math.isnan(tabela["CP1"]["energia_consumida_kWh"])
+    assert tabela.atualizar_energia("CP1", 3.5)
+    assert tabela["CP1"] == _status(energia=3.5)
+
+
+def test_remocao_libera_o_indice_para_outro_carregador():
+    tabela = TabelaCarregadores()
+    tabela["CP1"] = {**_status(), "sessao": "s1"}
+    tabela["CP2"] = _status(carregador="CP2")
+    indice = tabela._indices["CP1"]
+    del tabela["CP1"]
+    assert "CP1" not in tabela and len(tabela) == 1
+
+    tabela["CP3"] = {"carregador": "CP3", "status": "livre"}
+    assert tabela._indices["CP3"] == indice
+    # Nada do carregador removido vaza para o novo dono do índice
+    assert tabela["CP3"] == {"carregador": "CP3", "status": "livre"}
+    assert dict(tabela.items()) == {"CP2": _status(carregador="CP2"), "CP3": tabela["CP3"]}
+
+    tabela.clear()
+    assert len(tabela) == 0 and tabela.json() == "{}"
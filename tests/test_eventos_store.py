@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.eventos_store import EventoStore, formatar_cursor, ler_cursor  # noqa: E402
+
+
+def _evento(timestamp, carregador="CP1", carro="Carro_1", acao="inicio_carga"):
+    return {"carregador": carregador, "carro": carro, "acao": acao, "timestamp": timestamp}
+
+
+def _paginar(store, **filtros):
+    paginas = []
+    cursor = None
+    while True:
+        pagina, cursor = store.consultar(cursor=cursor, **filtros)
+        paginas.append([e["timestamp"] for e in pagina])
+        if cursor is None:
+            return paginas
+
+
+def test_cursor_ida_e_volta():
+    assert ler_cursor(formatar_cursor(42, 7)) == (42, 7)
+    with pytest.raises(ValueError):
+        ler_cursor("42")
+
+
+def test_consulta_em_ordem_de_lamport_mesmo_fora_de_ordem_de_chegada():
+    store = EventoStore(capacidade=10)
+    for timestamp in (5, 1, 3, 2, 4):
+        store.adicionar(_evento(timestamp))
+    assert _paginar(store, limit=2) == [[1, 2], [3, 4], [5]]
+
+
+def test_cursor_desempata_timestamps_iguais_pela_sequencia():
+    store = EventoStore(capacidade=10)
+    for carro in ("A", "B", "C"):
+        store.adicionar(_evento(7, carro=carro))
+    primeira, cursor = store.consultar(limit=2)
+    segunda, cursor_final = store.consultar(limit=2, cursor=cursor)
+    assert [e["carro"] for e in primeira + segunda] == ["A", "B", "C"]
+    assert cursor_final is None
+
+
+def test_buffer_circular_descarta_os_mais_antigos_e_os_indices():
+    store = EventoStore(capacidade=3)
+    for timestamp in range(1, 6):
+        store.adicionar(_evento(timestamp, carregador=f"CP{timestamp}"))
+    assert len(store) == 3
+    assert [e["timestamp"] for e in store.ultimos(10)] == [3, 4, 5]
+    assert store.consultar(carregador="CP1") == ([], None)
+    assert store.consultar()[0] == [_evento(t, carregador=f"CP{t}") for t in (3, 4, 5)]
+
+
+def test_filtros_por_carregador_carro_e_since():
+    store = EventoStore(capacidade=20)
+    store.adicionar(_evento(1, "CP1", "A"))
+    store.adicionar(_evento(2, "CP2", "A"))
+    store.adicionar(_evento(3, "CP1", "B"))
+    store.adicionar(_evento(4, "CP1", "A"))
+
+    assert _paginar(store, carregador="CP1", limit=1) == [[1], [3], [4]]
+    assert _paginar(store, carro="A") == [[1, 2, 4]]
+    assert _paginar(store, carregador="CP1", carro="A") == [[1, 4]]
+    assert store.consultar(since=2)[0] == [_evento(3, "CP1", "B"), _evento(4, "CP1", "A")]
+
+
+def test_limpar_zera_o_store():
+    store = EventoStore(capacidade=5)
+    store.adicionar(_evento(1))
+    store.limpar()
+    assert len(store) == 0
+    assert store.consultar() == ([], None)
@@ -0,0 +1,89 @@
+import os
+import queue
+import sys
+import zlib
+
+import pytest
+
+# Os módulos do backend se importam pelo nome (rodam de dentro de backend/)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import spool  # noqa: E402
+import transporte  # noqa: E402
+from codec import codificar, decodificar  # noqa: E402
+from frota import Frota  # noqa: E402
+from transporte import BrokerLocal, ClienteLocal, MensagemLocal  # noqa: E402
+
+ESPERA = 5
+
+
+@pytest.fixture
+def broker(monkeypatch, tmp_path):
+    broker = BrokerLocal()
+    monkeypatch.setattr(transporte, "MQTT_TRANSPORTE", "local")
+    monkeypatch.setattr(transporte, "_broker", broker)
+    monkeypatch.setattr(spool, "SPOOL_DIR", str(tmp_path))
+    return broker
+
+
+@pytest.fixture
+def frota(broker):
+    frota = Frota("f1", num_conexoes=2)
+    for client in frota.clients:
+        client.connect()
+    yield frota
+    for publicador in frota.publicadores:
+        publicador.fechar()
+
+
+@pytest.fixture
+def observador(broker):
+    client = ClienteLocal("observador", True, broker)
+    recebidas = queue.Queue()
+    client.on_message = lambda c, u, msg: recebidas.put((msg.topic, decodificar(msg.payload)))
+    client.connect()
+    client.loop_start()
+    client.subscribe("carregadores/#", 1)
+    yield recebidas
+    client.disconnect()
+    client.loop_stop()
+
+
+def test_iniciar_distribui_carregadores_entre_as_conexoes(frota, observador):
+    frota.aplicar_comando({"acao": "iniciar", "carregadores": ["CP1", "CP2", "CP1"]})
+
+    assert sorted(frota.carregadores) == ["CP1", "CP2"]
+    for carregador_id, carregador in frota.carregadores.items():
+        assert carregador.client is frota.clients[zlib.crc32(carregador_id.encode()) % 2]
+    status = {observador.get(timeout=ESPERA)[1]["carregador"] for _ in range(2)}
+    assert status == {"CP1", "CP2"}
+
+
+def test_parar_publica_offline_e_finaliza_a_sessao(frota, observador):
+    frota.aplicar_comando({"acao": "iniciar", "carregadores": ["CP1"]})
+    observador.get(timeout=ESPERA)
+    frota.carregadores["CP1"].conectar_carro("Carro_1")
+    observador.get(timeout=ESPERA)  # inicio_carga
+    observador.get(timeout=ESPERA)  # status ocupado
+
+    frota.aplicar_comando({"acao": "parar_todos"})
+
+    assert frota.carregadores == {}
+    recebidas = [observador.get(timeout=ESPERA) for _ in range(3)]
+    assert recebidas[0][1]["acao"] == "fim_carga"
+    assert recebidas[-1] == ("carregadores/CP1/status", {"carregador": "CP1", "status": "offline", "carro_conectado": None, "energia_consumida_kWh": 0})
+
+
+def test_comando_desconhecido_e_ignorado(frota):
+    frota.aplicar_comando({"acao": "iniciar", "carregadores": ["CP1"]})
+    frota.aplicar_comando({"acao": "explodir", "carregadores": ["CP1"]})
+    assert list(frota.carregadores) == ["CP1"]
+
+
+def test_relogio_global_guarda_o_maior_e_e_incorporado_no_passo(frota):
+    frota.aplicar_comando({"acao": "iniciar", "carregadores": ["CP1"]})
+    for timestamp in (500, 20):
+        frota.on_message(None, None, MensagemLocal("relogio/beacon", codificar({"timestamp": timestamp}), 0, False))
+    assert frota.ultimo_timestamp_global == 500
+
+    frota._passo_carregador(frota.carregadores["CP1"])
+    assert frota.carregadores["CP1"].clock.get_time() > 500
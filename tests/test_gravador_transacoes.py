@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import gravador_transacoes  # noqa: E402
+from gravador_transacoes import GravadorTransacoes  # noqa: E402
+
+ESPERA = 5
+
+
+class BancoFalso:
+    """
+    Substitui o pool do psycopg2 e o execute_values: guarda as linhas por
+    chave de idempotência (como o ON CONFLICT DO NOTHING) e pode ficar fora do ar.
+    """
+
+    def __init__(self):
+        self.no_ar = True
+        self.linhas = {}
+        self.versao_esquema = 0
+        self._lock = threading.Lock()
+
+    def _verificar(self):
+        if not self.no_ar:
+            raise psycopg2.OperationalError("connection refused")
+
+    # pool
+    def ThreadedConnectionPool(self, minimo, maximo, url):
+        self._verificar()
+        return self
+
+    def getconn(self):
+        self._verificar()
+        return self
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+    # conexão e cursor
+    closed = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql):
+        self._verificar()
+
+    def fetchone(self):
+        return (self.versao_esquema,)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def execute_values(self, cur, sql, valores, page_size, fetch):
+        self._verificar()
+        inseridas = []
+        with self._lock:
+            for valor in valores:
+                if valor[5] not in self.linhas:
+                    self.linhas[valor[5]] = valor
+                    inseridas.append((valor[5],))
+        return inseridas
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    banco = BancoFalso()
+    monkeypatch.setattr(gravador_transacoes, "pg_pool", types.SimpleNamespace(ThreadedConnectionPool=banco.ThreadedConnectionPool))
+    monkeypatch.setattr(gravador_transacoes, "execute_values", banco.execute_values)
+    monkeypatch.setattr(gravador_transacoes, "ESPERA_MAX", 0.01)
+    return banco
+
+
+@pytest.fixture
+def criar(tmp_path):
+    criados = []
+
+    def criar(**opcoes):
+        gravados = []
+        opcoes.setdefault("pendentes_dir", str(tmp_path / "pendentes"))
+        gravador = GravadorTransacoes("postgresql://teste", flush_interval=0.01, ao_gravar=gravados.extend, **opcoes)
+        gravador.versao_esquema = 0
+        criados.append(gravador)
+        return gravador, gravados
+
+    yield criar
+    for gravador in criados:
+        gravador.fechar()
+
+
+def _transacao(chave):
+    return {"carro": "Carro_1", "carregador": "CP1", "energia_total_kWh": 1.0, "custo_total_brl": 2.0,
+            "timestamp_transacao": 1, "chave_idempotencia": chave}
+
+
+def _esperar(condicao, timeout=ESPERA):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            pytest.fail("condição não atingida a tempo")
+        time.sleep(0.01)
+
+
+def test_chave_repetida_e_gravada_e_publicada_uma_vez(banco, criar):
+    gravador, gravados = criar()
+    confirmadas = []
+    for chave in ("a", "b", "a"):
+        gravador.enviar(_transacao(chave), lambda chave=chave: confirmadas.append(chave))
+    gravador.fechar()
+    gravador2, gravados2 = criar()
+    gravador2.enviar(_transacao("b"))
+    gravador2.fechar()
+
+    assert sorted(banco.linhas) == ["a", "b"]
+    assert [t["chave_idempotencia"] for t in gravados] == ["a", "b"]
+    assert gravados2 == []
+    assert sorted(confirmadas) == ["a", "a", "b"]
+
+
+def test_banco_fora_do_ar_no_inicio_nao_perde_o_lote(banco, criar):
+    banco.no_ar = False
+    gravador, gravados = criar()
+    confirmadas = []
+    gravador.enviar(_transacao("a"), lambda: confirmadas.append("a"))
+    time.sleep(0.1)
+    assert confirmadas == []
+
+    banco.no_ar = True
+    _esperar(lambda: confirmadas == ["a"])
+    assert [t["chave_idempotencia"] for t in gravados] == ["a"]
+
+
+def test_desligamento_sem_banco_guarda_o_lote_e_o_proximo_regrava(banco, criar, tmp_path):
+    banco.no_ar = False
+    gravador, _ = criar()
+    confirmadas = []
+    for chave in ("a", "b"):
+        gravador.enviar(_transacao(chave), lambda chave=chave: confirmadas.append(chave))
+    gravador.fechar()
+
+    pendentes = tmp_path / "pendentes"
+    (arquivo,) = os.listdir(pendentes)
+    assert [t["chave_idempotencia"] for t in json.loads((pendentes / arquivo).read_text())] == ["a", "b"]
+    assert sorted(confirmadas) == ["a", "b"]  # seguras no disco
+
+    banco.no_ar = True
+    gravador2, gravados2 = criar()
+    gravador2.fechar()
+    assert sorted(t["chave_idempotencia"] for t in gravados2) == ["a", "b"]
+    assert os.listdir(pendentes) == []
+
+
+def test_lote_tomado_por_processo_morto_volta_para_a_fila(banco, criar, tmp_path):
+    pendentes = tmp_path / "pendentes"
+    pendentes.mkdir()
+    # PID acima de pid_max: nenhum processo o tem
+    (pendentes / "lote-1-1.json.99999999").write_text(json.dumps([_transacao("a")]))
+    gravador, _ = criar()
+    gravador.fechar()
+    assert "a" in banco.linhas
+    assert os.listdir(pendentes) == []
+
+
+def test_versao_necessaria_e_a_maior_migracao(tmp_path):
+    for arquivo in ("0001_a.sql", "0012_b.sql", "0003_c.sql", "notas.md"):
+        (tmp_path / arquivo).write_text("")
+    assert gravador_transacoes.versao_esquema_necessaria(str(tmp_path)) == 12
+    assert gravador_transacoes.versao_esquema_necessaria(str(tmp_path / "nao-existe")) == 0
+
+
+def test_espera_o_esquema_chegar_na_versao_antes_de_gravar(banco, criar):
+    banco.versao_esquema = 4
+    gravador, _ = criar()
+    gravador.versao_esquema = 5
+    confirmadas = []
+    gravador.enviar(_transacao("a"), lambda: confirmadas.append("a"))
+    time.sleep(0.1)
+    assert banco.linhas == {} and confirmadas == []
+
+    banco.versao_esquema = 5
+    _esperar(lambda: confirmadas == ["a"])
+    assert "a" in banco.linhas
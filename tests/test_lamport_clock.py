@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from lamport_clock import (  # noqa: E402
+    BITS_LOGICO, MASCARA_LOGICO, LamportClock, RelogioHibrido, criar_relogio, epoch_do_timestamp, timestamp_hibrido,
+)
+
+
+def test_lamport_envio_recebimento_e_reserva():
+    relogio = LamportClock()
+    assert relogio.send_event() == 1
+    assert relogio.receive_event(10) == 11
+    assert relogio.receive_event(3) == 12
+    assert list(relogio.reservar(3)) == [13, 14, 15]
+    assert relogio.get_time() == 15
+    assert relogio.deriva(15, 11) == 4
+
+
+def test_lamport_sem_timestamps_repetidos_entre_threads():
+    relogio = LamportClock()
+    vistos = [[] for _ in range(4)]
+
+    def usar(saida):
+        for _ in range(500):
+            saida.append(relogio.send_event())
+            saida.extend(relogio.reservar(3))
+
+    threads = [threading.Thread(target=usar, args=(saida,)) for saida in vistos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    todos = [t for saida in vistos for t in saida]
+    assert sorted(todos) == list(range(1, 4 * 500 * 4 + 1))
+
+
+def _hibrido(ms):
+    agora = [ms]
+    return RelogioHibrido(agora_ms=lambda: agora[0]), agora
+
+
+def test_hibrido_segue_o_tempo_fisico():
+    relogio, agora = _hibrido(1000)
+    assert relogio.send_event() == 1000 << BITS_LOGICO
+    assert relogio.send_event() == (1000 << BITS_LOGICO) + 1
+    agora[0] = 1005
+    assert relogio.tick() == 1005 << BITS_LOGICO
+
+
+def test_hibrido_nunca_volta_com_o_relogio_fisico():
+    relogio, agora = _hibrido(2000)
+    antes = relogio.send_event()
+    agora[0] = 1500  # ajuste do NTP para trás
+    assert relogio.send_event() == antes + 1
+
+
+def test_hibrido_recebimento_de_no_adiantado():
+    relogio, _ = _hibrido(1000)
+    recebido = (1200 << BITS_LOGICO) + 7
+    assert relogio.receive_event(recebido) == recebido + 1
+    assert relogio.deriva(1000 << BITS_LOGICO, recebido) == 200
+
+
+def test_hibrido_contador_estourado_avanca_um_ms():
+    relogio, _ = _hibrido(1000)
+    relogio.time = (1000 << BITS_LOGICO) | MASCARA_LOGICO
+    assert relogio.send_event() == 1001 << BITS_LOGICO
+
+
+def test_hibrido_reserva_consecutiva():
+    relogio, _ = _hibrido(1000)
+    relogio.send_event()
+    reservados = relogio.reservar(3)
+    assert list(reservados) == [(1000 << BITS_LOGICO) + i for i in (1, 2, 3)]
+    assert relogio.get_time() == reservados[-1]
+
+
+def test_conversao_entre_horario_e_timestamp_hibrido():
+    assert epoch_do_timestamp(timestamp_hibrido(1700000000.123, 42)) == 1700000000.123
+    # Limite de consulta: todo timestamp gerado naquele ms é >= timestamp_hibrido(instante)
+    relogio, _ = _hibrido(1700000000123)
+    assert relogio.send_event() >= timestamp_hibrido(1700000000.123)
+
+
+def test_criar_relogio_pelo_modo():
+    assert type(criar_relogio("lamport")) is LamportClock
+    assert type(criar_relogio("hibrido")) is RelogioHibrido
@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import log_eventos  # noqa: E402
+from log_eventos import LogEventos, ler_log, listar_segmentos, resumo  # noqa: E402
+
+
+@pytest.fixture
+def diretorio(tmp_path):
+    return str(tmp_path / "log")
+
+
+def _gravar(diretorio, registros, **opcoes):
+    log = LogEventos(diretorio, flush_intervalo=60, **opcoes)
+    for registro in registros:
+        log.adicionar(*registro)
+    log.fechar()
+    return log
+
+
+def test_le_os_registros_na_ordem_de_chegada_com_o_payload_intacto(diretorio):
+    registros = [
+        ("carregadores/CP1/eventos", b'{"acao": "inicio_carga"}', 5, 100.0),
+        ("carregadores/CP1/status", b"\x81\x00\xff", None, 101.0),
+        ("carregadores/CP2/leituras", b"", 3, 102.0),
+    ]
+    _gravar(diretorio, registros)
+    assert list(ler_log(diretorio)) == registros
+
+
+def test_filtra_por_timestamp_horario_e_sufixo(diretorio):
+    _gravar(diretorio, [
+        ("carregadores/CP1/eventos", b"a", 1, 10.0),
+        ("carregadores/CP1/status", b"b", None, 20.0),
+        ("carregadores/CP1/leituras", b"c", 3, 30.0),
+        ("carregadores/CP1/eventos", b"d", 4, 40.0),
+    ])
+
+    def payloads(**filtros):
+        return [dados for _, dados, _, _ in ler_log(diretorio, **filtros)]
+
+    # Limites inclusivos; sem timestamp não passa num filtro de timestamp
+    assert payloads(ts_de=3) == [b"c", b"d"]
+    assert payloads(ts_ate=3) == [b"a", b"c"]
+    assert payloads(desde=20.0, ate=30.0) == [b"b", b"c"]
+    assert payloads(sufixos=("/eventos", "/leituras")) == [b"a", b"c", b"d"]
+
+
+def test_indice_dos_segmentos_e_rotacao(diretorio):
+    # Segmentos minúsculos: cada registro fecha o seu
+    _gravar(diretorio, [("t/eventos", b"x" * 64, ts, float(ts)) for ts in range(1, 6)],
+            tamanho_segmento_mb=50 / (1024 * 1024), max_segmentos=3)
+
+    segmentos = resumo(diretorio)
+    assert len(segmentos) == 3
+    # O último segmento foi aberto depois da última rotação e ficou vazio
+    assert [s["faixa"]["ts_max"] for s in segmentos] == [4, 5, None]
+    assert [ts for _, _, ts, _ in ler_log(diretorio)] == [4, 5]
+    assert [ts for _, _, ts, _ in ler_log(diretorio, ts_de=5)] == [5]
+
+
+def test_indice_permite_pular_segmentos(diretorio, monkeypatch):
+    _gravar(diretorio, [("t/eventos", b"x" * 64, ts, float(ts)) for ts in range(1, 4)],
+            tamanho_segmento_mb=50 / (1024 * 1024), max_segmentos=0)
+    abertos = []
+    abrir = open
+    monkeypatch.setattr(log_eventos, "open", lambda caminho, *args: abertos.append(os.path.basename(caminho)) or abrir(caminho, *args), raising=False)
+
+    assert [ts for _, _, ts, _ in ler_log(diretorio, ts_de=3)] == [3]
+    # Só o segmento com ts 3 e o último, vazio, são lidos
+    assert [nome for nome in abertos if nome.endswith(".log")] == ["segmento-00000002.log", "segmento-00000003.log"]
+
+
+def test_nova_execucao_comeca_outro_segmento_e_ignora_registro_truncado(diretorio):
+    _gravar(diretorio, [("t/eventos", b"a", 1, 1.0)])
+    log = LogEventos(diretorio, flush_intervalo=60)
+    log.adicionar("t/eventos", b"b", 2, 2.0)
+    log.adicionar("t/eventos", b"c" * 10, 3, 3.0)
+    log._arquivo.flush()
+    # Queda no meio da escrita do último registro, sem índice gravado
+    with open(log.caminho, "r+b") as arquivo:
+        arquivo.truncate(os.path.getsize(log.caminho) - 5)
+
+    assert [os.path.basename(s) for s in listar_segmentos(diretorio)] == ["segmento-00000000.log", "segmento-00000001.log"]
+    assert resumo(diretorio)[1]["faixa"] is None
+    assert [dados for _, dados, _, _ in ler_log(diretorio)] == [b"a", b"b"]
+    log.fechar()
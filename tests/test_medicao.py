@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.medicao import MedicaoSessoes  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from carregador import Carregador  # noqa: E402
+from codec import decodificar  # noqa: E402
+
+
+def _leitura(energia, sessao="s1"):
+    return {"carregador": "CP1", "acao": "leitura", "sessao": sessao, "energia_consumida_kWh": energia}
+
+
+@pytest.fixture
+def medicao():
+    medicao = MedicaoSessoes(horizonte=120)
+    medicao.iniciar({"carregador": "CP1", "carro": "Carro_1", "sessao": "s1"}, agora=0)
+    return medicao
+
+
+def test_interpola_pela_potencia_entre_leituras(medicao):
+    medicao.registrar_leitura(_leitura(1.0), agora=60)
+    medicao.registrar_leitura(_leitura(3.0), agora=120)
+
+    (sessao,) = medicao.estimar(agora=150)
+    assert sessao["leituras"] == 2
+    assert sessao["potencia_kW"] == 120.0  # 2 kWh em 60 s
+    assert sessao["energia_medida_kWh"] == 3.0
+    assert sessao["energia_estimada_kWh"] == 4.0
+    assert sessao["ultima_leitura_ha_s"] == 30
+
+
+def test_estimativa_para_de_crescer_depois_do_horizonte(medicao):
+    medicao.registrar_leitura(_leitura(1.0), agora=36)  # 100 kW
+    assert medicao.estimar(agora=36 + 120)[0]["energia_estimada_kWh"] == medicao.estimar(agora=36 + 3600)[0]["energia_estimada_kWh"]
+
+
+def test_leitura_de_outra_sessao_recomeca_a_medicao(medicao):
+    medicao.registrar_leitura(_leitura(2.0), agora=60)
+    medicao.registrar_leitura(_leitura(0.5, sessao="s2"), agora=90)
+
+    (sessao,) = medicao.estimar(agora=90)
+    assert (sessao["sessao"], sessao["leituras"], sessao["energia_medida_kWh"], sessao["potencia_kW"]) == ("s2", 1, 0.5, 0.0)
+
+
+def test_fim_carga_so_encerra_a_propria_sessao(medicao):
+    medicao.finalizar({"carregador": "CP1", "sessao": "outra"})
+    assert len(medicao.estimar(agora=1)) == 1
+    medicao.finalizar({"carregador": "CP1", "sessao": "s1"})
+    assert medicao.estimar(agora=1) == []
+
+
+class ClienteFalso:
+    def __init__(self):
+        self.publicadas = []
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.publicadas.append((topic, decodificar(payload), retain))
+
+
+class PublicadorFalso:
+    def __init__(self):
+        self.conexoes = 0
+
+    def ao_conectar(self):
+        self.conexoes += 1
+
+
+def test_carregador_republica_o_status_a_cada_conexao():
+    client, publicador = ClienteFalso(), PublicadorFalso()
+    carregador = Carregador("CP1", client=client, verbose=False, publicador=publicador)
+    carregador.carro_conectado = "Carro_1"
+
+    carregador.on_connect(client, None, {}, 0)
+
+    # Substitui o 'offline' que o LWT deixou retido numa queda
+    topico, payload, retido = client.publicadas[-1]
+    assert (topico, payload["status"], payload["carro_conectado"], retido) == ("carregadores/CP1/status", "ocupado", "Carro_1", True)
+    assert publicador.conexoes == 1
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from backend import metricas, registro  # noqa: E402
+from backend.registro import FormatoJson, FormatoTexto, LimiteTaxa  # noqa: E402
+
+
+@pytest.mark.parametrize("topico, rotulo", [
+    ("carregadores/CP00042/status", "carregadores/+/status"),
+    ("frotas/frota-1/comandos", "frotas/+/comandos"),
+    ("billing/worker-3/controle", "billing/+/controle"),
+    ("billing/transacoes", "billing/transacoes"),
+    ("relogio/beacon", "relogio/beacon"),
+])
+def test_topico_metrica_tem_baixa_cardinalidade(topico, rotulo):
+    assert metricas.topico_metrica(topico) == rotulo
+
+
+def test_decodificar_medindo_repassa_o_erro():
+    assert metricas.decodificar_medindo(json.loads, b'{"a": 1}') == {"a": 1}
+    with pytest.raises(ValueError):
+        metricas.decodificar_medindo(json.loads, b"{")
+
+
+def _registro(mensagem="Falha em %s", nivel=logging.WARNING, **extras):
+    record = logging.LogRecord("billing", nivel, __file__, 1, mensagem, ("CP1",), None)
+    record.__dict__.update(extras)
+    return record
+
+
+def test_limite_de_taxa_por_mensagem_conta_as_suprimidas(monkeypatch):
+    agora = [0.0]
+    monkeypatch.setattr(registro, "time", types.SimpleNamespace(monotonic=lambda: agora[0]))
+    limite = LimiteTaxa(por_segundo=1, rajada=2)
+
+    assert [limite.filter(_registro()) for _ in range(4)] == [True, True, False, False]
+    # Outra mensagem tem o próprio balde
+    assert limite.filter(_registro("Outra falha em %s"))
+
+    agora[0] = 1.0
+    record = _registro()
+    assert limite.filter(record)
+    assert record.suprimidas == 2
+
+
+def test_formatos_incluem_campos_e_suprimidas():
+    record = _registro(campos={"carregador": "CP1", "lote": 3}, suprimidas=5)
+
+    linha = json.loads(FormatoJson().format(record))
+    assert linha["mensagem"] == "Falha em CP1"
+    assert linha["nivel"] == "WARNING"
+    assert linha["carregador"] == "CP1" and linha["lote"] == 3
+    assert linha["suprimidas"] == 5
+
+    texto = FormatoTexto().format(record)
+    assert texto.endswith("Falha em CP1 carregador=CP1 lote=3 (5 mensagens iguais suprimidas)")
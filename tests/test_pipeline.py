@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from pipeline import ConfirmacoesMqtt, Estagio, Pipeline  # noqa: E402
+
+
+class Saida:
+    """Último estágio de teste: guarda os itens que chegaram ao fim."""
+
+    def __init__(self):
+        self.itens = []
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.itens.append(item)
+
+
+def test_estagios_encadeados_preservam_a_ordem_por_chave():
+    saida = Saida()
+    pipeline = Pipeline([
+        Estagio("dobrar", lambda x: (x[0], x[1] * 2), workers=4),
+        Estagio("saida", saida, workers=2),
+    ])
+    pipeline.iniciar()
+    for i in range(200):
+        chave = f"CP{i % 7}"
+        pipeline.enviar((chave, i), chave)
+    pipeline.parar()
+
+    assert len(saida.itens) == 200
+    for chave in {c for c, _ in saida.itens}:
+        valores = [v for c, v in saida.itens if c == chave]
+        assert valores == sorted(valores)
+    assert sorted(v for _, v in saida.itens) == [i * 2 for i in range(200)]
+
+
+def test_none_descarta_e_erro_nao_para_o_estagio():
+    saida = Saida()
+
+    def filtrar(x):
+        if x == 3:
+            raise RuntimeError("item inválido")
+        return x if x % 2 else None
+
+    pipeline = Pipeline([Estagio("filtrar", filtrar), Estagio("saida", saida)])
+    pipeline.iniciar()
+    for i in range(6):
+        pipeline.enviar(i)
+    pipeline.parar()
+
+    assert saida.itens == [1, 5]
+    estatisticas = pipeline.estatisticas()["filtrar"]
+    assert estatisticas["processados"] == 5
+    assert estatisticas["erros"] == 1
+    assert estatisticas["fila"] == 0
+
+
+class ClienteAck:
+    def __init__(self):
+        self.acks = []
+
+    def ack(self, mid, qos):
+        self.acks.append(mid)
+
+
+def test_pubacks_saem_na_ordem_de_chegada():
+    client = ClienteAck()
+    confirmacoes = ConfirmacoesMqtt(client)
+    primeira, segunda, terceira = (confirmacoes.registrar(mid, 1) for mid in (1, 2, 3))
+    confirmacoes.registrar(4, 0)()  # QoS 0: não há PUBACK
+
+    terceira()
+    segunda()
+    assert client.acks == []
+    primeira()
+    assert client.acks == [1, 2, 3]
+    assert confirmacoes.pendentes == 0
+
+
+def test_confirmacao_so_depois_do_ultimo_estagio_ou_de_quem_a_assume():
+    client = ClienteAck()
+    confirmacoes = ConfirmacoesMqtt(client)
+    guardadas = []
+
+    def persistir(item, confirmar):
+        guardadas.append(confirmar)
+
+    pipeline = Pipeline([
+        Estagio("validar", lambda x: None if x == "descartar" else x),
+        Estagio("persistir", persistir, repassa_confirmacao=True),
+    ])
+    pipeline.iniciar()
+    for mid, item in enumerate(["gravar", "descartar"], start=1):
+        pipeline.enviar(item, confirmar=confirmacoes.registrar(mid, 1))
+    pipeline.parar()
+
+    # O descartado já terminou, mas o PUBACK espera o anterior (ainda não gravado)
+    assert client.acks == []
+    guardadas[0]()
+    assert client.acks == [1, 2]
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import relogio_beacon  # noqa: E402
+from carregador import Carregador  # noqa: E402
+from codec import codificar, decodificar  # noqa: E402
+from lamport_clock import LamportClock  # noqa: E402
+from relogio_beacon import TOPICO_BEACON, BeaconRelogio  # noqa: E402
+from transporte import MensagemLocal  # noqa: E402
+
+
+class ClienteFalso:
+    def __init__(self):
+        self.publicadas = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.publicadas.append((topic, decodificar(payload), retain))
+
+
+def _esperar(condicao, timeout=2):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            pytest.fail("condição não atingida a tempo")
+        time.sleep(0.01)
+
+
+def test_beacon_retido_so_quando_o_relogio_muda():
+    client = ClienteFalso()
+    clock = LamportClock()
+    beacon = BeaconRelogio(client, clock, "billing-0", intervalo=0.01)
+    beacon.iniciar()
+    try:
+        _esperar(lambda: len(client.publicadas) == 1)
+        time.sleep(0.05)
+        assert client.publicadas == [(TOPICO_BEACON, {"origem": "billing-0", "timestamp": 0}, True)]
+
+        clock.receive_event(41)
+        _esperar(lambda: len(client.publicadas) == 2)
+        assert client.publicadas[-1][1]["timestamp"] == 42
+    finally:
+        beacon.parar()
+
+
+def test_carregador_no_modo_beacon_escuta_so_o_beacon():
+    if relogio_beacon.MODO_SINCRONIA != "beacon":
+        pytest.skip("CLOCK_SYNC_MODE diferente de 'beacon'")
+    carregador = Carregador("CP1", client=ClienteFalso(), verbose=False)
+    assert carregador.topic_relogio == TOPICO_BEACON
+
+    carregador.on_message(None, None, MensagemLocal(TOPICO_BEACON, codificar({"origem": "billing-0", "timestamp": 100}), 0, True))
+    assert carregador.clock.get_time() == 101
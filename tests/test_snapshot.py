@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api.estado_carregadores import TabelaCarregadores  # noqa: E402
+from api.eventos_store import EventoStore  # noqa: E402
+from api.snapshot import SnapshotEstado, escolher_codificacao, etag_corresponde  # noqa: E402
+
+
+def _status(carregador_id, status="livre"):
+    return {"carregador": carregador_id, "status": status, "carro_conectado": None, "energia_consumida_kWh": 0.0, "timestamp": 1}
+
+
+@pytest.fixture
+def snapshot():
+    carregadores = TabelaCarregadores()
+    snapshot = SnapshotEstado(carregadores, EventoStore(capacidade=100), historico=3)
+    for carregador_id in ("CP1", "CP2"):
+        carregadores[carregador_id] = _status(carregador_id)
+        snapshot.registrar_status(carregador_id)
+    return snapshot
+
+
+def test_serializado_uma_vez_por_versao(snapshot):
+    corpo, etag = asyncio.run(snapshot.serializado())
+    assert json.loads(corpo) == {"versao": 2, "instancia": snapshot.instancia, "carregadores": {"CP1": _status("CP1"), "CP2": _status("CP2")}, "eventos": []}
+    assert etag == snapshot.etag()
+    assert asyncio.run(snapshot.serializado())[0] is corpo
+
+    evento = {"acao": "inicio_carga", "carregador": "CP1"}
+    snapshot.eventos_store.adicionar(evento)
+    snapshot.registrar_evento(evento)
+    novo, novo_etag = asyncio.run(snapshot.serializado())
+    assert novo_etag != etag
+    assert json.loads(novo)["eventos"] == [evento]
+
+
+def test_etag_e_corpo_por_codificacao(snapshot):
+    bruto, etag = asyncio.run(snapshot.serializado())
+    comprimido, etag_gzip = asyncio.run(snapshot.serializado("gzip"))
+    assert gzip.decompress(comprimido) == bruto
+    assert etag_gzip != etag and etag_gzip.endswith('-gz"')
+
+
+def test_mudancas_desde_uma_versao_conhecida(snapshot):
+    snapshot.carregadores["CP1"] = _status("CP1", "ocupado")
+    snapshot.registrar_status("CP1")
+    snapshot.registrar_evento({"acao": "inicio_carga"})
+
+    mudancas = snapshot.mudancas_desde(2)
+    assert mudancas == {"versao": 4, "instancia": snapshot.instancia, "carregadores": {"CP1": _status("CP1", "ocupado")}, "eventos": [{"acao": "inicio_carga"}]}
+    assert snapshot.mudancas_desde(4)["carregadores"] == {}
+
+
+def test_versao_fora_do_historico_pede_o_snapshot_completo(snapshot):
+    for _ in range(3):
+        snapshot.registrar_status("CP1")
+    assert snapshot.mudancas_desde(1) is None  # histórico de 3 mudanças
+    assert snapshot.mudancas_desde(99) is None
+    snapshot.reiniciar()
+    assert snapshot.mudancas_desde(snapshot.versao - 1) is None
+
+
+@pytest.mark.parametrize("cabecalho, casa", [
+    ('"abc-2"', True),
+    ('W/"abc-2"', True),
+    ('"x", "abc-2"', True),
+    ("*", True),
+    ('"abc-1"', False),
+    ("", False),
+    (None, False),
+])
+def test_etag_corresponde(cabecalho, casa):
+    assert etag_corresponde(cabecalho, '"abc-2"') is casa
+
+
+def test_escolher_codificacao():
+    assert escolher_codificacao("gzip, deflate") == "gzip"
+    assert escolher_codificacao(None) == "identity"
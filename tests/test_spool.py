@@ -0,0 +1,98 @@
+import os
+import sys
+
+from paho.mqtt import client as mqtt_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import spool  # noqa: E402
+from spool import PublicadorConfiavel, SpoolEventos  # noqa: E402
+from transporte import InfoPublicacao  # noqa: E402
+
+
+class ClienteFalso:
+    """Cliente sem conexão: publish devolve NO_CONN, como o paho desconectado."""
+
+    def __init__(self, rc=mqtt_client.MQTT_ERR_NO_CONN):
+        self.rc = rc
+        self.publicadas = []
+        self.on_publish = None
+
+    def max_inflight_messages_set(self, valor):
+        pass
+
+    def max_queued_messages_set(self, valor):
+        pass
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.publicadas.append((topic, payload))
+        return InfoPublicacao(self.rc, len(self.publicadas))
+
+
+def test_pendentes_sobrevivem_ao_reinicio_em_ordem_de_lamport(tmp_path):
+    caminho = str(tmp_path / "cp1.spool")
+    primeiro = SpoolEventos(caminho)
+    seqs = [primeiro.adicionar("carregadores/CP1/eventos", f"e{t}".encode(), t) for t in (30, 10, 20)]
+    primeiro.confirmar(seqs[1])
+    primeiro.fechar()
+
+    segundo = SpoolEventos(caminho)
+    assert [(topico, payload, t) for _, topico, payload, t in segundo.pendentes()] == [
+        ("carregadores/CP1/eventos", b"e20", 20),
+        ("carregadores/CP1/eventos", b"e30", 30),
+    ]
+    # A sequência continua de onde parou
+    assert segundo.adicionar("carregadores/CP1/eventos", b"e40", 40) == 3
+    segundo.fechar()
+
+
+def test_registro_truncado_por_queda_e_ignorado(tmp_path):
+    caminho = str(tmp_path / "cp1.spool")
+    spool_eventos = SpoolEventos(caminho)
+    spool_eventos.adicionar("t", b"completo", 1)
+    spool_eventos.adicionar("t", b"cortado", 2)
+    spool_eventos.fechar()
+    with open(caminho, "r+b") as arquivo:
+        arquivo.truncate(os.path.getsize(caminho) - 3)
+
+    recuperado = SpoolEventos(caminho)
+    assert [payload for _, _, payload, _ in recuperado.pendentes()] == [b"completo"]
+    recuperado.fechar()
+
+
+def test_limite_descarta_o_mais_antigo(tmp_path):
+    spool_eventos = SpoolEventos(str(tmp_path / "cp1.spool"), max_eventos=2)
+    for t in (1, 2, 3):
+        spool_eventos.adicionar("t", b"x", t)
+    assert [t for _, _, _, t in spool_eventos.pendentes()] == [2, 3]
+    spool_eventos.fechar()
+
+
+def test_compactacao_reescreve_so_os_pendentes(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, "SPOOL_COMPACTAR", 2)
+    caminho = str(tmp_path / "cp1.spool")
+    spool_eventos = SpoolEventos(caminho)
+    seqs = [spool_eventos.adicionar("t", b"x" * 100, t) for t in (1, 2, 3)]
+    spool_eventos.confirmar(seqs[0])
+    spool_eventos.confirmar(seqs[1])
+    spool_eventos.fechar()
+    assert os.path.getsize(caminho) < 150
+    assert len(SpoolEventos(caminho)) == 1
+
+
+def test_publicador_reenvia_na_conexao_so_o_que_o_paho_nao_tem(tmp_path):
+    caminho = str(tmp_path / "cp1.spool")
+    anterior = SpoolEventos(caminho)
+    anterior.adicionar("carregadores/CP1/eventos", b"da-execucao-anterior", 1)
+    anterior.fechar()
+
+    client = ClienteFalso()
+    publicador = PublicadorConfiavel(client, SpoolEventos(caminho))
+    publicador.publicar("carregadores/CP1/eventos", b"novo", 2)  # fica com o paho até conectar
+    publicador.ao_conectar()
+    assert [payload for _, payload in client.publicadas] == [b"novo", b"da-execucao-anterior"]
+
+    # PUBACKs: o spool esvazia
+    for mid in (1, 2):
+        publicador.on_publish(client, None, mid)
+    assert len(publicador.spool) == 0
+    publicador.fechar()
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from api import supervisor  # noqa: E402
+from api.supervisor import Supervisor  # noqa: E402
+
+ESPERA = 10
+
+
+def _python(codigo):
+    return [sys.executable, "-c", codigo]
+
+
+DORMINDO = _python("import time; time.sleep(30)")
+
+
+async def _encerrar(sup, worker):
+    # Sem a tarefa de vigia ninguém recolheria um processo vivo na parada
+    if worker.processo is not None and worker.processo.poll() is None:
+        worker.processo.kill()
+        worker.processo.wait(ESPERA)
+    await sup.parar([worker.nome])
+
+
+async def _esperar(condicao, timeout=ESPERA):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        assert time.monotonic() < limite, "condição não atingida a tempo"
+        await asyncio.sleep(0.01)
+
+
+def test_inicios_concorrentes_criam_um_processo_so(monkeypatch):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_INTERVALO", 0.01)
+
+    async def cenario():
+        sup = Supervisor()
+        sup.iniciar()
+        try:
+            workers = await asyncio.gather(*(sup.iniciar_worker("CP1", DORMINDO, tipo="carregador") for _ in range(3)))
+            assert len({id(w) for w in workers}) == 1
+            assert workers[0].estado == "executando" and workers[0].pid is not None
+            assert sup.nomes("carregador") == ["CP1"]
+            processo = workers[0].processo
+            assert await sup.parar(["CP1"], timeout=ESPERA) == ["CP1"]
+            assert processo.poll() is not None
+            assert sup.workers == {}
+        finally:
+            await sup.fechar()
+
+    asyncio.run(cenario())
+
+
+def test_queda_reinicia_com_backoff_exponencial(monkeypatch):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_BACKOFF_INICIAL", 1.0)
+
+    async def cenario():
+        sup = Supervisor()
+        worker = await sup.iniciar_worker("billing-1", _python("raise SystemExit(3)"), tipo="billing")
+        try:
+            worker.processo.wait(ESPERA)
+            agora = worker.iniciado_em + 1
+            sup._verificar(worker, agora)
+            assert (worker.estado, worker.ultimo_codigo) == ("reiniciando", 3)
+            assert worker.proximo_inicio == agora + 1.0 and worker.backoff == 2.0
+            assert sup.ativo("billing-1")
+
+            sup._verificar(worker, agora + 0.5)
+            assert worker.estado == "reiniciando"
+            sup._verificar(worker, agora + 1.0)
+            assert (worker.estado, worker.reinicios) == ("executando", 1)
+
+            # Caiu de novo logo em seguida: espera o dobro
+            worker.processo.wait(ESPERA)
+            sup._verificar(worker, worker.iniciado_em + 1)
+            assert worker.proximo_inicio == worker.iniciado_em + 1 + 2.0 and worker.backoff == 4.0
+        finally:
+            await _encerrar(sup, worker)
+
+    asyncio.run(cenario())
+
+
+def test_worker_estavel_volta_ao_backoff_inicial(monkeypatch):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_BACKOFF_INICIAL", 1.0)
+
+    async def cenario():
+        sup = Supervisor()
+        worker = await sup.iniciar_worker("billing-1", _python("pass"), tipo="billing")
+        worker.processo.wait(ESPERA)
+        worker.backoff = 32.0
+        sup._verificar(worker, worker.iniciado_em + supervisor.SUPERVISOR_ESTAVEL_APOS)
+        assert worker.proximo_inicio - worker.iniciado_em - supervisor.SUPERVISOR_ESTAVEL_APOS == 1.0
+        await _encerrar(sup, worker)
+
+    asyncio.run(cenario())
+
+
+def test_parada_manda_sigkill_a_quem_ignora_o_sigterm(monkeypatch, tmp_path):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_INTERVALO", 0.01)
+    pronto = tmp_path / "pronto"
+    teimoso = _python(f"import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); open({str(pronto)!r}, 'w').close(); time.sleep(30)")
+
+    async def cenario():
+        sup = Supervisor()
+        sup.iniciar()
+        try:
+            worker = await sup.iniciar_worker("CP1", teimoso)
+            await _esperar(pronto.exists)
+            inicio = time.monotonic()
+            assert await sup.parar(["CP1"], timeout=0.2) == ["CP1"]
+            assert time.monotonic() - inicio >= 0.2
+            assert worker.estado == "parado" and worker.ultimo_codigo == -9
+        finally:
+            await sup.fechar()
+
+    asyncio.run(cenario())
+
+
+def test_parada_durante_o_inicio_espera_o_processo_existir(monkeypatch):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_INTERVALO", 0.01)
+
+    async def cenario():
+        sup = Supervisor()
+        sup.iniciar()
+        try:
+            inicio = asyncio.create_task(sup.iniciar_worker("CP1", DORMINDO))
+            await asyncio.sleep(0)
+            assert sup.workers["CP1"].estado == "iniciando"
+            assert await sup.parar(["CP1"], timeout=ESPERA) == ["CP1"]
+            worker = await inicio
+            assert worker.estado == "parado" and worker.processo.poll() is not None
+            assert not sup.ativo("CP1")
+        finally:
+            await sup.fechar()
+
+    asyncio.run(cenario())
+
+
+def test_status_offline_tira_a_vivacidade_e_pode_reiniciar(monkeypatch):
+    monkeypatch.setattr(supervisor, "SUPERVISOR_OFFLINE_REINICIO", 30)
+
+    async def cenario():
+        sup = Supervisor()
+        worker = await sup.iniciar_worker("CP1", DORMINDO, tipo="carregador")
+        try:
+            agora = worker.iniciado_em
+            sup.registrar_status("CP1", "livre", agora)
+            assert sup.resumo()[0]["vivo"]
+            sup.registrar_status("CP1", "offline", agora + 1)
+            assert not sup.resumo()[0]["vivo"]
+
+            sup._verificar(worker, agora + 20)
+            assert worker.processo.poll() is None
+            sup._verificar(worker, agora + 32)
+            assert worker.processo.wait(ESPERA) == -9
+            sup._verificar(worker, agora + 33)
+            assert worker.estado == "reiniciando"
+        finally:
+            await _encerrar(sup, worker)
+
+    asyncio.run(cenario())
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("psycopg2")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+import tarifas  # noqa: E402
+from tarifas import DIA, SEMANA, Tarifa, _Indice, compilar, intervalos_consumo, segundo_da_semana  # noqa: E402
+
+HORA = 3600
+# 1970-01-05 00:00 UTC foi uma segunda
+SEGUNDA = 4 * DIA
+
+
+def _preco(limites, precos, segundo):
+    return next(p for limite, p in reversed(list(zip(limites, precos))) if limite <= segundo)
+
+
+def test_sem_janelas_um_preco_so():
+    assert compilar(0.75, []) == ([0], [0.75])
+
+
+def test_janela_que_atravessa_a_meia_noite():
+    # Terça 22h até quarta 6h
+    limites, precos = compilar(1.0, [(1, 22 * HORA, 6 * HORA, 0.5)])
+    assert limites == [0, DIA + 22 * HORA, 2 * DIA + 6 * HORA]
+    assert precos == [1.0, 0.5, 1.0]
+
+
+def test_domingo_a_noite_continua_na_segunda():
+    limites, precos = compilar(1.0, [(6, 23 * HORA, 2 * HORA, 0.5)])
+    assert limites == [0, 2 * HORA, 6 * DIA + 23 * HORA]
+    assert precos == [0.5, 1.0, 0.5]
+
+
+def test_fim_zero_vai_ate_a_meia_noite():
+    limites, precos = compilar(1.0, [(0, 18 * HORA, 0, 2.0)])
+    assert (limites, precos) == ([0, 18 * HORA, DIA], [1.0, 2.0, 1.0])
+
+
+def test_ultima_janela_tem_prioridade_e_trechos_iguais_se_juntam():
+    janelas = [(0, 8 * HORA, 20 * HORA, 2.0), (0, 12 * HORA, 14 * HORA, 3.0), (0, 20 * HORA, 22 * HORA, 2.0)]
+    limites, precos = compilar(1.0, janelas)
+    assert limites == [0, 8 * HORA, 12 * HORA, 14 * HORA, 22 * HORA]
+    assert precos == [1.0, 2.0, 3.0, 2.0, 1.0]
+    for segundo in range(0, SEMANA, 1800):
+        esperado = 1.0
+        for dia, inicio, fim, preco in janelas:
+            if dia * DIA + inicio <= segundo < dia * DIA + fim:
+                esperado = preco
+        assert _preco(limites, precos, segundo) == esperado
+
+
+def test_preco_no_horario_local_do_fuso():
+    tarifa = Tarifa(1, "ponta", 1.0, [(0, 18 * HORA, 21 * HORA, 2.0)], fuso="America/Sao_Paulo")
+    # Segunda 18h em São Paulo (UTC-3) = 21h UTC
+    assert segundo_da_semana(SEGUNDA + 21 * HORA, "America/Sao_Paulo") == 18 * HORA
+    assert tarifa.preco_em(SEGUNDA + 21 * HORA) == 2.0
+    assert tarifa.preco_em(SEGUNDA + 18 * HORA) == 1.0
+    assert tarifa.preco_em(SEGUNDA + SEMANA + 23 * HORA) == 2.0  # 20h local, semana seguinte
+
+
+def test_intervalos_consumo_somam_a_energia_cobrada():
+    perfil = [(100, 1.0), (200, 3.0), (300, 2.5), (400, 9.0)]
+    intervalos = intervalos_consumo(perfil, 5.0, 500)
+    # O acumulado nunca decresce nem passa do total
+    assert intervalos == [(100, 1.0), (150.0, 2.0), (350.0, 2.0)]
+    assert sum(energia for _, energia in intervalos) == 5.0
+    assert intervalos_consumo([], 2.0, 50) == [(50, 2.0)]
+
+
+def test_indice_resolve_carregador_depois_o_maior_prefixo():
+    padrao, sp, zona_sul, especial = (Tarifa(i, str(i), 1.0) for i in range(4))
+    indice = _Indice(padrao, {"SP-ZS-07": especial}, {"SP-": sp, "SP-ZS-": zona_sul})
+    assert indice.tarifa("SP-ZS-07") is especial
+    assert indice.tarifa("SP-ZS-01") is zona_sul
+    assert indice.tarifa("SP-CENTRO-01") is sp
+    assert indice.tarifa("RJ-01") is padrao
+    assert indice.tarifa(None) is padrao
+
+
+def test_custos_lote_sem_numpy_igual_ao_custo_de_cada_sessao(monkeypatch):
+    monkeypatch.setattr(tarifas, "numpy", None)
+    motor = tarifas.MotorTarifas("postgresql://teste")
+    ponta = Tarifa(1, "ponta", 1.0, [(0, 18 * HORA, 21 * HORA, 2.0)])
+    motor._indice = _Indice(Tarifa(0, "padrao", 0.5), por_local={"CP": ponta})
+    sessoes = [("CP1", [(SEGUNDA + 19 * HORA, 2.0), (SEGUNDA + 22 * HORA, 1.0)]), ("X1", [(SEGUNDA, 4.0)]), ("CP2", [])]
+
+    assert [custo for custo, _ in motor.custos_lote(sessoes)] == [5.0, 2.0, 0.0]
+    assert motor.custo("CP1", sessoes[0][1]) == (5.0, ponta)
@@ -0,0 +1,296 @@
+import os
+import queue
+import socket
+import struct
+import sys
+import time
+
+import pytest
+from paho.mqtt import client as mqtt_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from backend import transporte  # noqa: E402
+from backend.transporte import BrokerLocal, ClienteLocal, ServidorMqtt  # noqa: E402
+
+ESPERA = 5
+
+
+class Coletor:
+    """Guarda as mensagens recebidas por um cliente (local ou paho)."""
+
+    def __init__(self, client):
+        self.mensagens = queue.Queue()
+        self.conexoes = queue.Queue()
+        client.on_message = lambda c, u, msg: self.mensagens.put((msg.topic, bytes(msg.payload), msg.retain))
+        client.on_connect = lambda c, u, flags, rc: self.conexoes.put((flags, rc))
+
+    def receber(self, timeout=ESPERA):
+        return self.mensagens.get(timeout=timeout)
+
+    def conectado(self, timeout=ESPERA):
+        return self.conexoes.get(timeout=timeout)
+
+    def vazio(self, espera=0.2):
+        try:
+            self.mensagens.get(timeout=espera)
+        except queue.Empty:
+            return True
+        return False
+
+
+@pytest.fixture
+def broker():
+    return BrokerLocal()
+
+
+@pytest.fixture
+def clientes(broker):
+    criados = []
+
+    def criar(client_id, clean_session=True, will=None):
+        client = ClienteLocal(client_id, clean_session, broker)
+        coletor = Coletor(client)
+        if will is not None:
+            client.will_set(*will)
+        client.connect()
+        client.loop_start()
+        coletor.conectado()
+        criados.append(client)
+        return client, coletor
+
+    yield criar
+    for client in criados:
+        client.disconnect()
+        client.loop_stop()
+
+
+@pytest.fixture
+def servidor(broker):
+    servidor = ServidorMqtt(broker, host="127.0.0.1", porta=0)
+    servidor.iniciar()
+    yield servidor
+    servidor.parar()
+
+
+@pytest.fixture
+def paho(servidor):
+    criados = []
+
+    def criar(client_id, clean_session=True):
+        client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION1, client_id=client_id, clean_session=clean_session)
+        coletor = Coletor(client)
+        client.connect("127.0.0.1", servidor.porta)
+        client.loop_start()
+        coletor.conectado()
+        criados.append(client)
+        return client, coletor
+
+    yield criar
+    for client in criados:
+        client.disconnect()
+        client.loop_stop()
+
+
+@pytest.mark.parametrize("filtro, topico, casa", [
+    ("carregadores/+/status", "carregadores/CP1/status", True),
+    ("carregadores/+/status", "carregadores/CP1/eventos", False),
+    ("carregadores/#", "carregadores/CP1/status", True),
+    ("carregadores/#", "carregadores", True),
+    ("#", "billing/transacoes", True),
+    ("#", "$SYS/broker/uptime", False),
+    ("+/broker/uptime", "$SYS/broker/uptime", False),
+    ("$SYS/#", "$SYS/broker/uptime", True),
+])
+def test_curingas_e_topicos_de_sistema(clientes, filtro, topico, casa):
+    assinante, recebidas = clientes("assinante")
+    publicador, _ = clientes("publicador")
+    assinante.subscribe(filtro, 0)
+    publicador.publish(topico, b"x")
+    if casa:
+        assert recebidas.receber()[0] == topico
+    else:
+        assert recebidas.vazio()
+
+
+def test_retida_entregue_a_novo_assinante_e_limpa_com_payload_vazio(clientes):
+    publicador, _ = clientes("publicador")
+    publicador.publish("carregadores/CP1/status", b"livre", retain=True)
+
+    primeiro, recebidas = clientes("primeiro")
+    primeiro.subscribe("carregadores/+/status", 0)
+    assert recebidas.receber() == ("carregadores/CP1/status", b"livre", True)
+
+    publicador.publish("carregadores/CP1/status", b"", retain=True)
+    # Os assinantes atuais recebem o payload vazio como mensagem comum
+    assert recebidas.receber() == ("carregadores/CP1/status", b"", False)
+
+    segundo, recebidas_segundo = clientes("segundo")
+    segundo.subscribe("carregadores/+/status", 0)
+    assert recebidas_segundo.vazio()
+
+
+def test_lwt_publicado_so_na_queda(clientes):
+    observador, recebidas = clientes("observador")
+    observador.subscribe("carregadores/+/status", 1)
+
+    educado, _ = clientes("educado", will=("carregadores/A/status", b"offline", 1, False))
+    educado.disconnect()
+    assert recebidas.vazio()
+
+    caido, _ = clientes("caido", will=("carregadores/B/status", b"offline", 1, False))
+    caido.encerrar_abruptamente()
+    assert recebidas.receber() == ("carregadores/B/status", b"offline", False)
+
+
+def test_sessao_persistente_recebe_qos1_publicado_enquanto_desconectada(broker, clientes):
+    assinante, _ = clientes("billing", clean_session=False)
+    assinante.subscribe("carregadores/+/eventos", 1)
+    assinante.disconnect()
+    assinante.loop_stop()
+
+    publicador, _ = clientes("publicador")
+    publicador.publish("carregadores/CP1/eventos", b"qos1", qos=1)
+    publicador.publish("carregadores/CP1/eventos", b"qos0", qos=0)
+
+    reconectado = ClienteLocal("billing", False, broker)
+    recebidas = Coletor(reconectado)
+    reconectado.connect()
+    reconectado.loop_start()
+    try:
+        flags, _ = recebidas.conectado()
+        assert flags["session present"] == 1
+        assert recebidas.receber() == ("carregadores/CP1/eventos", b"qos1", False)
+        assert recebidas.vazio()
+    finally:
+        reconectado.disconnect()
+        reconectado.loop_stop()
+
+
+def test_subscricao_compartilhada_em_rodizio(clientes):
+    membros = [clientes(f"billing-{i}") for i in range(2)]
+    for client, _ in membros:
+        client.subscribe("$share/billing/carregadores/+/eventos", 1)
+    publicador, _ = clientes("publicador")
+    for i in range(4):
+        publicador.publish(f"carregadores/CP{i}/eventos", b"x", qos=1)
+
+    recebidas = []
+    for _, coletor in membros:
+        recebidas.append([coletor.receber()[0] for _ in range(2)])
+        assert coletor.vazio()
+    assert sorted(recebidas[0] + recebidas[1]) == [f"carregadores/CP{i}/eventos" for i in range(4)]
+
+
+def test_filtros_sobrepostos_entregam_uma_vez_com_o_maior_qos(broker):
+    entregues = []
+    broker.conectar("assinante", True, lambda *mensagem: entregues.append(mensagem))
+    broker.subscrever("assinante", "carregadores/#", 0)
+    broker.subscrever("assinante", "carregadores/+/eventos", 1)
+
+    broker.publicar("carregadores/CP1/eventos", b"x", qos=1)
+    assert entregues == [("carregadores/CP1/eventos", b"x", 1, False)]
+
+    broker.cancelar("assinante", "carregadores/+/eventos")
+    broker.publicar("carregadores/CP1/eventos", b"y", qos=1)
+    assert entregues[-1] == ("carregadores/CP1/eventos", b"y", 0, False)
+
+
+def test_publicacao_sem_conexao_sai_ao_conectar(broker, clientes):
+    observador, recebidas = clientes("observador")
+    observador.subscribe("carregadores/#", 1)
+    client = ClienteLocal("carregador", True, broker)
+    publicados = []
+    client.on_publish = lambda c, u, mid: publicados.append(mid)
+
+    info = client.publish("carregadores/CP1/status", "livre", qos=1)
+    assert info.rc == mqtt_client.MQTT_ERR_NO_CONN
+    assert recebidas.vazio()
+    client.connect()
+    client.loop_start()
+    try:
+        assert recebidas.receber() == ("carregadores/CP1/status", b"livre", False)
+    finally:
+        client.disconnect()
+        client.loop_stop()
+    assert publicados == [info.mid]
+
+
+def test_mesmo_client_id_derruba_a_conexao_anterior_sem_lwt(broker, clientes):
+    observador, recebidas = clientes("observador")
+    observador.subscribe("carregadores/+/status", 1)
+    antigo, _ = clientes("CP1", will=("carregadores/CP1/status", b"offline", 1, False))
+    quedas = []
+    antigo.on_disconnect = lambda c, u, rc: quedas.append(rc)
+
+    novo, _ = clientes("CP1")
+    novo.publish("carregadores/CP1/status", b"livre")
+    assert recebidas.receber() == ("carregadores/CP1/status", b"livre", False)
+    assert recebidas.vazio()
+    assert not antigo.is_connected() and novo.is_connected()
+    # O 'desconectado' da conexão substituída já passou pelo loop do antigo
+    antigo.loop_stop()
+    assert quedas == [7]
+
+
+@pytest.mark.parametrize("qos", [0, 1, 2])
+def test_paho_publica_e_recebe_pelo_servidor_tcp(paho, clientes, qos):
+    remoto, recebidas_remoto = paho("remoto")
+    remoto.subscribe("billing/transacoes", qos)
+    local, recebidas_local = clientes("local")
+    local.subscribe("carregadores/#", 1)
+    time.sleep(0.1)  # SUBACK do remoto
+
+    local.publish("billing/transacoes", b"t1", qos=1)
+    assert recebidas_remoto.receber() == ("billing/transacoes", b"t1", False)
+
+    remoto.publish("carregadores/CP1/status", b"s1", qos=qos).wait_for_publish(ESPERA)
+    assert recebidas_local.receber() == ("carregadores/CP1/status", b"s1", False)
+
+
+def test_paho_sessao_persistente_pelo_servidor_tcp(paho, clientes):
+    remoto, _ = paho("billing-remoto", clean_session=False)
+    remoto.subscribe("carregadores/+/eventos", 1)
+    time.sleep(0.1)
+    remoto.disconnect()
+    remoto.loop_stop()
+    time.sleep(0.1)
+
+    publicador, _ = clientes("publicador")
+    publicador.publish("carregadores/CP1/eventos", b"fim_carga", qos=1)
+
+    _, recebidas = paho("billing-remoto", clean_session=False)
+    assert recebidas.receber() == ("carregadores/CP1/eventos", b"fim_carga", False)
+
+
+def _connect(client_id, keepalive, will_topico, will_payload):
+    def texto(valor):
+        return struct.pack(">H", len(valor)) + valor
+
+    # MQTT 3.1.1, clean session + will QoS 1
+    corpo = texto(b"MQTT") + bytes([4, 0x02 | 0x04 | 0x08]) + struct.pack(">H", keepalive)
+    corpo += texto(client_id) + texto(will_topico) + texto(will_payload)
+    return bytes([0x10, len(corpo)]) + corpo
+
+
+def test_lwt_no_fim_do_keepalive_pelo_servidor_tcp(servidor, clientes):
+    observador, recebidas = clientes("observador")
+    observador.subscribe("carregadores/+/status", 1)
+
+    with socket.create_connection(("127.0.0.1", servidor.porta)) as sock:
+        sock.sendall(_connect(b"silencioso", 1, b"carregadores/CP9/status", b"offline"))
+        assert sock.recv(4) == bytes([0x20, 2, 0, 0])
+        # Sem PINGREQ: o servidor desiste depois de 1,5x o keepalive
+        assert recebidas.receber(timeout=ESPERA) == ("carregadores/CP9/status", b"offline", False)
+
+
+def test_porta_em_uso_gera_erro(broker):
+    with socket.socket() as ocupado:
+        ocupado.bind(("127.0.0.1", 0))
+        ocupado.listen()
+        with pytest.raises(OSError):
+            ServidorMqtt(broker, host="127.0.0.1", porta=ocupado.getsockname()[1]).iniciar()
+
+
+def test_criar_cliente_local(monkeypatch):
+    monkeypatch.setattr(transporte, "MQTT_TRANSPORTE", "local")
+    assert isinstance(transporte.criar_cliente("x"), ClienteLocal)